@@ -1,37 +1,183 @@
+import time
+_INICIO_PROCESSO = time.perf_counter()  # referência da medição de partida (ver launch_gui)
+
 import os
-import fdb
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
 import json
-import urllib.request
-import time
-import pickle
+import re
+import random
+import sqlite3
+import itertools
+import string
+import unicodedata
+import zlib
+import bisect
+import multiprocessing
+import queue
+import sys
+import threading
+from array import array
 from pathlib import Path
-from collections import deque
+from datetime import timedelta
+from collections import Counter, deque, namedtuple
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor, as_completed, wait
+
+# Driver do Firebird, urllib e NumPy só são importados no primeiro uso: a janela de
+# conexão não espera por eles, nem cada processo de análise que os dispensa.
+# NumPy é opcional: sem ele a validação em lote cai no laço em Python puro
+_np = None
+
+def _numpy():
+    global _np
+    if _np is None:
+        try:
+            import numpy
+        except ImportError:
+            numpy = False
+        _np = numpy
+    return _np or None
+
+# Cache de CNPJs consultados, em SQLite: cada resposta é um upsert de uma linha (nada
+# de regravar o arquivo inteiro), a validade é conferida na leitura e a poda apaga o
+# que venceu e, acima do limite de entradas, as mais antigas. O modo WAL com espera
+# por bloqueio permite duas instâncias do programa usando o mesmo arquivo
+CACHE_FILE = Path.home() / ".cache_cnpj.sqlite3"
+CACHE_FILE_ANTIGO = Path.home() / ".cache_cnpj.pkl"  # migrado uma vez para o SQLite
+CACHE_CNPJ_TTL = 2592000  # 30 dias
+# CNPJs que a API não encontrou ou respondeu com dados inválidos ficam numa tabela à
+# parte, por menos tempo (um CNPJ recém-aberto pode passar a constar), para que lotes
+# seguidos não gastem cota repetindo a mesma consulta perdida
+CACHE_CNPJ_TTL_NEGATIVO = int(os.getenv("CNPJ_CACHE_TTL_NEGATIVO", "86400"))  # 1 dia
+CACHE_CNPJ_MAX_ENTRADAS = int(os.getenv("CNPJ_CACHE_MAX_ENTRADAS", "100000"))
+CACHE_CNPJ_PODA_A_CADA = 500  # gravações entre duas podas
+
+class CacheCnpj:
+    def __init__(self, arquivo, ttl=CACHE_CNPJ_TTL, max_entradas=CACHE_CNPJ_MAX_ENTRADAS,
+                 ttl_negativo=CACHE_CNPJ_TTL_NEGATIVO):
+        self.arquivo = Path(arquivo)
+        self.ttl = ttl
+        self.ttl_negativo = ttl_negativo
+        self.max_entradas = max_entradas
+        self._lock = threading.Lock()  # uma conexão, usada pelas threads de consulta
+        self._gravacoes = 0
+        self.arquivo.parent.mkdir(parents=True, exist_ok=True)
+        self._con = sqlite3.connect(str(self.arquivo), timeout=30, isolation_level=None, check_same_thread=False)
+        self._con.execute("PRAGMA journal_mode=WAL")
+        self._con.execute("PRAGMA synchronous=NORMAL")
+        self._con.execute(
+            "CREATE TABLE IF NOT EXISTS CNPJ (CNPJ TEXT PRIMARY KEY, GRAVADO REAL NOT NULL, DADOS TEXT NOT NULL)"
+        )
+        self._con.execute("CREATE INDEX IF NOT EXISTS CNPJ_GRAVADO ON CNPJ (GRAVADO)")
+        self._con.execute(
+            "CREATE TABLE IF NOT EXISTS CNPJ_NEGATIVO (CNPJ TEXT PRIMARY KEY, GRAVADO REAL NOT NULL, MOTIVO TEXT NOT NULL)"
+        )
+
+    def obter(self, cnpj):
+        with self._lock:
+            linha = self._con.execute("SELECT GRAVADO, DADOS FROM CNPJ WHERE CNPJ = ?", (cnpj,)).fetchone()
+        if linha is None or time.time() - linha[0] >= self.ttl:
+            return None
+        return json.loads(linha[1])
+
+    def gravar(self, cnpj, dados, gravado=None):
+        with self._lock:
+            self._con.execute(
+                "INSERT INTO CNPJ (CNPJ, GRAVADO, DADOS) VALUES (?, ?, ?) "
+                "ON CONFLICT (CNPJ) DO UPDATE SET GRAVADO = excluded.GRAVADO, DADOS = excluded.DADOS",
+                (cnpj, time.time() if gravado is None else gravado, json.dumps(dados)),
+            )
+            self._con.execute("DELETE FROM CNPJ_NEGATIVO WHERE CNPJ = ?", (cnpj,))
+            self._gravacoes += 1
+            podar = self._gravacoes % CACHE_CNPJ_PODA_A_CADA == 0
+        if podar:
+            self.podar()
+
+    def obter_negativo(self, cnpj):
+        # Motivo gravado para um CNPJ sem dados na API, ou None
+        with self._lock:
+            linha = self._con.execute("SELECT GRAVADO, MOTIVO FROM CNPJ_NEGATIVO WHERE CNPJ = ?", (cnpj,)).fetchone()
+        if linha is None or time.time() - linha[0] >= self.ttl_negativo:
+            return None
+        return linha[1]
+
+    def gravar_negativo(self, cnpj, motivo):
+        with self._lock:
+            self._con.execute(
+                "INSERT INTO CNPJ_NEGATIVO (CNPJ, GRAVADO, MOTIVO) VALUES (?, ?, ?) "
+                "ON CONFLICT (CNPJ) DO UPDATE SET GRAVADO = excluded.GRAVADO, MOTIVO = excluded.MOTIVO",
+                (cnpj, time.time(), motivo),
+            )
 
-# Cache de CNPJs consultados (no início do arquivo, após imports)
-CACHE_FILE = Path.home() / ".cache_cnpj.pkl"
-_cache_cnpj = {}
+    def podar(self):
+        with self._lock:
+            self._con.execute("DELETE FROM CNPJ WHERE GRAVADO < ?", (time.time() - self.ttl,))
+            self._con.execute("DELETE FROM CNPJ_NEGATIVO WHERE GRAVADO < ?", (time.time() - self.ttl_negativo,))
+            excesso = self._con.execute("SELECT COUNT(*) FROM CNPJ").fetchone()[0] - self.max_entradas
+            if excesso > 0:
+                self._con.execute(
+                    "DELETE FROM CNPJ WHERE CNPJ IN (SELECT CNPJ FROM CNPJ ORDER BY GRAVADO LIMIT ?)", (excesso,)
+                )
 
-def _carregar_cache():
-    global _cache_cnpj
-    if CACHE_FILE.exists():
+    def migrar_pickle(self, arquivo):
+        import pickle
+        # Importa o cache antigo (dict cnpj -> {timestamp, data}) e renomeia o arquivo
+        arquivo = Path(arquivo)
+        if not arquivo.exists():
+            return 0
+        try:
+            with open(arquivo, "rb") as f:
+                antigo = pickle.load(f)
+            linhas = [
+                (cnpj, float(item["timestamp"]), json.dumps(item["data"]))
+                for cnpj, item in antigo.items()
+                if time.time() - float(item["timestamp"]) < self.ttl
+            ]
+        except Exception:
+            linhas = []
+        with self._lock:
+            # INSERT OR IGNORE: se outra instância já migrou ou gravou, o mais novo fica
+            self._con.execute("BEGIN IMMEDIATE")
+            try:
+                self._con.executemany("INSERT OR IGNORE INTO CNPJ (CNPJ, GRAVADO, DADOS) VALUES (?, ?, ?)", linhas)
+                self._con.execute("COMMIT")
+            except Exception:
+                self._con.execute("ROLLBACK")
+                raise
         try:
-            with open(CACHE_FILE, 'rb') as f:
-                _cache_cnpj = pickle.load(f)
-        except:
-            _cache_cnpj = {}
+            arquivo.replace(arquivo.with_name(arquivo.name + ".migrado"))
+        except OSError:
+            pass
+        return len(linhas)
 
-def _salvar_cache():
-    try:
-        CACHE_FILE.parent.mkdir(parents=True, exist_ok=True)
-        with open(CACHE_FILE, 'wb') as f:
-            pickle.dump(_cache_cnpj, f)
-    except:
-        pass
+    def fechar(self):
+        with self._lock:
+            self._con.close()
+
+_cache_cnpj = None
+_lock_cache_cnpj = threading.Lock()
+
+def cache_cnpj():
+    # Aberto no primeiro uso; o cache antigo em pickle é importado nessa hora
+    global _cache_cnpj
+    with _lock_cache_cnpj:
+        if _cache_cnpj is None:
+            cache = CacheCnpj(CACHE_FILE)
+            try:
+                cache.migrar_pickle(CACHE_FILE_ANTIGO)
+            except Exception:
+                pass
+            cache.podar()
+            _cache_cnpj = cache
+        return _cache_cnpj
 
-# Carregar cache ao iniciar
-_carregar_cache()
+def fechar_cache_cnpj():
+    global _cache_cnpj
+    with _lock_cache_cnpj:
+        if _cache_cnpj is not None:
+            _cache_cnpj.fechar()
+            _cache_cnpj = None
 
 def get_connection(
     host=os.getenv("FB_HOST", "localhost"),
@@ -40,81 +186,711 @@ def get_connection(
     password=os.getenv("FB_PASSWORD", "masterkey"),
     database=os.getenv("FB_DATABASE", r"C:\data\example.fdb"),
 ):
-    dsn = f"{host}/{port}:{database}" if host else database
+    import fdb
+
+    dsn = _montar_dsn(host, port, database)
     return fdb.connect(dsn=dsn, user=user, password=password)
 
-def fetch_people(con, filtro_nome=""):
-    cur = con.cursor()
+def _montar_dsn(host, port, database):
+    return f"{host}/{port}:{database}" if host else database
+
+def _fechar_conexao(con):
     try:
-        if filtro_nome:
-            cur.execute(
-                """
-                SELECT P.*, R.DESC_ROYALTIES AS ROYALTIES_DESCRICAO
-                FROM PESSOA P
-                LEFT JOIN PESAGEM_ROYALTIES R
-                       ON R.COD_ROYALTIES = P.ID_ROYALTIES
-                WHERE P.NOME CONTAINING ?
-                """,
-                (filtro_nome,),
-            )
-        else:
-            cur.execute(
-                """
-                SELECT P.*, R.DESC_ROYALTIES AS ROYALTIES_DESCRICAO
-                FROM PESSOA P
-                LEFT JOIN PESAGEM_ROYALTIES R
-                       ON R.COD_ROYALTIES = P.ID_ROYALTIES
-                """
-            )
-        columns = [desc[0] for desc in cur.description]
-        rows = cur.fetchall()
-        return columns, rows
+        con.close()
     except Exception:
         pass
 
+# Pool de conexões por DSN: evita o attach/detach no Firebird a cada ação da tela
+class PoolConexoes:
+    def __init__(self, tamanho_max=4, verificar_apos=30):
+        self.tamanho_max = tamanho_max
+        self.verificar_apos = verificar_apos  # segundos ociosa antes do health-check
+        self._livres = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.reconexoes = 0
+
+    def _conexao_ativa(self, con):
+        try:
+            cur = con.cursor()
+            cur.execute("SELECT 1 FROM RDB$DATABASE")
+            cur.fetchone()
+            return True
+        except Exception:
+            return False
+
+    def adquirir(self, host, port, user, password, database):
+        chave = (_montar_dsn(host, port, database), user, password)
+        while True:
+            with self._lock:
+                livres = self._livres.get(chave)
+                item = livres.pop() if livres else None
+            if item is None:
+                break
+            con, devolvida_em = item
+            if time.time() - devolvida_em < self.verificar_apos or self._conexao_ativa(con):
+                with self._lock:
+                    self.hits += 1
+                return chave, con
+            # Link caiu enquanto a conexão estava ociosa: descarta e tenta a próxima
+            with self._lock:
+                self.reconexoes += 1
+            _fechar_conexao(con)
+
+        con = get_connection(host, port, user, password, database)
+        with self._lock:
+            self.misses += 1
+        return chave, con
+
+    def devolver(self, chave, con, descartar=False):
+        if not descartar:
+            try:
+                # Encerra a transação de leitura para o próximo uso enxergar dados novos
+                con.rollback()
+            except Exception:
+                descartar = True
+        if not descartar:
+            with self._lock:
+                livres = self._livres.setdefault(chave, [])
+                if len(livres) < self.tamanho_max:
+                    livres.append((con, time.time()))
+                    return
+        _fechar_conexao(con)
+
+    @contextmanager
+    def conexao(self, host, port, user, password, database):
+        chave, con = self.adquirir(host, port, user, password, database)
+        try:
+            yield con
+        except Exception:
+            self.devolver(chave, con, descartar=not self._conexao_ativa(con))
+            raise
+        else:
+            self.devolver(chave, con)
+
+    def estatisticas(self):
+        with self._lock:
+            ociosas = sum(len(v) for v in self._livres.values())
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "reconexoes": self.reconexoes,
+                "ociosas": ociosas,
+            }
+
+    def fechar_todas(self):
+        with self._lock:
+            livres = [con for itens in self._livres.values() for con, _ in itens]
+            self._livres.clear()
+        for con in livres:
+            _fechar_conexao(con)
+
+_pool_conexoes = PoolConexoes(tamanho_max=int(os.getenv("FB_POOL_SIZE", "4")))
+
+# Estratégias de join com a tabela de royalties, na ordem em que são testadas
+def _estrategias_royalties():
+    yield ("PESAGEM_ROYALTIES", "DESC_ROYALTIES", "COD_ROYALTIES")
     tabelas_royaltie = ["ROYALTIES", "ROYALTIE", "CAD_ROYALTIES", "ROYALTY"]
     colunas_desc = ["DESCRICAO", "NOME", "DESCR", "DESCRICAO_ROYALTIES"]
-
     for tabela in tabelas_royaltie:
         for col_desc in colunas_desc:
+            yield (tabela, col_desc, "ID_ROYALTIES")
+    yield None  # sem royalties
+
+def _sql_pessoas(estrategia, filtro_nome="", apos_cod=None, limite=None, projecao=None, condicao=None):
+    primeiros = f"FIRST {int(limite)} " if limite else ""
+    campos = ", ".join(f"P.{c}" for c in projecao) if projecao else "P.*"
+    if estrategia:
+        tabela, col_desc, col_join = estrategia
+        sql = (
+            f"SELECT {primeiros}{campos}, R.{col_desc} AS ROYALTIES_DESCRICAO "
+            f"FROM PESSOA P LEFT JOIN {tabela} R ON R.{col_join} = P.ID_ROYALTIES"
+        )
+    else:
+        sql = f"SELECT {primeiros}{campos} FROM PESSOA P"
+
+    condicoes, params = [], []
+    if filtro_nome:
+        condicoes.append("P.NOME CONTAINING ?")
+        params.append(filtro_nome)
+    if apos_cod is not None:
+        condicoes.append("P.CODPESSOA > ?")
+        params.append(apos_cod)
+    if condicao:
+        condicoes.append(condicao[0])
+        params.extend(condicao[1])
+    if condicoes:
+        sql += " WHERE " + " AND ".join(condicoes)
+    if limite:
+        sql += " ORDER BY P.CODPESSOA"
+    return sql, params
+
+# Cache do esquema por DSN: guarda qual estratégia de royalties funcionou (ou nenhuma)
+ESQUEMA_CACHE_FILE = Path.home() / ".cache_esquema_cadastros.json"
+ESQUEMA_CACHE_TTL = 86400  # 1 dia; depois disso a base é sondada de novo
+_cache_esquema = None
+_lock_esquema = threading.Lock()
+
+def _obter_cache_esquema():
+    global _cache_esquema
+    if _cache_esquema is None:
+        try:
+            _cache_esquema = json.loads(ESQUEMA_CACHE_FILE.read_text(encoding="utf-8"))
+        except Exception:
+            _cache_esquema = {}
+    return _cache_esquema
+
+def _salvar_cache_esquema():
+    try:
+        ESQUEMA_CACHE_FILE.parent.mkdir(parents=True, exist_ok=True)
+        ESQUEMA_CACHE_FILE.write_text(json.dumps(_obter_cache_esquema()), encoding="utf-8")
+    except Exception:
+        pass
+
+def _estrategia_em_cache(dsn):
+    with _lock_esquema:
+        item = _obter_cache_esquema().get(dsn)
+    if not item or time.time() - item.get("timestamp", 0) > ESQUEMA_CACHE_TTL:
+        return False, None
+    estrategia = item.get("royalties")
+    return True, tuple(estrategia) if estrategia else None
+
+def _guardar_estrategia(dsn, estrategia):
+    with _lock_esquema:
+        _obter_cache_esquema()[dsn] = {"timestamp": time.time(), "royalties": estrategia}
+        _salvar_cache_esquema()
+
+def invalidar_cache_esquema(dsn=None):
+    with _lock_esquema:
+        cache = _obter_cache_esquema()
+        if dsn is None:
+            cache.clear()
+            _colunas_pessoa_por_dsn.clear()
+            _fonte_alteracoes_por_dsn.clear()
+        else:
+            cache.pop(dsn, None)
+            _colunas_pessoa_por_dsn.pop(dsn, None)
+            _fonte_alteracoes_por_dsn.pop(dsn, None)
+        _salvar_cache_esquema()
+
+# Metadados das colunas da PESSOA (nome -> tipo/tamanho), mantidos por DSN durante a sessão
+_colunas_pessoa_por_dsn = {}
+
+def colunas_pessoa(con, dsn=None):
+    if dsn:
+        with _lock_esquema:
+            colunas = _colunas_pessoa_por_dsn.get(dsn)
+        if colunas is not None:
+            return colunas
+
+    cur = con.cursor()
+    cur.execute(
+        """
+        SELECT TRIM(rf.RDB$FIELD_NAME), f.RDB$FIELD_TYPE,
+               COALESCE(f.RDB$CHARACTER_LENGTH, f.RDB$FIELD_LENGTH)
+        FROM RDB$RELATION_FIELDS rf
+        JOIN RDB$FIELDS f ON rf.RDB$FIELD_SOURCE = f.RDB$FIELD_NAME
+        WHERE rf.RDB$RELATION_NAME = 'PESSOA'
+        """
+    )
+    colunas = {nome: {"tipo": tipo, "tamanho": tamanho} for nome, tipo, tamanho in cur.fetchall()}
+    if dsn:
+        with _lock_esquema:
+            _colunas_pessoa_por_dsn[dsn] = colunas
+    return colunas
+
+def _executar_pessoas(cur, filtro_nome="", apos_cod=None, limite=None, dsn=None,
+                      projecao=None, com_royalties=True, condicao=None):
+    if not com_royalties:
+        sql, params = _sql_pessoas(None, filtro_nome, apos_cod, limite, projecao, condicao)
+        cur.execute(sql, params)
+        return [desc[0] for desc in cur.description]
+
+    if dsn:
+        encontrada, estrategia = _estrategia_em_cache(dsn)
+        if encontrada:
+            sql, params = _sql_pessoas(estrategia, filtro_nome, apos_cod, limite, projecao, condicao)
             try:
-                if filtro_nome:
-                    cur.execute(
-                        f"""
-                        SELECT P.*, R.{col_desc} AS ROYALTIES_DESCRICAO
-                        FROM PESSOA P
-                        LEFT JOIN {tabela} R ON R.ID_ROYALTIES = P.ID_ROYALTIES
-                        WHERE P.NOME CONTAINING ?
-                        """,
-                        (filtro_nome,),
-                    )
-                else:
-                    cur.execute(
-                        f"""
-                        SELECT P.*, R.{col_desc} AS ROYALTIES_DESCRICAO
-                        FROM PESSOA P
-                        LEFT JOIN {tabela} R ON R.ID_ROYALTIES = P.ID_ROYALTIES
-                        """
-                    )
-                columns = [desc[0] for desc in cur.description]
-                rows = cur.fetchall()
-                return columns, rows
+                cur.execute(sql, params)
+                return [desc[0] for desc in cur.description]
             except Exception:
-                continue
+                # Esquema mudou desde a última sondagem: descarta e sonda de novo
+                invalidar_cache_esquema(dsn)
 
-    if filtro_nome:
-        cur.execute("SELECT * FROM PESSOA WHERE NOME CONTAINING ?", (filtro_nome,))
+    for estrategia in _estrategias_royalties():
+        sql, params = _sql_pessoas(estrategia, filtro_nome, apos_cod, limite, projecao, condicao)
+        try:
+            cur.execute(sql, params)
+        except Exception:
+            if estrategia is None:
+                raise
+            continue
+        if dsn:
+            _guardar_estrategia(dsn, estrategia)
+        return [desc[0] for desc in cur.description]
+
+# Sincronização incremental: coluna de última alteração na PESSOA ou tabela de log
+# alimentada por trigger (CODPESSOA, DATA_HORA), nessa ordem de preferência
+COLUNAS_ULTIMA_ALTERACAO = (
+    "DATA_ALTERACAO", "DT_ALTERACAO", "DATAHORA_ALTERACAO",
+    "ULTIMA_ALTERACAO", "DATA_ULTIMA_ALTERACAO",
+)
+TABELA_LOG_ALTERACOES = os.getenv("PESSOA_LOG_ALTERACOES", "PESSOA_LOG_ALTERACAO")
+MARGEM_SINCRONIA = 60  # segundos relidos a cada sincronia, para transações longas
+_fonte_alteracoes_por_dsn = {}
+
+def fonte_alteracoes(con, dsn=None):
+    if dsn:
+        with _lock_esquema:
+            if dsn in _fonte_alteracoes_por_dsn:
+                return _fonte_alteracoes_por_dsn[dsn]
+
+    fonte = None
+    colunas = colunas_pessoa(con, dsn)
+    for coluna in COLUNAS_ULTIMA_ALTERACAO:
+        if coluna in colunas:
+            fonte = ("coluna", coluna)
+            break
     else:
-        cur.execute("SELECT * FROM PESSOA")
-    columns = [desc[0] for desc in cur.description]
+        cur = con.cursor()
+        cur.execute(
+            "SELECT 1 FROM RDB$RELATIONS WHERE RDB$RELATION_NAME = ?",
+            (TABELA_LOG_ALTERACOES,),
+        )
+        if cur.fetchone():
+            fonte = ("log", TABELA_LOG_ALTERACOES)
+
+    if dsn:
+        with _lock_esquema:
+            _fonte_alteracoes_por_dsn[dsn] = fonte
+    return fonte
+
+def _agora_servidor(con):
+    cur = con.cursor()
+    cur.execute("SELECT CURRENT_TIMESTAMP FROM RDB$DATABASE")
+    return cur.fetchone()[0]
+
+# Colunas usadas pelas abas de análise (Validação, Duplicados, Problemas, Relatórios, API)
+COLUNAS_ANALISE = (
+    "CODPESSOA", "NOME", "NOMEFANTASIA", "TIPO", "CPF", "CGC",
+    "EMAIL", "FONE1", "FONE2", "UF", "CEP", "SITUACAO", "CADASTRO_VALIDO",
+)
+
+def _projecao_pessoas(con, colunas, dsn=None):
+    # Mantém só as colunas que existem na PESSOA desta base; sem metadados, volta ao P.*
+    try:
+        existentes = colunas_pessoa(con, dsn)
+    except Exception:
+        return None
+    projecao = [c for c in colunas if c in existentes]
+    if "CODPESSOA" in existentes and "CODPESSOA" not in projecao:
+        projecao.insert(0, "CODPESSOA")
+    return projecao or None
+
+def _cursor_pessoas(con, filtro_nome="", dsn=None, colunas=None, condicao=None):
+    cur = con.cursor()
+    if colunas is None:
+        columns = _executar_pessoas(cur, filtro_nome, dsn=dsn, condicao=condicao)
+    else:
+        columns = _executar_pessoas(
+            cur, filtro_nome, dsn=dsn,
+            projecao=_projecao_pessoas(con, colunas, dsn),
+            com_royalties="ROYALTIES_DESCRICAO" in colunas,
+            condicao=condicao,
+        )
+    return cur, columns
+
+def fetch_people(con, filtro_nome="", dsn=None, colunas=None, condicao=None):
+    cur, columns = _cursor_pessoas(con, filtro_nome, dsn, colunas, condicao)
     rows = cur.fetchall()
     return columns, rows
 
-def _somente_digitos(valor):
-    return "".join(ch for ch in str(valor or "") if ch.isdigit())
+# Leitura em fluxo: as linhas chegam em lotes de fetchmany e não ficam todas em memória.
+# A conexão precisa continuar emprestada enquanto o gerador é consumido.
+TAMANHO_LOTE_LEITURA = int(os.getenv("PESSOAS_LOTE_LEITURA", "2000"))
 
-def validar_cpf(cpf):
-    cpf = _somente_digitos(cpf)
+def iter_people(con, filtro_nome="", dsn=None, colunas=None, condicao=None,
+                tamanho_lote=TAMANHO_LOTE_LEITURA):
+    cur, columns = _cursor_pessoas(con, filtro_nome, dsn, colunas, condicao)
+
+    def _linhas():
+        while True:
+            lote = cur.fetchmany(tamanho_lote)
+            if not lote:
+                break
+            yield from lote
+
+    return columns, _linhas()
+
+# Paginação por chave (CODPESSOA): custo de cada página independe do tamanho da tabela
+TAMANHO_PAGINA = int(os.getenv("PESSOAS_TAMANHO_PAGINA", "500"))
+
+def fetch_people_pagina(con, filtro_nome="", apos_cod=None, tamanho=TAMANHO_PAGINA, dsn=None):
+    cur = con.cursor()
+    columns = _executar_pessoas(cur, filtro_nome, apos_cod, tamanho, dsn=dsn)
+    rows = cur.fetchall()
+    ultimo_cod = rows[-1][columns.index("CODPESSOA")] if rows else apos_cod
+    return columns, rows, ultimo_cod, len(rows) < tamanho
+
+def _chave_cod(cod):
+    try:
+        return int(cod)
+    except (TypeError, ValueError):
+        return cod
+
+# Linhas alteradas durante a montagem da análise que ainda valem a pena reaplicar uma
+# a uma (cada uma custa ~0,6 ms); acima disso a análise é montada de novo
+REAPLICAR_MAX = 500
+
+# Retrato da PESSOA compartilhado pelas abas de análise; só é recarregado ou
+# corrigido quando a própria aplicação grava na base
+class DadosPessoas:
+    def __init__(self, colunas=COLUNAS_ANALISE):
+        self.colunas = colunas
+        # _lock guarda só o estado e é segurado por instantes, também pela thread do Tk.
+        # Leitura da tabela e montagem da análise rodam fora dele, sob _construcao, que
+        # só as threads de trabalho disputam
+        self._lock = threading.RLock()
+        self._construcao = threading.RLock()
+        self.dsn = None
+        self.columns = None
+        self.rows = None
+        self._pos_por_cod = {}
+        self.versao = 0
+        self.carregamentos = 0
+        self.sincronizado_em = None
+        self._documentos = None
+        self._analise = None
+        self._analise_versao = None
+        self._geracao = 0  # muda quando as posições das linhas deixam de valer
+        self._pendentes = None  # edições que chegam durante uma carga
+        self._tocadas = None  # posições editadas durante uma montagem
+
+    def carregado(self, dsn):
+        return self.rows is not None and self.dsn == dsn
+
+    def _definir(self, dsn, columns, rows):
+        self.dsn = dsn
+        self.columns = list(columns)
+        self.rows = list(rows)
+        i_cod = self.columns.index("CODPESSOA") if "CODPESSOA" in self.columns else None
+        self._pos_por_cod = (
+            {_chave_cod(r[i_cod]): pos for pos, r in enumerate(self.rows)} if i_cod is not None else {}
+        )
+        self._documentos = None
+        self._geracao += 1
+        self.versao += 1
+        self.carregamentos += 1
+
+    def obter(self, abrir_conexao, dsn, acompanhar=None):
+        with self._construcao:
+            while True:
+                with self._lock:
+                    if self.carregado(dsn):
+                        return self.columns, self.rows
+                    geracao = self._geracao
+                    self._pendentes = []
+                # Leitura em fluxo direto para o retrato: a tabela cruza a rede uma vez
+                # e todas as abas passam a usar a mesma cópia
+                try:
+                    with abrir_conexao() as con:
+                        sincronizado_em = _agora_servidor(con)
+                        columns, linhas = iter_people(con, "", dsn=dsn, colunas=self.colunas)
+                        rows = list(acompanhar(linhas) if acompanhar else linhas)
+                except BaseException:
+                    with self._lock:
+                        self._pendentes = None
+                    raise
+                with self._lock:
+                    pendentes, self._pendentes = self._pendentes, None
+                    if geracao != self._geracao:
+                        continue  # descartado durante a leitura (ex.: SQL livre): lê de novo
+                    self._definir(dsn, columns, rows)
+                    self.sincronizado_em = sincronizado_em
+                    # A leitura pode ter começado antes da gravação: as edições são reaplicadas
+                    for cod, campos in pendentes:
+                        pos = self._pos_por_cod.get(_chave_cod(cod))
+                        if pos is not None:
+                            self.rows[pos] = self._com_campos(self.rows[pos], campos)
+                    return self.columns, self.rows
+
+    def _congelar(self):
+        # Cópia rasa das linhas (tuplas) para montar estruturas derivadas fora do _lock;
+        # as posições editadas enquanto isso ficam anotadas em _tocadas
+        self._tocadas = set()
+        return self._geracao, self.columns, list(self.rows)
+
+    def _descongelar(self):
+        with self._lock:
+            self._tocadas = None
+
+    def obter_documentos(self, abrir_conexao, dsn, acompanhar=None):
+        # (colunas, linhas, documentos normalizados), consistentes entre si
+        with self._construcao:
+            while True:
+                self.obter(abrir_conexao, dsn, acompanhar)
+                with self._lock:
+                    if not self.carregado(dsn):
+                        continue
+                    if self._documentos is not None:
+                        return self.columns, self.rows, self._documentos
+                    geracao, columns, copia = self._congelar()
+                try:
+                    documentos = DocumentosNormalizados(columns, copia)
+                except BaseException:
+                    self._descongelar()
+                    raise
+                with self._lock:
+                    tocadas, self._tocadas = self._tocadas, None
+                    if geracao != self._geracao:
+                        continue
+                    for pos in sorted(p for p in tocadas if p < len(copia)):
+                        documentos.atualizar(pos, self.rows[pos])
+                    for nova in self.rows[len(copia):]:
+                        documentos.adicionar(nova)
+                    self._documentos = documentos
+                    return self.columns, self.rows, documentos
+
+    def analise(self, abrir_conexao, dsn, acompanhar=None, processos=1):
+        # Resultado do motor único, refeito só quando o retrato muda de versão. O motor
+        # roda sobre uma cópia; o que for editado enquanto isso é reaplicado antes da troca
+        with self._construcao:
+            while True:
+                self.obter_documentos(abrir_conexao, dsn, acompanhar)
+                with self._lock:
+                    if not self.carregado(dsn) or self._documentos is None:
+                        continue
+                    if self._analise_em_dia():
+                        return self._analise
+                    documentos = self._documentos.fatia(0, len(self.rows))
+                    geracao, columns, copia = self._congelar()
+                try:
+                    linhas = acompanhar(copia, len(copia)) if acompanhar else copia
+                    analise = AnaliseCadastros(columns, linhas, documentos, processos)
+                except BaseException:
+                    self._descongelar()
+                    raise
+                with self._lock:
+                    tocadas, self._tocadas = self._tocadas, None
+                    if geracao != self._geracao:
+                        continue
+                    if len(tocadas) + len(self.rows) - len(copia) > REAPLICAR_MAX:
+                        # Gravação em massa durante a montagem: recomeçar sai mais barato
+                        continue
+                    for pos in sorted(p for p in tocadas if p < len(copia)):
+                        analise.atualizar(pos, copia[pos], self.rows[pos])
+                    for nova in self.rows[len(copia):]:
+                        analise.adicionar(nova)
+                    self._analise = analise
+                    self._analise_versao = self.versao
+                    return analise
+
+    def sincronizar(self, abrir_conexao, dsn):
+        # Devolve (colunas, linhas alteradas, códigos removidos); None quando foi preciso recarregar tudo
+        with self._construcao:
+            with self._lock:
+                completo = not self.carregado(dsn) or "CODPESSOA" not in self.columns
+                if completo:
+                    self.invalidar()
+                desde = None if completo else self.sincronizado_em - timedelta(seconds=MARGEM_SINCRONIA)
+            if completo:
+                self.obter(abrir_conexao, dsn)
+                return None
+
+            with abrir_conexao() as con:
+                fonte = fonte_alteracoes(con, dsn)
+                if fonte is None:
+                    recarregar = True
+                else:
+                    recarregar = False
+                    agora = _agora_servidor(con)
+                    tipo, nome = fonte
+                    removidos = []
+                    if tipo == "coluna":
+                        columns, rows = fetch_people(
+                            con, "", dsn=dsn, colunas=self.colunas,
+                            condicao=(f"P.{nome} > ?", [desde]),
+                        )
+                        # A coluna não registra exclusões: confere a contagem da tabela (na
+                        # mesma transação) com o retrato mais os novos; se não bater, alguém
+                        # excluiu cadastros e o retrato é relido por completo
+                        cur = con.cursor()
+                        cur.execute("SELECT COUNT(*) FROM PESSOA")
+                        total = cur.fetchone()[0]
+                        i_cod = columns.index("CODPESSOA")
+                        with self._lock:
+                            esperado = None if self.rows is None else len(self.rows) + sum(
+                                1 for r in rows if _chave_cod(r[i_cod]) not in self._pos_por_cod
+                            )
+                        recarregar = total != esperado
+                    else:
+                        cur = con.cursor()
+                        cur.execute(f"SELECT DISTINCT CODPESSOA FROM {nome} WHERE DATA_HORA > ?", (desde,))
+                        cods = [r[0] for r in cur.fetchall()]
+                        columns, rows = self.columns, []
+                        # Firebird limita a 1500 itens por IN
+                        for i in range(0, len(cods), 1000):
+                            lote = cods[i:i + 1000]
+                            columns, parte = fetch_people(
+                                con, "", dsn=dsn, colunas=self.colunas,
+                                condicao=(f"P.CODPESSOA IN ({', '.join('?' * len(lote))})", lote),
+                            )
+                            rows.extend(parte)
+                        i_cod = columns.index("CODPESSOA")
+                        encontrados = {_chave_cod(r[i_cod]) for r in rows}
+                        removidos = [c for c in cods if _chave_cod(c) not in encontrados]
+
+            if recarregar:
+                self.invalidar()
+                self.obter(abrir_conexao, dsn)
+                return None
+
+            self.mesclar(columns, rows, removidos)
+            with self._lock:
+                self.sincronizado_em = agora
+            return columns, rows, removidos
+
+    def _analise_em_dia(self):
+        return self._analise is not None and self._analise_versao == self.versao
+
+    def _tocar(self, pos):
+        if self._tocadas is not None:
+            self._tocadas.add(pos)
+
+    def mesclar(self, columns, rows, removidos=()):
+        with self._lock:
+            if self.rows is None:
+                return
+            em_dia = self._analise_em_dia()
+            mapa = [columns.index(c) if c in columns else None for c in self.columns]
+            i_cod = self.columns.index("CODPESSOA")
+            for r in rows:
+                nova = tuple(r[j] if j is not None else None for j in mapa)
+                cod = _chave_cod(nova[i_cod])
+                pos = self._pos_por_cod.get(cod)
+                if pos is None:
+                    self._pos_por_cod[cod] = len(self.rows)
+                    self.rows.append(nova)
+                    if self._documentos is not None:
+                        self._documentos.adicionar(nova)
+                    if em_dia:
+                        self._analise.adicionar(nova)
+                else:
+                    antiga = self.rows[pos]
+                    self.rows[pos] = nova
+                    self._tocar(pos)
+                    if self._documentos is not None:
+                        self._documentos.atualizar(pos, nova)
+                    if em_dia:
+                        self._analise.atualizar(pos, antiga, nova)
+            if removidos:
+                removidos = {_chave_cod(c) for c in removidos}
+                self.rows = [r for r in self.rows if _chave_cod(r[i_cod]) not in removidos]
+                self._pos_por_cod = {_chave_cod(r[i_cod]): pos for pos, r in enumerate(self.rows)}
+                # As posições mudaram: documentos e análise são refeitos na próxima leitura
+                self._documentos = None
+                self._geracao += 1
+                em_dia = False
+            self.versao += 1
+            if em_dia:
+                self._analise_versao = self.versao
+
+    def invalidar(self):
+        with self._lock:
+            self.rows = None
+            self._pos_por_cod = {}
+            self._documentos = None
+            self._geracao += 1
+            self.versao += 1
+
+    def _com_campos(self, antiga, campos):
+        row = list(antiga)
+        for campo, valor in campos.items():
+            if campo in self.columns:
+                row[self.columns.index(campo)] = valor
+        return tuple(row)
+
+    def atualizar_linha(self, cod, campos):
+        # Devolve [(cod, problema ou None)] dos cadastros cujo problema mudou, quando a
+        # análise em cache pôde ser ajustada só para esta linha; senão None
+        with self._lock:
+            if self.rows is None:
+                if self._pendentes is not None:
+                    self._pendentes.append((cod, dict(campos)))
+                # Sem retrato, a versão ainda marca a base como alterada para quem guarda
+                # resultados lidos do servidor
+                self.versao += 1
+                return None
+            pos = self._pos_por_cod.get(_chave_cod(cod))
+            if pos is None:
+                # Registro fora do retrato (ex.: incluído por SQL): recarrega na próxima leitura
+                self.invalidar()
+                return None
+            antiga = self.rows[pos]
+            self.rows[pos] = self._com_campos(antiga, campos)
+            self._tocar(pos)
+            if self._documentos is not None:
+                self._documentos.atualizar(pos, self.rows[pos])
+            alterados = None
+            if self._analise_em_dia():
+                alterados = self._analise.atualizar(pos, antiga, self.rows[pos])
+            self.versao += 1
+            if alterados is not None:
+                self._analise_versao = self.versao
+            return alterados
+
+    def atualizar_linhas(self, alteracoes, tamanho_lote=1000):
+        # Gravações em massa ({cod: campos}), chamada da thread de trabalho: linhas e
+        # documentos são corrigidos em lotes curtos de _lock e a análise fica para ser
+        # refeita, o que sai mais barato que ajustá-la linha a linha
+        itens = list(alteracoes.items())
+        for inicio in range(0, len(itens), tamanho_lote):
+            with self._lock:
+                for cod, campos in itens[inicio:inicio + tamanho_lote]:
+                    if self.rows is None:
+                        if self._pendentes is not None:
+                            self._pendentes.append((cod, dict(campos)))
+                        continue
+                    pos = self._pos_por_cod.get(_chave_cod(cod))
+                    if pos is None:
+                        self.invalidar()
+                        continue
+                    self.rows[pos] = self._com_campos(self.rows[pos], campos)
+                    self._tocar(pos)
+                    if self._documentos is not None:
+                        self._documentos.atualizar(pos, self.rows[pos])
+                self.versao += 1
+
+    def analise_pronta(self, dsn):
+        # Análise em cache e em dia com o retrato, sem disparar leitura nem recálculo
+        with self._lock:
+            return self._analise if self.carregado(dsn) and self._analise_em_dia() else None
+
+    def versao_analise(self, dsn):
+        # Versão do retrato que a análise em cache reflete (None sem análise em dia); lida
+        # antes de extrair os dados, nunca fica à frente do que foi extraído
+        with self._lock:
+            return self._analise_versao if self.carregado(dsn) and self._analise_em_dia() else None
+
+# Tabela de exclusão para bytes.translate: tudo que não for 0-9 é descartado em C
+_NAO_DIGITOS = bytes(c for c in range(256) if not 48 <= c <= 57)
+
+_NAO_DIGITOS_COLUNA = _NAO_DIGITOS.replace(b"\n", b"")
+
+def _somente_digitos(valor):
+    return str(valor or "").encode("ascii", "ignore").translate(None, _NAO_DIGITOS).decode("ascii")
+
+def _somente_digitos_coluna(valores):
+    # Coluna inteira em uma única chamada a translate, separada por quebras de linha
+    valores = [str(v or "") for v in valores]
+    texto = "\n".join(valores).encode("ascii", "ignore").translate(None, _NAO_DIGITOS_COLUNA).decode("ascii")
+    digitos = texto.split("\n")
+    if len(digitos) != len(valores):  # algum valor já continha quebra de linha
+        return [_somente_digitos(v) for v in valores]
+    return digitos
+
+def _cpf_digitos_valido(cpf):
     if len(cpf) != 11 or cpf == cpf[0] * 11:
         return False
     soma1 = sum(int(cpf[i]) * (10 - i) for i in range(9))
@@ -127,8 +903,7 @@ def validar_cpf(cpf):
     d2 = 0 if d2 == 10 else d2
     return d2 == int(cpf[10])
 
-def validar_cnpj(cnpj):
-    cnpj = _somente_digitos(cnpj)
+def _cnpj_digitos_valido(cnpj):
     if len(cnpj) != 14 or cnpj == cnpj[0] * 14:
         return False
     pesos1 = [5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2]
@@ -143,133 +918,1203 @@ def validar_cnpj(cnpj):
     d2 = 0 if d2 >= 10 else d2
     return d2 == int(cnpj[13])
 
-def analisar_problemas(columns, rows):
-    idx = {c: i for i, c in enumerate(columns)}
-    get = lambda r, c: r[idx[c]] if c in idx else None
+def validar_cpf(cpf):
+    return _cpf_digitos_valido(_somente_digitos(cpf))
 
-    def _is_ativo(r):
-        if "SITUACAO" in idx:
-            return str(get(r, "SITUACAO") or "").strip().upper() != "I"
-        if "CADASTRO_VALIDO" in idx:
-            return str(get(r, "CADASTRO_VALIDO") or "").strip().upper() != "N"
-        return True
+def validar_cnpj(cnpj):
+    return _cnpj_digitos_valido(_somente_digitos(cnpj))
+
+# Validação em lote: os dígitos verificadores de uma coluna inteira são calculados
+# de uma vez sobre uma matriz (documentos x dígitos)
+TAMANHO_LOTE_VALIDACAO = 20000
+
+def _dv_cpf(somas):
+    d = (somas * 10) % 11
+    return _numpy().where(d == 10, 0, d)
+
+def _dv_cnpj(somas):
+    d = 11 - somas % 11
+    return _numpy().where(d >= 10, 0, d)
+
+_PESOS_CPF = ((10, 9, 8, 7, 6, 5, 4, 3, 2), (11, 10, 9, 8, 7, 6, 5, 4, 3, 2))
+_PESOS_CNPJ = ((5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2), (6, 5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2))
+
+def _mascara_documentos(documentos, tamanho, pesos, dv, valido, normalizados=False):
+    digitos = documentos if normalizados else _somente_digitos_coluna(documentos)
+    np = _numpy()
+    if np is None:
+        return [valido(d) for d in digitos]
+
+    # Só dígitos ASCII daqui em diante: o filtro de tamanho e a junção ficam em C
+    com_tamanho = np.fromiter(map(len, digitos), dtype=np.int64, count=len(digitos)) == tamanho
+    posicoes = np.flatnonzero(com_tamanho)
+    mascara = np.zeros(len(digitos), dtype=bool)
+    if not len(posicoes):
+        return mascara
+    buffer = "".join(itertools.compress(digitos, com_tamanho)).encode("ascii")
+    # int16 basta (soma máxima 9 x 65) e mantém a matriz quatro vezes menor que int64
+    m = (np.frombuffer(buffer, dtype=np.uint8).reshape(-1, tamanho) - 48).astype(np.int16)
+    d1 = dv(m[:, :tamanho - 2] @ np.array(pesos[0], dtype=np.int16))
+    d2 = dv(m[:, :tamanho - 1] @ np.array(pesos[1], dtype=np.int16))
+    repetidos = (m == m[:, :1]).all(axis=1)
+    mascara[posicoes] = (d1 == m[:, -2]) & (d2 == m[:, -1]) & ~repetidos
+    return mascara
+
+def validar_cpfs(documentos, normalizados=False):
+    return _mascara_documentos(documentos, 11, _PESOS_CPF, _dv_cpf, _cpf_digitos_valido, normalizados)
+
+def validar_cnpjs(documentos, normalizados=False):
+    return _mascara_documentos(documentos, 14, _PESOS_CNPJ, _dv_cnpj, _cnpj_digitos_valido, normalizados)
+
+def _em_lotes(iteravel, tamanho=TAMANHO_LOTE_VALIDACAO):
+    lote = []
+    for item in iteravel:
+        lote.append(item)
+        if len(lote) >= tamanho:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+def _funcao_ativo(idx):
+    if "SITUACAO" in idx:
+        i = idx["SITUACAO"]
+        return lambda r: str(r[i] or "").strip().upper() != "I"
+    if "CADASTRO_VALIDO" in idx:
+        i = idx["CADASTRO_VALIDO"]
+        return lambda r: str(r[i] or "").strip().upper() != "N"
+    return lambda r: True
+
+# Documentos de cada linha já normalizados e validados, calculados uma vez por
+# carga; as análises leem daqui em vez de limpar CPF/CGC de novo a cada passada
+class DocumentosNormalizados:
+    _CAMPOS = ("cpf", "cnpj", "tipo", "ativo", "cpf_valido", "cnpj_valido")
+
+    def __init__(self, columns, rows):
+        self._idx = {c: i for i, c in enumerate(columns)}
+        self._ativo = _funcao_ativo(self._idx)
+        rows = rows if isinstance(rows, list) else list(rows)
+        self.cpf = self._coluna(rows, "CPF", _somente_digitos_coluna)
+        self.cnpj = self._coluna(rows, "CGC", _somente_digitos_coluna)
+        self.tipo = self._coluna(rows, "TIPO", lambda valores: [str(v or "").strip().upper() for v in valores])
+        self.ativo = [self._ativo(r) for r in rows]
+        self.cpf_valido = _como_lista(validar_cpfs(self.cpf, normalizados=True))
+        self.cnpj_valido = _como_lista(validar_cnpjs(self.cnpj, normalizados=True))
+
+    def _coluna(self, rows, campo, funcao):
+        i = self._idx.get(campo)
+        return funcao([r[i] for r in rows] if i is not None else [None] * len(rows))
+
+    def __len__(self):
+        return len(self.cpf)
+
+    def _linha(self, r):
+        get = lambda c: r[self._idx[c]] if c in self._idx else None
+        cpf = _somente_digitos(get("CPF"))
+        cnpj = _somente_digitos(get("CGC"))
+        tipo = str(get("TIPO") or "").strip().upper()
+        return cpf, cnpj, tipo, self._ativo(r), _cpf_digitos_valido(cpf), _cnpj_digitos_valido(cnpj)
+
+    def atualizar(self, pos, r):
+        for campo, valor in zip(self._CAMPOS, self._linha(r)):
+            getattr(self, campo)[pos] = valor
+
+    def adicionar(self, r):
+        for campo, valor in zip(self._CAMPOS, self._linha(r)):
+            getattr(self, campo).append(valor)
+
+    def fatia(self, inicio, fim):
+        parte = DocumentosNormalizados.__new__(DocumentosNormalizados)
+        for campo in self._CAMPOS:
+            setattr(parte, campo, getattr(self, campo)[inicio:fim])
+        return parte
+
+    def repetidos(self):
+        # ({cpf: usos}, {cnpj: usos}) dos documentos com mais de um cadastro ativo: é o
+        # que as regras de duplicado consultam, e cabe inteiro em cada lote
+        contagens = []
+        for coluna in (self.cpf, self.cnpj):
+            usos = Counter(d for d, ativo in zip(coluna, self.ativo) if ativo and d)
+            contagens.append({d: n for d, n in usos.items() if n > 1})
+        return tuple(contagens)
+
+def _como_lista(mascara):
+    return mascara.tolist() if hasattr(mascara, "tolist") else list(mascara)
+
+def _lotes_documentados(columns, rows, documentos=None):
+    # Linhas em lotes, cada um com a fatia correspondente dos documentos normalizados
+    inicio = 0
+    for lote in _em_lotes(rows):
+        if documentos is None:
+            docs = DocumentosNormalizados(columns, lote)
+        else:
+            docs = documentos.fatia(inicio, inicio + len(lote))
+        inicio += len(lote)
+        yield lote, docs
+
+# Análise em paralelo: lotes de linhas vão para um pool de processos. As contagens de
+# documentos repetidos saem antes, no processo principal, para que cada lote já volte
+# com as regras avaliadas; só a junção dos resultados fica serial.
+# Desligada por padrão (1); PESSOAS_PROCESSOS_ANALISE=0 usa todos os núcleos
+PROCESSOS_ANALISE = int(os.getenv("PESSOAS_PROCESSOS_ANALISE", "1")) or (os.cpu_count() or 1)
+LIMIAR_ANALISE_PARALELA = int(os.getenv("PESSOAS_LIMIAR_PARALELO", "100000"))
+
+_pool_processos = None
+_lock_processos = threading.Lock()
+
+def _executor_processos(processos):
+    global _pool_processos
+    with _lock_processos:
+        if _pool_processos is None or _pool_processos[0] != processos:
+            if _pool_processos is not None:
+                _pool_processos[1].shutdown(wait=False)
+            # spawn: fork a partir de um processo com threads (Tk, pool) pode travar
+            contexto = multiprocessing.get_context("spawn")
+            _pool_processos = (processos, ProcessPoolExecutor(max_workers=processos, mp_context=contexto))
+        return _pool_processos[1]
+
+def encerrar_processos():
+    global _pool_processos
+    with _lock_processos:
+        if _pool_processos is not None:
+            _pool_processos[1].shutdown(wait=False, cancel_futures=True)
+            _pool_processos = None
+
+def _mapear_lotes(funcao, columns, rows, documentos, processos=1, *extras):
+    # funcao(columns, lote, docs, número do lote, *extras) lote a lote, com os resultados
+    # na ordem dos lotes; abaixo do limiar não compensa subir processos
+    if processos > 1 and len(documentos) >= LIMIAR_ANALISE_PARALELA:
+        # Os documentos do lote são refeitos no processo: mandá-los custaria mais que isso
+        yield from _mapear_em_processos(funcao, columns, _em_lotes(rows), processos, *extras)
+        return
+    for numero, (lote, docs) in enumerate(_lotes_documentados(columns, rows, documentos)):
+        yield funcao(columns, lote, docs, numero, *extras)
+
+def _mapear_em_processos(funcao, columns, lotes, processos, *extras):
+    executor = _executor_processos(processos)
+    pendentes = deque()
+    for numero, lote in enumerate(lotes):
+        pendentes.append(executor.submit(funcao, columns, lote, None, numero, *extras))
+        # Até dois lotes por processo em voo: a leitura não corre muito à frente
+        if len(pendentes) >= 2 * processos:
+            yield pendentes.popleft().result()
+    while pendentes:
+        yield pendentes.popleft().result()
+
+# Só o necessário de cada cadastro ativo para as regras, com os documentos já normalizados
+_CAMPOS_FICHA = "cod, nome, tipo, cpf, cnpj, cpf_valido, cnpj_valido, email, fone, uf, cep"
+FichaCadastro = namedtuple("FichaCadastro", _CAMPOS_FICHA)
+
+def _problema(ficha, erros):
+    return (ficha.cod, ficha.nome, ficha.tipo, ficha.cpf or ficha.cnpj or "", " / ".join(erros))
+
+# Regras de problemas cadastrais. Cada regra declara as colunas de que precisa (sem
+# elas a regra nem entra na análise) e a condição, uma função de (ficha, cpfs, cnpjs)
+# sobre a FichaCadastro e as contagens de documentos; as regras rodam na ordem em que
+# foram declaradas e uma regra com "depende" é pulada nos cadastros em que alguma
+# daquelas já acusou.
+# Ocorrências são contadas sempre; o tempo de cada regra é medido numa amostra dos
+# lotes e projetado para o total de cadastros avaliados
+AMOSTRA_TEMPO_REGRAS = 16  # um em cada N lotes roda regra a regra, cronometrado
+
+class RegraCadastro:
+    _lock = threading.Lock()
+
+    def __init__(self, mensagem, colunas, condicao, depende=()):
+        self.mensagem = mensagem
+        self.colunas = tuple(colunas)
+        self.condicao = condicao
+        self.depende = tuple(depende)
+        self.avaliados = 0
+        self.ocorrencias = 0
+        self.tempo = 0.0
+        self.medidos = 0
+
+    def registrar(self, avaliados, ocorrencias, tempo=0.0, medidos=0):
+        with self._lock:
+            self.avaliados += avaliados
+            self.ocorrencias += ocorrencias
+            self.tempo += tempo
+            self.medidos += medidos
+
+    @property
+    def tempo_estimado(self):
+        return self.tempo * self.avaliados / self.medidos if self.medidos else 0.0
+
+class MotorRegras:
+    def __init__(self, columns, regras=None, contadores=None):
+        # Com contadores ({mensagem: [avaliados, ocorrências, tempo, medidos]}) as
+        # estatísticas ficam neles, para o processo principal registrar depois
+        self.contadores = contadores
+        presentes = set(columns)
+        regras = REGRAS_CADASTRO if regras is None else regras
+        self.regras = [r for r in regras if presentes.issuperset(r.colunas)]
+        self._lotes = 0
+
+    def avaliar(self, fichas, contagens, cronometrar=None):
+        # Devolve {índice da ficha: [mensagens]} só dos cadastros com problema
+        self._lotes += 1
+        if cronometrar is None:
+            cronometrar = self._lotes % AMOSTRA_TEMPO_REGRAS == 1 or AMOSTRA_TEMPO_REGRAS <= 1
+        if cronometrar:
+            return self._avaliar_cronometrado(fichas, contagens)
+        cpfs, cnpjs = contagens
+        erros = {}
+        for i, ficha in enumerate(fichas):
+            e = []
+            for regra in self.regras:
+                if regra.depende and any(d in e for d in regra.depende):
+                    continue
+                if regra.condicao(ficha, cpfs, cnpjs):
+                    e.append(regra.mensagem)
+            if e:
+                erros[i] = e
+        ocorrencias = Counter(itertools.chain.from_iterable(erros.values()))
+        for regra in self.regras:
+            self._registrar(regra, len(fichas), ocorrencias.get(regra.mensagem, 0))
+        return erros
+
+    def _registrar(self, regra, avaliados, ocorrencias, tempo=0.0, medidos=0):
+        if self.contadores is None:
+            regra.registrar(avaliados, ocorrencias, tempo, medidos)
+            return
+        soma = self.contadores.setdefault(regra.mensagem, [0, 0, 0.0, 0])
+        for k, valor in enumerate((avaliados, ocorrencias, tempo, medidos)):
+            soma[k] += valor
+
+    def _avaliar_cronometrado(self, fichas, contagens):
+        # Uma regra por vez sobre o lote inteiro, mesmo resultado da passada por cadastro
+        cpfs, cnpjs = contagens
+        erros = {}
+        acusados = {}
+        for regra in self.regras:
+            pulados = set()
+            for anterior in regra.depende:
+                pulados.update(acusados.get(anterior, ()))
+            condicao = regra.condicao
+            inicio = time.perf_counter()
+            casos = [
+                i for i, ficha in enumerate(fichas) if i not in pulados and condicao(ficha, cpfs, cnpjs)
+            ]
+            self._registrar(regra, len(fichas), len(casos), time.perf_counter() - inicio, len(fichas))
+            acusados[regra.mensagem] = casos
+            for i in casos:
+                if i in erros:
+                    erros[i].append(regra.mensagem)
+                else:
+                    erros[i] = [regra.mensagem]
+        return dict(sorted(erros.items()))
+
+def estatisticas_regras(regras=None):
+    # (mensagem, avaliados, ocorrências, segundos estimados) das regras já executadas, da mais lenta à mais rápida
+    regras = REGRAS_CADASTRO if regras is None else regras
+    return sorted(
+        ((r.mensagem, r.avaliados, r.ocorrencias, r.tempo_estimado) for r in regras if r.avaliados),
+        key=lambda e: -e[3],
+    )
 
-    # índices principais
-    problemas = []
-    cpfs = {}
-    cnpjs = {}
+_EMAIL_VALIDO = re.compile(r"[^@\s;,]+@[^@\s;,]+\.[^@\s;,.]+")
+_SEPARADOR_EMAILS = re.compile(r"[;,\s]+")
+UFS = frozenset((
+    "AC", "AL", "AM", "AP", "BA", "CE", "DF", "ES", "GO", "MA", "MG", "MS", "MT", "PA",
+    "PB", "PE", "PI", "PR", "RJ", "RN", "RO", "RR", "RS", "SC", "SE", "SP", "TO",
+))
+# Faixas de CEP (5 primeiros dígitos) de cada UF, ordenadas pelo início
+_FAIXAS_CEP = sorted([
+    (1000, 19999, "SP"), (20000, 28999, "RJ"), (29000, 29999, "ES"), (30000, 39999, "MG"),
+    (40000, 48999, "BA"), (49000, 49999, "SE"), (50000, 56999, "PE"), (57000, 57999, "AL"),
+    (58000, 58999, "PB"), (59000, 59999, "RN"), (60000, 63999, "CE"), (64000, 64999, "PI"),
+    (65000, 65999, "MA"), (66000, 68899, "PA"), (68900, 68999, "AP"), (69000, 69299, "AM"),
+    (69300, 69399, "RR"), (69400, 69899, "AM"), (69900, 69999, "AC"), (70000, 72799, "DF"),
+    (72800, 72999, "GO"), (73000, 73699, "DF"), (73700, 76799, "GO"), (76800, 76999, "RO"),
+    (77000, 77999, "TO"), (78000, 78899, "MT"), (79000, 79999, "MS"), (80000, 87999, "PR"),
+    (88000, 89999, "SC"), (90000, 99999, "RS"),
+])
+_INICIOS_CEP = [f[0] for f in _FAIXAS_CEP]
+
+def _uf_do_cep(cep):
+    prefixo = int(cep[:5])
+    i = bisect.bisect_right(_INICIOS_CEP, prefixo) - 1
+    if i >= 0 and prefixo <= _FAIXAS_CEP[i][1]:
+        return _FAIXAS_CEP[i][2]
+    return None
+
+def _email_invalido(email):
+    email = str(email or "").strip()
+    if not email or _EMAIL_VALIDO.fullmatch(email):
+        return False
+    # Mais de um endereço no campo ("a@x.com; b@y.com"): cada um precisa ser válido
+    return not all(_EMAIL_VALIDO.fullmatch(e) for e in _SEPARADOR_EMAILS.split(email) if e)
+
+def _fone_invalido(fone):
+    # Na forma canônica (sem 55 do país nem 0 de longa distância): DDD + 8 ou 9 dígitos
+    return len(normalizar_fone(fone)) not in (0, 10, 11)
+
+def _uf(uf):
+    return str(uf or "").strip().upper()
+
+def _cep_invalido(cep):
+    digitos = normalizar_cep(cep)
+    return len(digitos) not in (0, 8) or digitos == "00000000"
+
+def _uf_cep_divergentes(uf, cep):
+    uf, cep = _uf(uf), normalizar_cep(cep)
+    return bool(uf) and len(cep) == 8 and _uf_do_cep(cep) not in (None, uf)
+
+REGRAS_CADASTRO = [
+    RegraCadastro("Nome vazio", ("NOME",), lambda f, cpfs, cnpjs: not str(f.nome or "").strip()),
+    RegraCadastro("CPF inválido", ("CPF",), lambda f, cpfs, cnpjs: f.cpf and not f.cpf_valido),
+    RegraCadastro("CNPJ inválido", ("CGC",), lambda f, cpfs, cnpjs: f.cnpj and not f.cnpj_valido),
+    RegraCadastro("CPF duplicado", ("CPF",), lambda f, cpfs, cnpjs: f.cpf and cpfs.get(f.cpf, 0) > 1),
+    RegraCadastro("CNPJ duplicado", ("CGC",), lambda f, cpfs, cnpjs: f.cnpj and cnpjs.get(f.cnpj, 0) > 1),
+    RegraCadastro("Tipo F com CNPJ informado", ("TIPO", "CGC"), lambda f, cpfs, cnpjs: f.tipo == "F" and f.cnpj),
+    RegraCadastro(
+        "Tipo F com CPF inválido", ("TIPO", "CPF"),
+        lambda f, cpfs, cnpjs: f.tipo == "F" and f.cpf and not f.cpf_valido,
+    ),
+    RegraCadastro("Tipo J com CPF informado", ("TIPO", "CPF"), lambda f, cpfs, cnpjs: f.tipo == "J" and f.cpf),
+    RegraCadastro(
+        "Tipo J com CNPJ inválido", ("TIPO", "CGC"),
+        lambda f, cpfs, cnpjs: f.tipo == "J" and f.cnpj and not f.cnpj_valido,
+    ),
+    RegraCadastro("Tipo de cadastro não informado", ("TIPO",), lambda f, cpfs, cnpjs: f.tipo not in ("F", "J")),
+    RegraCadastro("UF inválida", ("UF",), lambda f, cpfs, cnpjs: f.uf and _uf(f.uf) not in UFS),
+    RegraCadastro("Telefone com tamanho inválido", ("FONE1",), lambda f, cpfs, cnpjs: f.fone and _fone_invalido(f.fone)),
+    RegraCadastro("CEP inválido", ("CEP",), lambda f, cpfs, cnpjs: f.cep and _cep_invalido(f.cep)),
+    RegraCadastro("E-mail inválido", ("EMAIL",), lambda f, cpfs, cnpjs: f.email and _email_invalido(f.email)),
+    RegraCadastro(
+        "UF não confere com o CEP", ("UF", "CEP"),
+        lambda f, cpfs, cnpjs: f.uf and f.cep and _uf_cep_divergentes(f.uf, f.cep),
+        depende=("UF inválida", "CEP inválido"),
+    ),
+]
+
+# Normalização do documento no próprio Firebird; usa a coluna computada/indexada
+# <CAMPO>_NORMALIZADO quando a base tiver uma. Sem expressões regulares no servidor,
+# só a pontuação usual das máscaras é retirada: documentos com outros caracteres
+# (vírgula, letras, "_") não se agrupam aqui, embora o agrupamento local, que descarta
+# tudo que não for dígito, os junte
+def _expr_documento(colunas, campo, alias="P"):
+    if f"{campo}_NORMALIZADO" in colunas:
+        return f"{alias}.{campo}_NORMALIZADO"
+    expr = f"TRIM({alias}.{campo})"
+    for ch in (".", "-", "/", " ", "(", ")"):
+        expr = f"REPLACE({expr}, '{ch}', '')"
+    return expr
+
+def _sql_grupos_duplicados(colunas, campo, tamanho=None):
+    expr = _expr_documento(colunas, campo, "D")
+    condicoes = [f"{expr} <> ''"]
+    if tamanho:
+        condicoes.append(f"CHAR_LENGTH({expr}) = {int(tamanho)}")
+    return (
+        f"SELECT {expr} AS DOC, COUNT(*) AS QTD FROM PESSOA D "
+        f"WHERE {' AND '.join(condicoes)} GROUP BY {expr} HAVING COUNT(*) > 1"
+    )
 
-    for r in rows:
-        if not _is_ativo(r):
+def buscar_duplicados_sql(con, dsn=None):
+    colunas = colunas_pessoa(con, dsn)
+    cur = con.cursor()
+    resultado = []
+    for campo, tamanho in (("CPF", 11), ("CGC", 14)):
+        if campo not in colunas:
+            resultado.append([])
             continue
-        cpf_raw = get(r, "CPF")
-        cnpj_raw = get(r, "CGC")
-        cpf = _somente_digitos(cpf_raw)
-        cnpj = _somente_digitos(cnpj_raw)
-
-        if cpf:
-            cpfs[cpf] = cpfs.get(cpf, 0) + 1
-        if cnpj:
-            cnpjs[cnpj] = cnpjs.get(cnpj, 0) + 1
-
-    for r in rows:
-        if not _is_ativo(r):
+        nome = "P.NOME" if "NOME" in colunas else "NULL"
+        email = "P.EMAIL" if "EMAIL" in colunas else "NULL"
+        cur.execute(
+            f"""
+            SELECT G.DOC, P.CODPESSOA, {nome}, {email}
+            FROM ({_sql_grupos_duplicados(colunas, campo, tamanho)}) G
+            JOIN PESSOA P ON {_expr_documento(colunas, campo)} = G.DOC
+            ORDER BY G.DOC, P.CODPESSOA
+            """
+        )
+        resultado.append(cur.fetchall())
+    return resultado[0], resultado[1]
+
+# Normalizadores de contato. A forma canônica é a que o sistema grava: telefone e CEP
+# só com dígitos (sem o 55 do país nem o 0 de longa distância; CEP numérico que perdeu
+# o zero à esquerda volta a ter 8 dígitos) e e-mail minúsculo, sem espaços, com ";"
+# entre endereços. As versões de coluna fazem o trabalho pesado numa única chamada
+# a translate/lower sobre a coluna inteira, como _somente_digitos_coluna
+_PREFIXOS_SEM_DDD = ("0300", "0500", "0800", "0900")
+# Trocas feitas sobre a coluna de e-mails já unida (cada replace é uma passada em C)
+_TROCAS_EMAIL = ((" ", ""), ("\t", ""), ("\r", ""), ("\n", ""), (",", ";"))
+_SEPARADOR_COLUNA = "\x1f"
+
+def _fone_canonico(digitos):
+    if len(digitos) in (12, 13) and digitos.startswith("55"):
+        return digitos[2:]
+    if len(digitos) in (11, 12) and digitos.startswith("0") and not digitos.startswith(_PREFIXOS_SEM_DDD):
+        return digitos[1:]
+    return digitos
+
+def _cep_canonico(digitos):
+    return digitos.zfill(8) if len(digitos) == 7 else digitos
+
+def _email_canonico(email):
+    if email.startswith("mailto:"):
+        email = email[7:]
+    if ";" in email:
+        email = ";".join(e for e in email.split(";") if e)
+    return email
+
+def normalizar_fone(valor):
+    return _fone_canonico(_somente_digitos(valor))
+
+def normalizar_cep(valor):
+    return _cep_canonico(_somente_digitos(valor))
+
+def _trocar_email(texto):
+    for antes, depois in _TROCAS_EMAIL:
+        texto = texto.replace(antes, depois)
+    return texto
+
+def normalizar_email(valor):
+    return _email_canonico(_trocar_email(str(valor or "").lower()))
+
+def normalizar_fones(valores):
+    # Só os longos podem trazer prefixo sobrando
+    return [f if len(f) < 11 else _fone_canonico(f) for f in _somente_digitos_coluna(valores)]
+
+def normalizar_ceps(valores):
+    return [c if len(c) != 7 else _cep_canonico(c) for c in _somente_digitos_coluna(valores)]
+
+def normalizar_emails(valores):
+    valores = [str(v or "") for v in valores]
+    texto = _trocar_email(_SEPARADOR_COLUNA.join(valores).lower())
+    emails = texto.split(_SEPARADOR_COLUNA)
+    if len(emails) != len(valores):  # algum valor já continha o separador
+        return [normalizar_email(v) for v in valores]
+    if ";" in texto or "mailto:" in texto:
+        emails = [_email_canonico(e) if ";" in e or e.startswith("mailto:") else e for e in emails]
+    return emails
+
+# Só vira sugestão o valor normalizado que ficou válido: ramal colado no telefone,
+# texto ("não tem") ou e-mail com espaço no meio do nome ficam para as regras de validação
+def _fone_sugerivel(bruto, fone):
+    return len(fone) in (10, 11)
+
+def _cep_sugerivel(bruto, cep):
+    return len(cep) == 8 and cep != "00000000"
+
+def _email_sugerivel(bruto, email):
+    # O normalizador tira os espaços; um espaço dentro de um endereço juntaria duas palavras
+    partes = [p for p in _SEPARADOR_EMAILS.split(str(bruto).strip().lower().replace("mailto:", "")) if p]
+    return email.isascii() and len(partes) == len(email.split(";")) and all(
+        _EMAIL_VALIDO.fullmatch(e) for e in email.split(";")
+    )
+
+CAMPOS_CONTATO = (
+    ("FONE1", normalizar_fones, _fone_sugerivel, "Normalizar telefone (somente dígitos)"),
+    ("FONE2", normalizar_fones, _fone_sugerivel, "Normalizar telefone (somente dígitos)"),
+    ("CEP", normalizar_ceps, _cep_sugerivel, "Normalizar CEP (somente dígitos)"),
+    ("EMAIL", normalizar_emails, _email_sugerivel, "Normalizar e-mail (minúsculas, sem espaços)"),
+)
+
+def _contatos_normalizados(idx, lote):
+    # (campo, posição na linha, coluna normalizada, validação, motivo) de cada campo de contato presente
+    return [
+        (campo, idx[campo], normalizar([r[idx[campo]] for r in lote]), sugerivel, motivo)
+        for campo, normalizar, sugerivel, motivo in CAMPOS_CONTATO
+        if campo in idx
+    ]
+
+def _sugestoes_contato(cod, r, pos, contatos):
+    for campo, i, normalizados, sugerivel, motivo in contatos:
+        bruto = r[i]
+        if bruto is None or not str(bruto).strip():
             continue
+        valor = normalizados[pos]
+        if str(bruto) != valor and sugerivel(bruto, valor):
+            yield (cod, campo, valor, motivo)
+
+def _sugestoes_cadastro(cod, nome, nomefantasia, tipo, cpf_raw, cnpj_raw, cpf, cnpj):
+    cpf = cpf or None
+    cnpj = cnpj or None
+
+    if not str(nome or "").strip() and str(nomefantasia or "").strip():
+        yield (cod, "NOME", str(nomefantasia).strip(), "Nome vazio; usar Nome fantasia")
+
+    if cpf_raw and cpf and str(cpf_raw).strip() != cpf:
+        yield (cod, "CPF", cpf, "Normalizar CPF (remover caracteres)")
+    if cnpj_raw and cnpj and str(cnpj_raw).strip() != cnpj:
+        yield (cod, "CGC", cnpj, "Normalizar CNPJ (remover caracteres)")
+
+    if tipo == "F" and cnpj_raw:
+        yield (cod, "CGC", None, "Tipo F não deve ter CNPJ")
+    if tipo == "J" and cpf_raw:
+        yield (cod, "CPF", None, "Tipo J não deve ter CPF")
+
+def _status_documento(valor, valido):
+    return "✅ Válido" if valor and valido else ("❌ Inválido" if valor else "⚪ Não informado")
+
+COLUNAS_API = ["CODPESSOA", "NOME", "CGC", "NOMEFANTASIA", "EMAIL", "FONE1"]
+
+# Motor único de análise: uma passada sobre as linhas produz tudo o que as abas de
+# qualidade exibem (problemas, validação, duplicados, sugestões, relatório e CNPJs válidos).
+# Os resultados ficam indexados pela posição da linha no retrato, para que a edição de
+# um cadastro troque só a contribuição dele (e a dos vizinhos de documento)
+class AnaliseCadastros:
+    def __init__(self, columns, rows, documentos=None, processos=1):
+        self.columns = list(columns)
+        self._lock = threading.RLock()
+        self._motor = MotorRegras(columns)
+        self.relatorio = {
+            "total": 0, "tipo_f": 0, "tipo_j": 0, "cpf_validos": 0,
+            "cnpj_validos": 0, "sem_email": 0, "sem_telefone": 0,
+        }
+        self.validacoes = []
+        self._cnpjs_validos = {}
+        self._sugestoes = {}
+        self._ativos = {}
+        self._problemas = {}
+        self._grupos_cpf = {}
+        self._grupos_cnpj = {}
+        self._cpfs = IndiceDocumentos()
+        self._cnpjs = IndiceDocumentos()
+        self._desordenados = set()
+        self._duplicados = None
+
+        # Primeira fase: documentos repetidos da tabela inteira, para que as regras de
+        # duplicado já possam rodar lote a lote
+        if documentos is None:
+            rows = list(rows)
+            documentos = DocumentosNormalizados(columns, rows)
+        contagens = documentos.repetidos()
+
+        # Segunda fase: cada lote volta com a sua contribuição e os seus problemas (no
+        # próprio processo ou no pool); a junção na ordem dos lotes reproduz a passada serial
+        inicio = 0
+        for parcial in _mapear_lotes(_analise_lote, columns, rows, documentos, processos, contagens):
+            self._incorporar(parcial, inicio)
+            inicio += parcial["linhas"]
+
+    def _guardar(self, nome, pos, valor):
+        dados = getattr(self, nome)
+        if pos not in dados and dados and pos < next(reversed(dados)):
+            self._desordenados.add(nome)
+        dados[pos] = valor
+
+    def _guardar_varios(self, nome, inicio, itens):
+        dados = getattr(self, nome)
+        if not dados or inicio > next(reversed(dados)):
+            # Lote depois de tudo o que já existe (carga inicial): entra em ordem
+            dados.update((inicio + p, valor) for p, valor in itens)
+        else:
+            for p, valor in itens:
+                self._guardar(nome, inicio + p, valor)
+
+    def _ordenados(self, nome):
+        if nome in self._desordenados:
+            setattr(self, nome, dict(sorted(getattr(self, nome).items())))
+            self._desordenados.discard(nome)
+        return getattr(self, nome)
+
+    def _incorporar(self, parcial, inicio):
+        for chave, valor in parcial["relatorio"].items():
+            self.relatorio[chave] += valor
+        self.validacoes[inicio:inicio + parcial["linhas"]] = parcial["validacoes"]
+        self._guardar_varios("_cnpjs_validos", inicio, parcial["cnpjs_validos"])
+        self._guardar_varios("_sugestoes", inicio, parcial["sugestoes"])
+        ativos = parcial["ativos"]
+        if ativos and type(ativos[0][1]) is tuple:
+            ativos = [(p, FichaCadastro(*ficha)) for p, ficha in ativos]
+        self._guardar_varios("_ativos", inicio, ativos)
+        if "problemas" in parcial:
+            fichas = dict(ativos)
+            self._guardar_varios(
+                "_problemas", inicio, [(p, _problema(fichas[p], m)) for p, m in parcial["problemas"]]
+            )
+            for regra in self._motor.regras:
+                if regra.mensagem in parcial["regras"]:
+                    regra.registrar(*parcial["regras"][regra.mensagem])
+        for p, ficha in ativos:
+            if ficha.cpf:
+                self._cpfs.adicionar(ficha.cpf, inicio + p)
+            if ficha.cnpj:
+                self._cnpjs.adicionar(ficha.cnpj, inicio + p)
+        for grupos, chave in ((self._grupos_cpf, "grupos_cpf"), (self._grupos_cnpj, "grupos_cnpj")):
+            for doc, itens in parcial[chave].items():
+                grupo = grupos.setdefault(doc, [])
+                for p, item in itens:
+                    if grupo and grupo[-1][0] > inicio + p:
+                        bisect.insort(grupo, (inicio + p, item))
+                    else:
+                        grupo.append((inicio + p, item))
+        if parcial["grupos_cpf"] or parcial["grupos_cnpj"]:
+            self._duplicados = None
+
+    def _retirar(self, pos, parcial):
+        # Desfaz a contribuição de uma linha (parcial calculado sobre o conteúdo antigo dela)
+        for chave, valor in parcial["relatorio"].items():
+            self.relatorio[chave] -= valor
+        self._cnpjs_validos.pop(pos, None)
+        self._sugestoes.pop(pos, None)
+        ficha = self._ativos.pop(pos, None)
+        if ficha:
+            if ficha.cpf:
+                self._cpfs.remover(ficha.cpf, pos)
+            if ficha.cnpj:
+                self._cnpjs.remover(ficha.cnpj, pos)
+        for grupos, chave in ((self._grupos_cpf, "grupos_cpf"), (self._grupos_cnpj, "grupos_cnpj")):
+            for doc in parcial[chave]:
+                grupo = [g for g in grupos.get(doc, []) if g[0] != pos]
+                if grupo:
+                    grupos[doc] = grupo
+                else:
+                    grupos.pop(doc, None)
+        if parcial["grupos_cpf"] or parcial["grupos_cnpj"]:
+            self._duplicados = None
+
+    def _avaliar(self, pos):
+        ficha = self._ativos.get(pos)
+        problema = None
+        if ficha:
+            erros = self._motor.avaliar([ficha], (self._cpfs, self._cnpjs))
+            if erros:
+                problema = _problema(ficha, erros[0])
+        if problema:
+            self._guardar("_problemas", pos, problema)
+        else:
+            self._problemas.pop(pos, None)
+        return self.validacoes[pos][0], problema
+
+    def _vizinhos(self, *fichas):
+        # Cadastros cujo "duplicado" pode ter mudado: só quando o documento ficou com até 2 usos
+        afetados = set()
+        for ficha in fichas:
+            if not ficha:
+                continue
+            for indice, doc in ((self._cpfs, ficha.cpf), (self._cnpjs, ficha.cnpj)):
+                if doc and indice.get(doc, 0) <= 2:
+                    afetados.update(indice.posicoes(doc))
+        return afetados
+
+    def atualizar(self, pos, antiga, nova):
+        # Troca a contribuição de uma linha; devolve [(cod, problema ou None)] dos cadastros afetados
+        with self._lock:
+            anterior = self._ativos.get(pos)
+            self._retirar(pos, _analise_parcial(self.columns, [antiga]))
+            self._incorporar(_analise_parcial(self.columns, [nova]), pos)
+            afetados = {pos} | self._vizinhos(anterior, self._ativos.get(pos))
+            return [self._avaliar(p) for p in sorted(afetados)]
+
+    def adicionar(self, nova):
+        with self._lock:
+            pos = len(self.validacoes)
+            self._incorporar(_analise_parcial(self.columns, [nova]), pos)
+            afetados = {pos} | self._vizinhos(self._ativos.get(pos))
+            return [self._avaliar(p) for p in sorted(afetados)]
+
+    @property
+    def problemas(self):
+        with self._lock:
+            return list(self._ordenados("_problemas").values())
+
+    @property
+    def cnpjs_validos(self):
+        with self._lock:
+            return list(self._ordenados("_cnpjs_validos").values())
+
+    @property
+    def sugestoes(self):
+        with self._lock:
+            return [s for lista in self._ordenados("_sugestoes").values() for s in lista]
+
+    @property
+    def dup_cpf(self):
+        return self._grupos_duplicados()[0]
+
+    @property
+    def dup_cnpj(self):
+        return self._grupos_duplicados()[1]
+
+    def _grupos_duplicados(self):
+        with self._lock:
+            if self._duplicados is None:
+                self._duplicados = (_achatar_grupos(self._grupos_cpf), _achatar_grupos(self._grupos_cnpj))
+            return self._duplicados
+
+def _achatar_grupos(grupos):
+    # Grupos na ordem do primeiro cadastro, itens na ordem das linhas
+    repetidos = sorted(
+        ((doc, itens) for doc, itens in grupos.items() if len(itens) > 1), key=lambda g: g[1][0][0]
+    )
+    return [(doc, *item) for doc, itens in repetidos for _, item in itens]
+
+class IndiceDocumentos:
+    # Documento -> posição do único cadastro ativo que o usa, ou lista de posições quando
+    # repetido; get() devolve a contagem, como os dicionários lidos pelas regras de duplicado
+    def __init__(self):
+        self._pos = {}
+
+    def adicionar(self, doc, pos):
+        atual = self._pos.get(doc)
+        if atual is None:
+            self._pos[doc] = pos
+        elif isinstance(atual, list):
+            atual.append(pos)
+        else:
+            self._pos[doc] = [atual, pos]
+
+    def remover(self, doc, pos):
+        atual = self._pos.get(doc)
+        if isinstance(atual, list):
+            atual.remove(pos)
+            if len(atual) == 1:
+                self._pos[doc] = atual[0]
+        elif atual == pos:
+            del self._pos[doc]
+
+    def get(self, doc, padrao=0):
+        atual = self._pos.get(doc)
+        if atual is None:
+            return padrao
+        return len(atual) if isinstance(atual, list) else 1
+
+    def posicoes(self, doc):
+        atual = self._pos.get(doc)
+        if atual is None:
+            return []
+        return list(atual) if isinstance(atual, list) else [atual]
+
+def _analise_parcial(columns, lote, docs=None):
+    # Contribuição de um lote; posições relativas ao início do lote
+    if docs is None:
+        docs = DocumentosNormalizados(columns, lote)
+    idx = {c: i for i, c in enumerate(columns)}
+    get = lambda r, c: r[idx[c]] if c in idx else None
+    vazio = lambda r, c: r[idx[c]] if c in idx else ""
+    posicoes_api = [idx.get(c) for c in COLUNAS_API]
+    relatorio = {
+        "total": 0, "tipo_f": 0, "tipo_j": 0, "cpf_validos": 0,
+        "cnpj_validos": 0, "sem_email": 0, "sem_telefone": 0,
+    }
+    validacoes = []
+    cnpjs_validos = []
+    sugestoes = []
+    ativos = []
+    grupos_cpf = {}
+    grupos_cnpj = {}
+    contatos = _contatos_normalizados(idx, lote)
+
+    for pos, (r, ativo, tipo, cpf, cnpj, cpf_valido, cnpj_valido) in enumerate(zip(
+        lote, docs.ativo, docs.tipo, docs.cpf, docs.cnpj, docs.cpf_valido, docs.cnpj_valido
+    )):
         cod = get(r, "CODPESSOA")
         nome = get(r, "NOME")
-        tipo = (get(r, "TIPO") or "").strip().upper()
-        cpf_raw = get(r, "CPF")
-        cnpj_raw = get(r, "CGC")
-
-        cpf = _somente_digitos(cpf_raw)
-        cnpj = _somente_digitos(cnpj_raw)
-
-        erros = []
-
-        if not str(nome or "").strip():
-            erros.append("Nome vazio")
-
-        if cpf and not validar_cpf(cpf):
-            erros.append("CPF inválido")
-        if cnpj and not validar_cnpj(cnpj):
-            erros.append("CNPJ inválido")
-
-        if cpf and cpfs.get(cpf, 0) > 1:
-            erros.append("CPF duplicado")
-        if cnpj and cnpjs.get(cnpj, 0) > 1:
-            erros.append("CNPJ duplicado")
 
+        # Relatório
+        relatorio["total"] += 1
         if tipo == "F":
-            if cnpj:
-                erros.append("Tipo F com CNPJ informado")
-            if cpf and not validar_cpf(cpf):
-                erros.append("Tipo F com CPF inválido")
+            relatorio["tipo_f"] += 1
         elif tipo == "J":
-            if cpf:
-                erros.append("Tipo J com CPF informado")
-            if cnpj and not validar_cnpj(cnpj):
-                erros.append("Tipo J com CNPJ inválido")
-        else:
-            erros.append("Tipo de cadastro não informado")
+            relatorio["tipo_j"] += 1
+        relatorio["cpf_validos"] += cpf_valido
+        relatorio["cnpj_validos"] += cnpj_valido
+        if not get(r, "EMAIL"):
+            relatorio["sem_email"] += 1
+        if not get(r, "FONE1"):
+            relatorio["sem_telefone"] += 1
+
+        # Validação e CNPJs válidos
+        cpf_tela = vazio(r, "CPF")
+        cnpj_tela = vazio(r, "CGC")
+        validacoes.append(
+            (vazio(r, "CODPESSOA"), vazio(r, "NOME"), tipo,
+             cpf_tela or "-", _status_documento(cpf_tela, cpf_valido),
+             cnpj_tela or "-", _status_documento(cnpj_tela, cnpj_valido))
+        )
+        if cnpj_valido:
+            cnpjs_validos.append((pos, tuple(r[i] if i is not None else "" for i in posicoes_api)))
 
-        if erros:
-            problemas.append((cod, nome, tipo, cpf or cnpj or "", " / ".join(erros)))
+        # Duplicados (todos os cadastros, ativos ou não)
+        item = (vazio(r, "CODPESSOA"), vazio(r, "NOME"), vazio(r, "EMAIL"))
+        if len(cpf) == 11:
+            grupos_cpf.setdefault(cpf, []).append((pos, item))
+        if len(cnpj) == 14:
+            grupos_cnpj.setdefault(cnpj, []).append((pos, item))
 
-    return problemas
+        if not ativo:
+            continue
 
-def _limpar_documento(valor):
-    doc = _somente_digitos(valor)
-    return doc if doc else None
+        ativos.append((pos, FichaCadastro(
+            cod, nome, tipo, cpf, cnpj, cpf_valido, cnpj_valido,
+            get(r, "EMAIL"), get(r, "FONE1"), get(r, "UF"), get(r, "CEP"),
+        )))
+        if cod is not None:
+            sugestoes_linha = list(_sugestoes_cadastro(
+                cod, nome, get(r, "NOMEFANTASIA"), tipo, get(r, "CPF"), get(r, "CGC"), cpf, cnpj
+            ))
+            sugestoes_linha.extend(_sugestoes_contato(cod, r, pos, contatos))
+            if sugestoes_linha:
+                sugestoes.append((pos, sugestoes_linha))
+
+    return {
+        "linhas": len(validacoes), "relatorio": relatorio, "validacoes": validacoes,
+        "cnpjs_validos": cnpjs_validos, "sugestoes": sugestoes, "ativos": ativos,
+        "grupos_cpf": grupos_cpf, "grupos_cnpj": grupos_cnpj,
+    }
 
-def sugerir_ajustes_massa(columns, rows):
+def _analise_lote(columns, lote, docs, numero, contagens):
+    # Contribuição do lote já com os problemas, avaliados com as contagens da tabela
+    # inteira; as estatísticas das regras voltam junto para o processo principal.
+    # Os problemas voltam só como (posição, mensagens) e, vindo do pool (docs None), as
+    # fichas voltam como tuplas simples, que o pickle traz bem mais depressa
+    parcial = _analise_parcial(columns, lote, docs)
+    motor = MotorRegras(columns, contadores={})
+    fichas = [ficha for _, ficha in parcial["ativos"]]
+    erros = motor.avaliar(fichas, contagens, numero % AMOSTRA_TEMPO_REGRAS == 0)
+    parcial["problemas"] = [(parcial["ativos"][i][0], mensagens) for i, mensagens in erros.items()]
+    parcial["regras"] = motor.contadores
+    if docs is None:
+        parcial["ativos"] = [(p, tuple(ficha)) for p, ficha in parcial["ativos"]]
+    return parcial
+
+# Quase-duplicados: o nome é reduzido a uma forma canônica (sem acentos, pontuação
+# e termos societários) e quebrado em trigramas. Assinaturas MinHash divididas em
+# faixas (LSH) só colocam lado a lado nomes com boa chance de serem parecidos; e-mail
+# e telefone iguais entram como blocos exatos. Com NumPy as assinaturas saem em lote.
+# Com 10 faixas de 6 linhas o limiar do LSH, (1/10)^(1/6) ~ 0,68, fica logo abaixo de
+# LIMIAR_SIMILARIDADE: um par com 0,8 vira candidato em ~95% dos casos e pares de
+# nomes só medianamente parecidos (~0,5) quase não chegam a ser pontuados
+LIMIAR_SIMILARIDADE = float(os.getenv("PESSOAS_LIMIAR_SIMILARIDADE", "0.8"))
+TERMOS_IGNORADOS_NOME = frozenset((
+    "LTDA", "ME", "EPP", "EIRELI", "SA", "S", "A", "MEI", "CIA",
+    "DA", "DE", "DO", "DAS", "DOS", "E",
+))
+MINHASH_FAIXAS = 10
+MINHASH_LINHAS = 6
+MINHASH_PERMUTACOES = MINHASH_FAIXAS * MINHASH_LINHAS
+LIMITE_BALDE = 50  # baldes maiores (nomes muito comuns) gerariam comparações demais
+LIMITE_PARES_EXIBIDOS = 5000
+
+_MINHASH_PRIMO = 4294967311  # primo > 2**32: a*x + b cabe em 64 bits
+_gerador_minhash = random.Random(20240917)
+_MINHASH_PARAMS = [
+    (_gerador_minhash.randrange(1, 2 ** 32), _gerador_minhash.randrange(0, 2 ** 32))
+    for _ in range(MINHASH_PERMUTACOES)
+]
+del _gerador_minhash
+_PONTUACAO_ESPACO = str.maketrans(string.punctuation, " " * len(string.punctuation))
+
+def _nome_canonico(texto):
+    texto = unicodedata.normalize("NFKD", str(texto or "")).encode("ascii", "ignore").decode("ascii")
+    termos = texto.upper().translate(_PONTUACAO_ESPACO).split()
+    return " ".join(t for t in termos if t not in TERMOS_IGNORADOS_NOME)
+
+def _trigramas(nome):
+    # Inteiros de 32 bits em array: um milhão de nomes em listas de int não caberia na memória
+    nome = f" {nome} "
+    return array("I", sorted({zlib.crc32(nome[i:i + 3].encode("ascii")) for i in range(len(nome) - 2)}))
+
+def _assinaturas_minhash(conjuntos, tarefa=None):
+    np = _numpy()
+    if np is None:
+        assinaturas = []
+        for c in conjuntos:
+            if tarefa and len(assinaturas) % 4096 == 0:
+                tarefa.verificar_cancelamento()
+            assinaturas.append(tuple(min((a * x + b) % _MINHASH_PRIMO for x in c) for a, b in _MINHASH_PARAMS))
+        return assinaturas
+    a = np.array([p[0] for p in _MINHASH_PARAMS], dtype=np.uint64)[:, None]
+    b = np.array([p[1] for p in _MINHASH_PARAMS], dtype=np.uint64)[:, None]
+    primo = np.uint64(_MINHASH_PRIMO)
+    assinaturas = np.empty((len(conjuntos), MINHASH_PERMUTACOES), dtype=np.uint64)
+    # Em blocos: a matriz (permutações x trigramas) de um milhão de nomes não cabe na memória
+    for inicio in range(0, len(conjuntos), 4096):
+        if tarefa:
+            tarefa.verificar_cancelamento()
+        parte = conjuntos[inicio:inicio + 4096]
+        tamanhos = np.fromiter(map(len, parte), dtype=np.int64, count=len(parte))
+        x = np.fromiter(itertools.chain.from_iterable(parte), dtype=np.uint64, count=int(tamanhos.sum()))
+        valores = (a * x[None, :] + b) % primo
+        offsets = np.concatenate(([0], np.cumsum(tamanhos)[:-1]))
+        assinaturas[inicio:inicio + len(parte)] = np.minimum.reduceat(valores, offsets, axis=1).T
+    return assinaturas
+
+def _pares_lsh(assinaturas, tarefa=None):
+    # Dois nomes viram candidatos quando coincidem em todas as linhas de alguma faixa
+    np = _numpy()
+    pares = set()
+    for faixa in range(MINHASH_FAIXAS):
+        if tarefa:
+            tarefa.verificar_cancelamento()
+        inicio = faixa * MINHASH_LINHAS
+        if np is None:
+            baldes = {}
+            for i, assinatura in enumerate(assinaturas):
+                baldes.setdefault(assinatura[inicio:inicio + MINHASH_LINHAS], []).append(i)
+            grupos = (g for g in baldes.values() if 1 < len(g) <= LIMITE_BALDE)
+        else:
+            bloco = assinaturas[:, inicio:inicio + MINHASH_LINHAS]
+            chave = bloco[:, 0].copy()
+            for c in range(1, MINHASH_LINHAS):
+                chave = chave * np.uint64(1000003) ^ bloco[:, c]
+            ordem = np.argsort(chave, kind="stable")
+            quebras = np.flatnonzero(np.diff(chave[ordem])) + 1
+            inicios = np.concatenate(([0], quebras))
+            fins = np.concatenate((quebras, [len(ordem)]))
+            tamanhos = fins - inicios
+            escolhidos = (tamanhos > 1) & (tamanhos <= LIMITE_BALDE)
+            grupos = (ordem[i0:i1].tolist() for i0, i1 in zip(inicios[escolhidos], fins[escolhidos]))
+        for grupo in grupos:
+            pares.update(itertools.combinations(sorted(grupo), 2))
+    return pares
+
+def _pares_bloco(chaves):
+    baldes = {}
+    for i, chave in enumerate(chaves):
+        if chave:
+            baldes.setdefault(chave, []).append(i)
+    pares = set()
+    for grupo in baldes.values():
+        if 1 < len(grupo) <= LIMITE_BALDE:
+            pares.update(itertools.combinations(grupo, 2))
+    return pares
+
+def _pares_nomes_iguais(nomes, secundarias):
+    # Nomes idênticos repetidos além de LIMITE_BALDE, que o LSH descarta: o grupo é
+    # dividido pela chave secundária (CEP ou UF) e, se ainda passar do limite, cada
+    # cadastro é ligado ao primeiro do sub-bloco (n - 1 pares em vez de n²)
+    baldes = {}
+    for i, nome in enumerate(nomes):
+        if nome:
+            baldes.setdefault(nome, []).append(i)
+    pares = set()
+    for grupo in baldes.values():
+        if len(grupo) <= LIMITE_BALDE:
+            continue
+        sub_blocos = {}
+        for i in grupo:
+            sub_blocos.setdefault(secundarias[i], []).append(i)
+        for membros in sub_blocos.values():
+            if len(membros) <= LIMITE_BALDE:
+                pares.update(itertools.combinations(membros, 2))
+            else:
+                pares.update((membros[0], i) for i in membros[1:])
+    return pares
+
+def buscar_quase_duplicados(columns, rows, documentos=None, limiar=None, tarefa=None):
+    # Pares (similaridade, cod, nome, cod, nome, motivo) de cadastros ativos parecidos,
+    # do mais parecido para o menos; cadastros com documentos diferentes não formam par.
+    # Pares achados só por e-mail ou telefone não têm os nomes pontuados (similaridade None)
+    limiar = LIMIAR_SIMILARIDADE if limiar is None else limiar
     idx = {c: i for i, c in enumerate(columns)}
+    rows = rows if isinstance(rows, list) else list(rows)
+    if documentos is None:
+        documentos = DocumentosNormalizados(columns, rows)
     get = lambda r, c: r[idx[c]] if c in idx else None
 
-    def _is_ativo(r):
-        if "SITUACAO" in idx:
-            return str(get(r, "SITUACAO") or "").strip().upper() != "I"
-        if "CADASTRO_VALIDO" in idx:
-            return str(get(r, "CADASTRO_VALIDO") or "").strip().upper() != "N"
-        return True
-
-    sugestoes = []
-
-    def add(cod, campo, valor, motivo):
-        if cod is None:
-            return
-        sugestoes.append((cod, campo, valor, motivo))
-
-    for r in rows:
-        if not _is_ativo(r):
+    posicoes, nomes, conjuntos, emails, fones, secundarias = [], [], [], [], [], []
+    for pos, r in enumerate(rows):
+        if not documentos.ativo[pos]:
             continue
+        canonico = _nome_canonico(get(r, "NOME")) or _nome_canonico(get(r, "NOMEFANTASIA"))
+        posicoes.append(pos)
+        nomes.append(canonico)
+        conjuntos.append(_trigramas(canonico) if canonico else [])
+        emails.append(str(get(r, "EMAIL") or "").strip().lower())
+        fone = _somente_digitos(get(r, "FONE1"))
+        fones.append(fone if len(fone) >= 8 else "")
+        secundarias.append(_somente_digitos(get(r, "CEP")) or str(get(r, "UF") or "").strip().upper())
+
+    if tarefa:
+        tarefa.reportar(texto="Calculando assinaturas dos nomes...")
+    com_nome = [i for i, c in enumerate(conjuntos) if c]
+    assinaturas = _assinaturas_minhash([conjuntos[i] for i in com_nome], tarefa)
+    por_nome = {(com_nome[i], com_nome[j]) for i, j in _pares_lsh(assinaturas, tarefa)}
+    por_nome |= _pares_nomes_iguais(nomes, secundarias)
+    por_email = _pares_bloco(emails)
+    por_fone = _pares_bloco(fones)
+
+    def documento(i):
+        pos = posicoes[i]
+        return documentos.cpf[pos] or documentos.cnpj[pos]
+
+    # Trigramas como frozenset montados uma vez por nome, só para os que aparecem em pares
+    trigramas = {}
+
+    def conjunto(i):
+        c = trigramas.get(i)
+        if c is None:
+            c = trigramas[i] = frozenset(conjuntos[i])
+        return c
+
+    def similaridade(i, j):
+        a, b = conjunto(i), conjunto(j)
+        if not a or not b:
+            return 0.0
+        comuns = len(a & b)
+        return comuns / (len(a) + len(b) - comuns)
+
+    candidatos = por_nome | por_email | por_fone
+    total = len(candidatos)
+    resultado = []
+    for feitos, (i, j) in enumerate(candidatos, 1):
+        if tarefa and feitos % 20000 == 0:
+            tarefa.reportar(feitos, total, f"Comparando nomes: {feitos}/{total} pares...")
+        nota = similaridade(i, j) if (i, j) in por_nome else None
+        motivos = [m for m, ok in (
+            ("nome", nota is not None and nota >= limiar),
+            ("e-mail", (i, j) in por_email),
+            ("telefone", (i, j) in por_fone),
+        ) if ok]
+        if not motivos:
+            continue
+        doc_i, doc_j = documento(i), documento(j)
+        if doc_i and doc_j and doc_i != doc_j:
+            continue
+        ri, rj = rows[posicoes[i]], rows[posicoes[j]]
+        cod_i, cod_j = get(ri, "CODPESSOA"), get(rj, "CODPESSOA")
+        if _chave_cod(cod_j) < _chave_cod(cod_i):
+            ri, rj, cod_i, cod_j = rj, ri, cod_j, cod_i
+        nome_i = get(ri, "NOME") or get(ri, "NOMEFANTASIA") or ""
+        nome_j = get(rj, "NOME") or get(rj, "NOMEFANTASIA") or ""
+        nota = None if nota is None else round(nota, 2)
+        resultado.append((nota, cod_i, nome_i, cod_j, nome_j, ", ".join(motivos)))
+    resultado.sort(key=lambda p: (p[0] is None, -(p[0] or 0), _chave_cod(p[1]), _chave_cod(p[3])))
+    return resultado
+
+# Execução em segundo plano: o trabalho roda em threads do pool e o resultado volta
+# para a thread do Tk pelo laço de root.after, único lugar onde widgets são tocados
+class TarefaCancelada(Exception):
+    pass
+
+class Tarefa:
+    def __init__(self, nome):
+        self.nome = nome
+        self._cancelada = threading.Event()
+        self.iniciada = False
+        self.feitos = 0
+        self.total = None
+        self.texto = ""
+
+    @property
+    def cancelada(self):
+        return self._cancelada.is_set()
+
+    def cancelar(self):
+        self._cancelada.set()
+
+    def verificar_cancelamento(self):
+        if self._cancelada.is_set():
+            raise TarefaCancelada(self.nome)
+
+    def reportar(self, feitos=None, total=None, texto=None):
+        if feitos is not None:
+            self.feitos = feitos
+        if total is not None:
+            self.total = total
+        if texto is not None:
+            self.texto = texto
+        self.verificar_cancelamento()
+
+    def acompanhar(self, linhas, total=None, intervalo=1000):
+        # Repassa as linhas contando o progresso e checando o cancelamento a cada lote
+        if total is not None:
+            self.total = total
+        feitos = 0
+        for linha in linhas:
+            feitos += 1
+            if feitos % intervalo == 0:
+                self.reportar(feitos)
+            yield linha
+        self.feitos = feitos
+
+class ExecutorTarefas:
+    def __init__(self, root, max_workers=2, ao_atualizar=None, intervalo_ms=100):
+        self.root = root
+        self.ao_atualizar = ao_atualizar
+        self.intervalo_ms = intervalo_ms
+        self.pendentes = []
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="cadastros")
+        self._concluidas = queue.Queue()
+        self._encerrado = False
+        root.after(intervalo_ms, self._processar)
+
+    def submeter(self, nome, trabalho, ao_concluir=None, ao_falhar=None):
+        tarefa = Tarefa(nome)
+        self.pendentes.append(tarefa)
+
+        def _executar():
+            tarefa.iniciada = True
+            try:
+                tarefa.verificar_cancelamento()
+                resultado = (True, trabalho(tarefa))
+            except Exception as e:
+                resultado = (False, e)
+            self._concluidas.put((tarefa, resultado, ao_concluir, ao_falhar))
 
-        cod = get(r, "CODPESSOA")
-        nome = get(r, "NOME")
-        nomefantasia = get(r, "NOMEFANTASIA")
-        tipo = (get(r, "TIPO") or "").strip().upper()
-
-        cpf_raw = get(r, "CPF")
-        cnpj_raw = get(r, "CGC")
-
-        cpf = _limpar_documento(cpf_raw)
-        cnpj = _limpar_documento(cnpj_raw)
-
-        if not str(nome or "").strip() and str(nomefantasia or "").strip():
-            add(cod, "NOME", str(nomefantasia).strip(), "Nome vazio; usar Nome fantasia")
-
-        if cpf_raw and cpf and str(cpf_raw).strip() != cpf:
-            add(cod, "CPF", cpf, "Normalizar CPF (remover caracteres)")
-        if cnpj_raw and cnpj and str(cnpj_raw).strip() != cnpj:
-            add(cod, "CGC", cnpj, "Normalizar CNPJ (remover caracteres)")
-
-        if tipo == "F" and cnpj_raw:
-            add(cod, "CGC", None, "Tipo F não deve ter CNPJ")
-        if tipo == "J" and cpf_raw:
-            add(cod, "CPF", None, "Tipo J não deve ter CPF")
+        self._pool.submit(_executar)
+        return tarefa
 
-    return sugestoes
+    def em_execucao(self):
+        return next((t for t in self.pendentes if t.iniciada), None)
 
-def launch_gui():
+    def _processar(self):
+        if self._encerrado:
+            return
+        while True:
+            try:
+                tarefa, (ok, valor), ao_concluir, ao_falhar = self._concluidas.get_nowait()
+            except queue.Empty:
+                break
+            if tarefa in self.pendentes:
+                self.pendentes.remove(tarefa)
+            try:
+                if ok and ao_concluir:
+                    ao_concluir(valor)
+                elif not ok and ao_falhar:
+                    ao_falhar(valor)
+            except Exception:
+                self.root.report_callback_exception(*sys.exc_info())
+        if self.ao_atualizar:
+            self.ao_atualizar(self)
+        self.root.after(self.intervalo_ms, self._processar)
+
+    def cancelar_todas(self):
+        for tarefa in list(self.pendentes):
+            tarefa.cancelar()
+
+    def encerrar(self):
+        self._encerrado = True
+        self.cancelar_todas()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+# Aplicação em lote: um UPDATE preparado por conjunto de colunas, executado com executemany
+TAMANHO_LOTE_UPDATE = int(os.getenv("PESSOAS_TAMANHO_LOTE", "500"))
+
+def aplicar_sugestoes_em_lote(con, sugestoes, tamanho_lote=TAMANHO_LOTE_UPDATE, progresso=None):
+    por_cadastro = {}
+    for cod, campo, valor, _ in sugestoes:
+        por_cadastro.setdefault(cod, {})[campo] = valor
+
+    por_assinatura = {}
+    for cod, campos in por_cadastro.items():
+        cols = tuple(sorted(campos))
+        por_assinatura.setdefault(cols, []).append((*[campos[c] for c in cols], int(cod)))
+
+    total = len(por_cadastro)
+    feitos = 0
+    cur = con.cursor()
+    for cols, params in por_assinatura.items():
+        sql = "UPDATE PESSOA SET " + ", ".join(f"{c}=?" for c in cols) + " WHERE CODPESSOA=?"
+        preparado = cur.prep(sql)
+        for i in range(0, len(params), tamanho_lote):
+            lote = params[i:i + tamanho_lote]
+            cur.executemany(preparado, lote)
+            # Commit retentor: grava o lote sem perder o statement preparado
+            con.commit(retaining=True)
+            feitos += len(lote)
+            if progresso:
+                progresso(feitos, total)
+    con.commit()
+    return por_cadastro
+
+def launch_gui(medir_inicio=False):
     root = tk.Tk()
     root.title("Sistema de Gestão de Cadastros - Firebird")
     root.state('zoomed')  # Maximizar janela
@@ -308,19 +2153,47 @@ def launch_gui():
     status_var = tk.StringVar(value="Aguardando conexão...")
     api_url_var = tk.StringVar(value=API_URL_TEMPLATE)
 
+    def _abridor_conexao():
+        # Lê os campos na thread do Tk; o retorno pode ser usado pelas tarefas em segundo plano
+        parametros = (
+            entries["Host"].get().strip(),
+            entries["Porta"].get().strip(),
+            entries["Usuário"].get().strip(),
+            entries["Senha"].get(),
+            entries["Database"].get().strip(),
+        )
+        return lambda: _pool_conexoes.conexao(*parametros)
+
+    def _dsn_atual():
+        return _montar_dsn(
+            entries["Host"].get().strip(),
+            entries["Porta"].get().strip(),
+            entries["Database"].get().strip(),
+        )
+
+    dados_pessoas = DadosPessoas()
+
+    # Abas de qualidade: o motor único roda uma vez sobre o retrato e o resultado
+    # fica guardado até os dados mudarem
+    def _analise(abrir, dsn, tarefa):
+        return dados_pessoas.analise(abrir, dsn, tarefa.acompanhar, PROCESSOS_ANALISE)
+
     def testar_conexao():
-        try:
-            con = get_connection(
-                entries["Host"].get().strip(),
-                entries["Porta"].get().strip(),
-                entries["Usuário"].get().strip(),
-                entries["Senha"].get(),
-                entries["Database"].get().strip(),
+        abrir = _abridor_conexao()
+
+        def trabalho(tarefa):
+            with abrir():
+                pass
+            return _pool_conexoes.estatisticas()
+
+        def concluir(est):
+            dados_pessoas.invalidar()
+            status_var.set(
+                f"Conexão realizada com sucesso. "
+                f"(pool: {est['hits']} reaproveitadas / {est['misses']} novas)"
             )
-            con.close()
-            status_var.set("Conexão realizada com sucesso.")
-        except Exception as e:
-            status_var.set(f"Falha na conexão: {e}")
+
+        _em_segundo_plano("Conectando", trabalho, concluir, "Falha na conexão")
 
     style = ttk.Style(root)
     style.configure("Destaque.TButton", font=("Segoe UI", 10, "bold"))
@@ -336,6 +2209,51 @@ def launch_gui():
         row=0, column=1, sticky="w"
     )
 
+    progresso_bar = ttk.Progressbar(actions_frame, length=180, mode="determinate")
+    progresso_bar.grid(row=0, column=3, padx=(8, 0))
+    fila_var = tk.StringVar(value="")
+    ttk.Label(actions_frame, textvariable=fila_var, width=14).grid(row=0, column=4, padx=(8, 0))
+
+    def _atualizar_progresso(executor):
+        tarefa = executor.em_execucao()
+        fila = len(executor.pendentes)
+        fila_var.set(f"Fila: {fila}" if fila else "")
+        if tarefa is None:
+            progresso_bar.stop()
+            progresso_bar.configure(mode="determinate", value=0)
+            return
+        if tarefa.total:
+            progresso_bar.stop()
+            progresso_bar.configure(mode="determinate", maximum=tarefa.total, value=tarefa.feitos)
+        elif str(progresso_bar.cget("mode")) != "indeterminate":
+            progresso_bar.configure(mode="indeterminate")
+            progresso_bar.start(15)
+        if tarefa.texto:
+            status_var.set(tarefa.texto)
+
+    tarefas = ExecutorTarefas(root, ao_atualizar=_atualizar_progresso)
+
+    def cancelar_tarefas():
+        tarefas.cancelar_todas()
+        status_var.set("Cancelando tarefas em andamento...")
+
+    ttk.Button(actions_frame, text="✖ Cancelar", command=cancelar_tarefas).grid(
+        row=0, column=5, padx=(8, 0)
+    )
+
+    def _em_segundo_plano(nome, trabalho, ao_concluir, mensagem_falha, ao_falhar=None):
+        status_var.set(f"{nome}...")
+
+        def falhar(e):
+            if ao_falhar:
+                ao_falhar(e)
+            if isinstance(e, TarefaCancelada):
+                status_var.set(f"{nome}: cancelado.")
+            else:
+                status_var.set(f"{mensagem_falha}: {e}")
+
+        return tarefas.submeter(nome, trabalho, ao_concluir, falhar)
+
     root.columnconfigure(1, weight=1)
 
     notebook = ttk.Notebook(root)
@@ -375,7 +2293,18 @@ def launch_gui():
     tree = ttk.Treeview(table_frame, show="headings")
     vsb = ttk.Scrollbar(table_frame, orient="vertical", command=tree.yview)
     hsb = ttk.Scrollbar(table_frame, orient="horizontal", command=tree.xview)
-    tree.configure(yscrollcommand=vsb.set, xscrollcommand=hsb.set)
+
+    # Estado da paginação da aba Pessoas
+    paginacao = {"filtro": "", "ultimo_cod": None, "fim": True, "carregando": False, "total": 0, "geracao": 0}
+
+    def _on_tree_scroll(primeiro, ultimo):
+        vsb.set(primeiro, ultimo)
+        # Busca a próxima página quando o usuário chega perto do fim da lista
+        if float(ultimo) >= 0.9 and not paginacao["fim"] and not paginacao["carregando"]:
+            paginacao["carregando"] = True
+            root.after_idle(carregar_proxima_pagina)
+
+    tree.configure(yscrollcommand=_on_tree_scroll, xscrollcommand=hsb.set)
 
     tree.grid(row=0, column=0, sticky="nsew")
     vsb.grid(row=0, column=1, sticky="ns")
@@ -425,15 +2354,17 @@ def launch_gui():
         if not cod:
             messagebox.showwarning("Atenção", "Selecione um registro.")
             return
-        try:
-            con = get_connection(
-                entries["Host"].get().strip(),
-                entries["Porta"].get().strip(),
-                entries["Usuário"].get().strip(),
-                entries["Senha"].get(),
-                entries["Database"].get().strip(),
-            )
-            try:
+        campos = {
+            "NOME": edit_vars["NOME"].get().strip(),
+            "NOMEFANTASIA": edit_vars["NOMEFANTASIA"].get().strip(),
+            "EMAIL": edit_vars["EMAIL"].get().strip(),
+            "FONE1": edit_vars["FONE1"].get().strip(),
+            "ID_ROYALTIES": edit_vars["ID_ROYALTIES"].get().strip() or None,
+        }
+        abrir = _abridor_conexao()
+
+        def trabalho(tarefa):
+            with abrir() as con:
                 cur = con.cursor()
                 cur.execute(
                     """
@@ -441,22 +2372,15 @@ def launch_gui():
                     SET NOME=?, NOMEFANTASIA=?, EMAIL=?, FONE1=?, ID_ROYALTIES=?
                     WHERE CODPESSOA=?
                     """,
-                    (
-                        edit_vars["NOME"].get().strip(),
-                        edit_vars["NOMEFANTASIA"].get().strip(),
-                        edit_vars["EMAIL"].get().strip(),
-                        edit_vars["FONE1"].get().strip(),
-                        edit_vars["ID_ROYALTIES"].get().strip() or None,
-                        int(cod),
-                    ),
+                    (*campos.values(), int(cod)),
                 )
                 con.commit()
-            finally:
-                con.close()
-            on_load()
+
+        def concluir(_):
+            _refletir_alteracao(cod, campos, dados_pessoas.atualizar_linha(cod, campos))
             status_var.set("Registro atualizado com sucesso.")
-        except Exception as e:
-            status_var.set(f"Falha ao atualizar: {e}")
+
+        _em_segundo_plano("Atualizando registro", trabalho, concluir, "Falha ao atualizar")
 
     def _campo_inativacao_disponivel(columns):
         if "SITUACAO" in columns:
@@ -511,31 +2435,29 @@ def launch_gui():
             if not inativacao:
                 return
             campo, val_inativo, val_ativo = inativacao
-            try:
-                con = get_connection(
-                    entries["Host"].get().strip(),
-                    entries["Porta"].get().strip(),
-                    entries["Usuário"].get().strip(),
-                    entries["Senha"].get(),
-                    entries["Database"].get().strip(),
-                )
-                try:
+            novo_valor = val_inativo if inativo_var.get() else val_ativo
+            abrir = _abridor_conexao()
+
+            def trabalho(tarefa):
+                with abrir() as con:
                     cur = con.cursor()
                     cur.execute(
                         f"UPDATE PESSOA SET {campo}=? WHERE CODPESSOA=?",
                         (
-                            val_inativo if inativo_var.get() else val_ativo,
+                            novo_valor,
                             int(cod),
                         ),
                     )
                     con.commit()
-                finally:
-                    con.close()
-                on_load()
+
+            def concluir(_):
+                alterados = dados_pessoas.atualizar_linha(cod, {campo: novo_valor})
+                _refletir_alteracao(cod, {campo: novo_valor}, alterados)
                 status_var.set("Configurações salvas com sucesso.")
-                top.destroy()
-            except Exception as e:
-                status_var.set(f"Falha ao salvar configurações: {e}")
+                if top.winfo_exists():
+                    top.destroy()
+
+            _em_segundo_plano("Salvando configurações", trabalho, concluir, "Falha ao salvar configurações")
 
         ttk.Button(top, text="Salvar configurações", command=salvar_configuracoes).pack(
             anchor="e", padx=10, pady=10
@@ -548,46 +2470,31 @@ def launch_gui():
         row=3, column=0, columnspan=4, pady=4
     )
 
-    def _buscar_cgc_por_cod(cod):
-        con = get_connection(
-            entries["Host"].get().strip(),
-            entries["Porta"].get().strip(),
-            entries["Usuário"].get().strip(),
-            entries["Senha"].get(),
-            entries["Database"].get().strip(),
-        )
-        try:
-            cur = con.cursor()
-            cur.execute("SELECT CGC FROM PESSOA WHERE CODPESSOA = ?", (int(cod),))
-            row = cur.fetchone()
-            return row[0] if row else ""
-        finally:
-            con.close()
-
-    _requisicoes_recentes = deque(maxlen=3)  # Últimas 3 requisições
-    _MIN_INTERVALO = 20  # 20 segundos
+    def _buscar_cgc_por_cod(cod, ao_encontrar):
+        abrir = _abridor_conexao()
 
-    def _pode_fazer_requisicao():
-        agora = time.time()
-        if len(_requisicoes_recentes) < 3:
-            return True
-        # Verificar se passaram 60 segundos desde a primeira das últimas 3
-        return (agora - _requisicoes_recentes[0]) >= 60
+        def trabalho(tarefa):
+            with abrir() as con:
+                cur = con.cursor()
+                cur.execute("SELECT CGC FROM PESSOA WHERE CODPESSOA = ?", (int(cod),))
+                row = cur.fetchone()
+                return row[0] if row else ""
 
-    def _registrar_requisicao():
-        _requisicoes_recentes.append(time.time())
+        _em_segundo_plano("Buscando CNPJ do cadastro", trabalho, ao_encontrar, "Falha ao buscar CNPJ")
 
-    def atualizar_cnpj_api(cod=None):
+    def atualizar_cnpj_api(cod=None, ao_terminar=None):
         cod = (str(cod).strip() if cod is not None else edit_vars["CODPESSOA"].get().strip())
         if not cod:
             messagebox.showwarning("Atenção", "Selecione um registro.")
             return
 
-        if cod and cod != edit_vars.get("CODPESSOA", tk.StringVar()).get().strip():
-            cgc = _buscar_cgc_por_cod(cod)
+        if cod != edit_vars["CODPESSOA"].get().strip():
+            # Cadastro de outra aba: o CGC vem da base, fora da thread do Tk
+            _buscar_cgc_por_cod(cod, lambda cgc: _consultar_cnpj_api(cod, cgc, ao_terminar))
         else:
-            cgc = edit_vars.get("CGC").get().strip() if "CGC" in edit_vars else ""
+            _consultar_cnpj_api(cod, edit_vars["CGC"].get().strip() if "CGC" in edit_vars else "", ao_terminar)
 
+    def _consultar_cnpj_api(cod, cgc, ao_terminar=None):
         if not cgc:
             messagebox.showwarning("Atenção", "CNPJ não encontrado no cadastro selecionado.")
             return
@@ -597,274 +2504,144 @@ def launch_gui():
             messagebox.showwarning("Atenção", "CNPJ inválido.")
             return
 
-        if not _pode_fazer_requisicao():
-            aguardar = 60 - (time.time() - _requisicoes_recentes[0])
-            messagebox.showwarning(
-                "Aguarde", 
-                f"Limite de 3 requisições por minuto.\nAguarde {int(aguardar)} segundos."
-            )
-            return
-        
-        _registrar_requisicao()
-        try:
-            if cnpj in _cache_cnpj:
-                cache_data = _cache_cnpj[cnpj]
-                if time.time() - cache_data['timestamp'] < 2592000:
-                    data = cache_data['data']
-                    messagebox.showinfo("Info", "Dados recuperados do cache local.")
-                else:
-                    raise KeyError("Cache expirado")
-            else:
-                raise KeyError("Não está em cache")
-        except KeyError:
-            try:
-                # Substituir URL fixa por template configurável
-                url = _build_api_url(api_url_var.get(), cnpj)
-                req = urllib.request.Request(url)
-                req.add_header('User-Agent', 'Mozilla/5.0')
-                with urllib.request.urlopen(req, timeout=15) as resp:
-                    data = json.loads(resp.read().decode("utf-8"))
-                _cache_cnpj[cnpj] = {
-                    'timestamp': time.time(),
-                    'data': data
-                }
-                _salvar_cache()
-            except urllib.error.HTTPError as e:
+        url_template = api_url_var.get()
+        abrir, dsn = _abridor_conexao(), _dsn_atual()
+
+        # Consulta, extração e gravação rodam fora da thread do Tk
+        def trabalho(tarefa):
+            tarefa.reportar(texto=f"Consultando CNPJ {cnpj}...")
+            # Sem ficha no limitador a consulta avulsa não espera: o usuário é avisado
+            data, do_cache = consultar_cnpj_api(cnpj, url_template, limitador_api(url_template), esperar=False)
+            tarefa.verificar_cancelamento()
+            dados = extrair_dados_cnpj(data)
+
+            with abrir() as con:
+                # Metadados da PESSOA: uma consulta ao catálogo por sessão
+                campos_update = campos_atualizacao_cnpj(dados, colunas_pessoa(con, dsn))
+                gravar_campos_cnpj(con.cursor(), [([cod], campos_update)])
+                con.commit()
+            return do_cache, campos_update, mensagem_dados_cnpj(dados)
+
+        def concluir(resultado):
+            do_cache, campos_update, info_msg = resultado
+            if do_cache:
+                messagebox.showinfo("Info", "Dados recuperados do cache local.")
+            campos = {c: v for c, v in campos_update if v is not None}
+            _refletir_alteracao(cod, campos, dados_pessoas.atualizar_linha(cod, campos))
+            messagebox.showinfo("Sucesso", info_msg)
+            status_var.set("✅ Cadastro atualizado via API com dados completos.")
+            if ao_terminar:
+                ao_terminar()
+
+        def falhar(e):
+            if isinstance(e, TarefaCancelada):
+                status_var.set("Consulta à API CNPJ cancelada.")
+            elif isinstance(e, LimiteApiExcedido):
+                messagebox.showwarning("Aguarde", str(e))
+                status_var.set("Limite de requisições da API atingido.")
+            elif isinstance(e, CnpjSemDados):
+                messagebox.showwarning("CNPJ sem dados", str(e))
+                status_var.set(str(e))
+            elif isinstance(e, ErroHttp):
                 if e.code == 429:
                     messagebox.showerror("Limite Atingido", "Muitas requisições. Aguarde alguns minutos e tente novamente.")
                 else:
                     messagebox.showerror("Erro HTTP", f"Erro {e.code}: {e.reason}")
                 status_var.set(f"Falha ao consultar API CNPJ: HTTP {e.code}")
-                return
-            except Exception as e:
+            else:
                 messagebox.showerror("Erro", f"Falha ao consultar API CNPJ:\n{str(e)}")
                 status_var.set(f"Falha ao consultar API CNPJ: {e}")
-                return
 
-        # === Extrair TODOS os dados da BrasilAPI ===
-        nome = data.get("razao_social", "")
-        fantasia = data.get("nome_fantasia", "")
-        
-        # Estabelecimento
-        estabelecimento = data.get("estabelecimento", {})
-        if not fantasia:
-            fantasia = estabelecimento.get("nome_fantasia", "")
-        
-        # Email
-        email = estabelecimento.get("email", "")
-        
-        # Telefones
-        ddd1 = estabelecimento.get("ddd1", "")
-        tel1 = estabelecimento.get("telefone1", "")
-        ddd2 = estabelecimento.get("ddd2", "")
-        tel2 = estabelecimento.get("telefone2", "")
-        
-        fone1 = f"{ddd1}{tel1}".replace(" ", "").replace("-", "").replace("(", "").replace(")", "") if ddd1 or tel1 else ""
-        fone2 = f"{ddd2}{tel2}".replace(" ", "").replace("-", "").replace("(", "").replace(")", "") if ddd2 or tel2 else ""
-        
-        # Endereço completo
-        tipo_logradouro = estabelecimento.get("tipo_logradouro", "")
-        logradouro = estabelecimento.get("logradouro", "")
-        numero = estabelecimento.get("numero", "")
-        complemento = estabelecimento.get("complemento", "")
-        bairro = estabelecimento.get("bairro", "")
-        
-        # Cidade/Estado
-        cidade = estabelecimento.get("cidade", {})
-        municipio = cidade.get("nome", "") if isinstance(cidade, dict) else ""
-        cod_municipio = cidade.get("ibge_id", "") if isinstance(cidade, dict) else ""
-        
-        estado = estabelecimento.get("estado", {})
-        uf = estado.get("sigla", "") if isinstance(estado, dict) else ""
-        
-        # CEP
-        cep = (estabelecimento.get("cep", "") or "").replace(".", "").replace("-", "")
-        
-        # Montar endereço completo
-        nome_rua = f"{tipo_logradouro} {logradouro}".strip() if tipo_logradouro else logradouro
-        if numero:
-            nome_rua = f"{nome_rua}, {numero}" if nome_rua else numero
-        
-        # Dados adicionais
-        situacao_cadastral = data.get("descricao_situacao_cadastral", "")
-        data_situacao = data.get("data_situacao_cadastral", "")
-        natureza_juridica = data.get("natureza_juridica", "")
-        porte = data.get("porte", "")
-        data_abertura = data.get("data_inicio_atividade", "")
-        cnae_fiscal = str(data.get("cnae_fiscal", ""))
-        cnae_fiscal_descricao = data.get("cnae_fiscal_descricao", "")
-
-        con = get_connection(
-            entries["Host"].get().strip(),
-            entries["Porta"].get().strip(),
-            entries["Usuário"].get().strip(),
-            entries["Senha"].get(),
-            entries["Database"].get().strip(),
-        )
-        try:
-            cur = con.cursor()
-            
-            # Verificar tamanho máximo dos campos
-            def verificar_tamanho_campo(nome_campo):
-                try:
-                    cur.execute(f"""
-                        SELECT f.RDB$FIELD_LENGTH
-                        FROM RDB$RELATION_FIELDS rf
-                        JOIN RDB$FIELDS f ON rf.RDB$FIELD_SOURCE = f.RDB$FIELD_NAME
-                        WHERE rf.RDB$RELATION_NAME = 'PESSOA' 
-                        AND rf.RDB$FIELD_NAME = '{nome_campo}'
-                    """)
-                    resultado = cur.fetchone()
-                    return resultado[0] if resultado else None
-                except:
-                    return None
-            
-            # Limitar tamanhos dos campos
-            tamanho_nome = verificar_tamanho_campo('NOME') or 100
-            tamanho_fantasia = verificar_tamanho_campo('NOMEFANTASIA') or 100
-            tamanho_email = verificar_tamanho_campo('EMAIL') or 100
-            tamanho_rua = verificar_tamanho_campo('NOME_RUA') or 100
-            tamanho_complemento = verificar_tamanho_campo('COMPLEMENTO') or 50
-            tamanho_bairro = verificar_tamanho_campo('BAIRRO') or 50
-            
-            nome = nome[:tamanho_nome] if nome else ""
-            fantasia = fantasia[:tamanho_fantasia] if fantasia else ""
-            email = email[:tamanho_email] if email else ""
-            nome_rua = nome_rua[:tamanho_rua] if nome_rua else ""
-            complemento = complemento[:tamanho_complemento] if complemento else ""
-            bairro = bairro[:tamanho_bairro] if bairro else ""
-            
-            # Verificar campos disponíveis
-            cur.execute("SELECT FIRST 1 RDB$FIELD_NAME FROM RDB$RELATION_FIELDS WHERE RDB$RELATION_NAME='PESSOA' AND RDB$FIELD_NAME='ATUALIZADO_API'")
-            tem_campo_api = cur.fetchone() is not None
-            
-            cur.execute("SELECT FIRST 1 RDB$FIELD_NAME FROM RDB$RELATION_FIELDS WHERE RDB$RELATION_NAME='PESSOA' AND RDB$FIELD_NAME='FONE2'")
-            tem_fone2 = cur.fetchone() is not None
-            
-            # Campos básicos obrigatórios
-            campos_update = [
-                ("NOME", nome),
-                ("NOMEFANTASIA", fantasia),
-                ("EMAIL", email),
-                ("FONE1", fone1),
-                ("NOME_RUA", nome_rua),
-                ("RUA_NUMERO", numero),
-                ("COMPLEMENTO", complemento),
-                ("BAIRRO", bairro),
-                ("CEP", cep),
-            ]
-            
-            # Adicionar FONE2 se existir
-            if tem_fone2 and fone2:
-                campos_update.append(("FONE2", fone2))
-            
-            # Adicionar flag API se existir
-            if tem_campo_api:
-                campos_update.append(("ATUALIZADO_API", "S"))
-            
-            # Verificar e adicionar campos opcionais
-            campos_opcionais = [
-                ("MUNICIPIO", municipio),
-                ("UF", uf),
-                ("COD_MUNICIPIO", cod_municipio),
-                ("SITUACAO_CADASTRAL", situacao_cadastral),
-                ("DATA_SITUACAO", data_situacao),
-                ("NATUREZA_JURIDICA", natureza_juridica),
-                ("PORTE", porte),
-                ("DATA_ABERTURA", data_abertura),
-                ("CNAE_FISCAL", cnae_fiscal),
-                ("CNAE_DESCRICAO", cnae_fiscal_descricao),
-            ]
-            
-            for campo, valor in campos_opcionais:
-                if valor:
-                    cur.execute(f"SELECT FIRST 1 RDB$FIELD_NAME FROM RDB$RELATION_FIELDS WHERE RDB$RELATION_NAME='PESSOA' AND RDB$FIELD_NAME='{campo}'")
-                    if cur.fetchone():
-                        campos_update.append((campo, valor))
-            
-            # Construir e executar SQL
-            set_clause = ", ".join([f"{campo}=COALESCE(?, {campo})" for campo, _ in campos_update])
-            valores = [valor for _, valor in campos_update]
-            valores.append(int(cod))
-            
-            sql = f"UPDATE PESSOA SET {set_clause} WHERE CODPESSOA=?"
-            cur.execute(sql, valores)
-            con.commit()
-        finally:
-            con.close()
-
-        on_load()
-        
-        # Mensagem detalhada de sucesso
-        info_msg = "✅ Cadastro atualizado via API BrasilAPI\n\n"
-        info_msg += "📋 DADOS CADASTRAIS\n"
-        info_msg += f"Razão Social: {nome or 'N/A'}\n"
-        info_msg += f"Nome Fantasia: {fantasia or 'N/A'}\n"
-        if situacao_cadastral:
-            info_msg += f"Situação: {situacao_cadastral}\n"
-        if cnae_fiscal:
-            info_msg += f"CNAE: {cnae_fiscal}"
-            if cnae_fiscal_descricao:
-                info_msg += f" - {cnae_fiscal_descricao}"
-            info_msg += "\n"
-        
-        info_msg += "\n📍 ENDEREÇO\n"
-        info_msg += f"{nome_rua or 'N/A'}\n"
-        if bairro:
-            info_msg += f"Bairro: {bairro}\n"
-        info_msg += f"Cidade/UF: {municipio or 'N/A'}/{uf or 'N/A'}\n"
-        if cep:
-            info_msg += f"CEP: {cep}\n"
-        
-        info_msg += "\n📞 CONTATO\n"
-        if fone1:
-            info_msg += f"Telefone 1: {fone1}\n"
-        if fone2:
-            info_msg += f"Telefone 2: {fone2}\n"
-        if email:
-            info_msg += f"Email: {email}"
-        else:
-            info_msg += "Email: N/A"
-        
-        messagebox.showinfo("Sucesso", info_msg)
-        status_var.set("✅ Cadastro atualizado via API com dados completos.")
+        status_var.set("Consultando API CNPJ...")
+        tarefas.submeter("Atualizar CNPJ via API", trabalho, concluir, falhar)
 
     ttk.Button(edit_frame, text="Atualizar CNPJ (API)", command=atualizar_cnpj_api).grid(
         row=4, column=0, columnspan=4, pady=4
     )
 
-    def on_load():
-        try:
-            con = get_connection(
-                entries["Host"].get().strip(),
-                entries["Porta"].get().strip(),
-                entries["Usuário"].get().strip(),
-                entries["Senha"].get(),
-                entries["Database"].get().strip(),
-            )
-            try:
-                columns, rows = fetch_people(con, filtro_var.get().strip())
-            finally:
-                con.close()
+    itens_pessoas = {}  # CODPESSOA -> item da Treeview, usado pela sincronização
+
+    def _inserir_pessoas(columns, rows, no_lugar=False):
+        # no_lugar: cadastros trazidos pela sincronização entram na posição do código
+        # (a lista é paginada por CODPESSOA), não no fim
+        idx_desc = columns.index("ROYALTIES_DESCRICAO") if "ROYALTIES_DESCRICAO" in columns else None
+        idx_cod = columns.index("CODPESSOA") if "CODPESSOA" in columns else None
+        chaves = sorted(itens_pessoas) if no_lugar and idx_cod is not None else None
+        for row in rows:
+            if idx_desc is not None and (row[idx_desc] is None or str(row[idx_desc]).strip() == ""):
+                row = list(row)
+                row[idx_desc] = "Sem descrição"
+                row = tuple(row)
+            posicao = "end"
+            if chaves is not None:
+                i = bisect.bisect_right(chaves, _chave_cod(row[idx_cod]))
+                if i < len(chaves):
+                    posicao = tree.index(itens_pessoas[chaves[i]])
+                chaves.insert(i, _chave_cod(row[idx_cod]))
+            item = tree.insert("", posicao, values=row)
+            if idx_cod is not None:
+                itens_pessoas[_chave_cod(row[idx_cod])] = item
+
+    def _status_paginacao():
+        sufixo = "" if paginacao["fim"] else " (role a lista para carregar mais)"
+        status_var.set(f"Carregadas {paginacao['total']} pessoas{sufixo}.")
 
+    def on_load():
+        filtro = filtro_var.get().strip()
+        abrir, dsn = _abridor_conexao(), _dsn_atual()
+        paginacao["carregando"] = True
+        paginacao["geracao"] += 1  # páginas pedidas antes deste filtro são descartadas
+        geracao = paginacao["geracao"]
+
+        def trabalho(tarefa):
+            with abrir() as con:
+                return fetch_people_pagina(con, filtro, dsn=dsn)
+
+        def concluir(resultado):
+            if geracao != paginacao["geracao"]:
+                return
+            columns, rows, ultimo_cod, fim = resultado
             tree.delete(*tree.get_children())
+            itens_pessoas.clear()
             tree["columns"] = columns
             for col in columns:
                 width = 220 if col in ("ROYALTIES_DESCRICAO", "NOME", "NOMEFANTASIA") else 120
                 tree.heading(col, text=col)
                 tree.column(col, width=width, minwidth=80, stretch=True)
 
-            idx_desc = columns.index("ROYALTIES_DESCRICAO") if "ROYALTIES_DESCRICAO" in columns else None
-            for row in rows:
-                if idx_desc is not None and (row[idx_desc] is None or str(row[idx_desc]).strip() == ""):
-                    row = list(row)
-                    row[idx_desc] = "Sem descrição"
-                    row = tuple(row)
-                tree.insert("", "end", values=row)
+            paginacao.update(filtro=filtro, ultimo_cod=ultimo_cod, fim=fim, carregando=False, total=len(rows))
+            _inserir_pessoas(columns, rows)
+            _status_paginacao()
+
+        def falhar(e):
+            paginacao.update(fim=True, carregando=False)
+
+        _em_segundo_plano("Carregando pessoas", trabalho, concluir, "Falha ao carregar", falhar)
+
+    def carregar_proxima_pagina():
+        filtro, apos_cod = paginacao["filtro"], paginacao["ultimo_cod"]
+        abrir, dsn = _abridor_conexao(), _dsn_atual()
+        geracao = paginacao["geracao"]
 
-            status_var.set(f"Carregadas {len(rows)} pessoas.")
-        except Exception as e:
-            status_var.set(f"Falha ao carregar: {e}")
+        def trabalho(tarefa):
+            with abrir() as con:
+                return fetch_people_pagina(con, filtro, apos_cod, dsn=dsn)
+
+        def concluir(resultado):
+            if geracao != paginacao["geracao"]:
+                return
+            columns, rows, ultimo_cod, fim = resultado
+            paginacao.update(ultimo_cod=ultimo_cod, fim=fim, carregando=False, total=paginacao["total"] + len(rows))
+            _inserir_pessoas(columns, rows)
+            _status_paginacao()
+
+        def falhar(e):
+            if geracao == paginacao["geracao"]:
+                paginacao.update(fim=True, carregando=False)
+
+        _em_segundo_plano(
+            "Carregando próxima página", trabalho, concluir, "Falha ao carregar próxima página", falhar
+        )
 
     ttk.Button(filtro_frame, text="Carregar/Filtrar", command=on_load).grid(
         row=0, column=3, padx=4
@@ -872,573 +2649,718 @@ def launch_gui():
 
     tree.bind("<<TreeviewSelect>>", carregar_selecao)
 
+    # Abas montadas que mostram dados derivados do cadastro (problemas, duplicados)
+    # registram aqui como se ajustar a uma edição e como se refazer depois de uma
+    # gravação em massa
+    ao_alterar_cadastro = []
+    ao_alterar_em_massa = []
+
+    # Edição de um cadastro: as telas são ajustadas só nas linhas afetadas, usando a
+    # análise em cache mantida incrementalmente, em vez de recarregar e reanalisar tudo
+    def _refletir_alteracao(cod, campos, alterados):
+        item = itens_pessoas.get(_chave_cod(cod))
+        tree_cols = list(tree["columns"])
+        if item is not None:
+            royalties_mudou = (
+                "ID_ROYALTIES" in campos
+                and "ID_ROYALTIES" in tree_cols
+                and "ROYALTIES_DESCRICAO" in tree_cols
+                and tree.set(item, "ID_ROYALTIES") != ("" if campos["ID_ROYALTIES"] is None else str(campos["ID_ROYALTIES"]))
+            )
+            for campo, valor in campos.items():
+                if campo in tree_cols:
+                    tree.set(item, campo, "" if valor is None else valor)
+            if royalties_mudou:
+                _atualizar_descricao_royalties(cod, item)
+
+        if alterados is None:
+            return
+        for refletir in ao_alterar_cadastro:
+            refletir(cod, alterados)
+
+    # Gravação em massa: o retrato já foi corrigido na thread de trabalho
+    # (atualizar_linhas); a lista só troca as linhas carregadas, sem voltar à primeira
+    # página, e as abas derivadas se refazem a partir de uma análise nova
+    def _refletir_alteracoes(por_cadastro):
+        for cod, campos in por_cadastro.items():
+            _refletir_alteracao(cod, campos, None)
+        for recarregar in ao_alterar_em_massa:
+            recarregar()
+
+    def _atualizar_descricao_royalties(cod, item):
+        # A descrição vem de outra tabela: relê só esta linha, pelo mesmo join da listagem,
+        # sem voltar a lista para a primeira página
+        abrir, dsn = _abridor_conexao(), _dsn_atual()
+
+        def trabalho(tarefa):
+            with abrir() as con:
+                return fetch_people(
+                    con, "", dsn=dsn, colunas=("CODPESSOA", "ID_ROYALTIES", "ROYALTIES_DESCRICAO"),
+                    condicao=("P.CODPESSOA = ?", [int(cod)]),
+                )
+
+        def concluir(resultado):
+            columns, rows = resultado
+            if rows and "ROYALTIES_DESCRICAO" in columns and tree.exists(item):
+                descricao = rows[0][columns.index("ROYALTIES_DESCRICAO")]
+                tree.set(item, "ROYALTIES_DESCRICAO", descricao if str(descricao or "").strip() else "Sem descrição")
+
+        _em_segundo_plano("Buscando descrição de royalties", trabalho, concluir, "Falha ao buscar royalties")
+
+    # As demais abas são montadas na primeira vez que são abertas: a janela sobe só
+    # com o formulário de conexão e a lista de pessoas
+    ao_abrir = {}  # aba -> recarga feita sempre que ela é selecionada
+
+    # Versão da análise que cada aba desenhou por último: voltar à aba sem que os dados
+    # tenham mudado não redesenha a Treeview (os botões sempre recarregam)
+    versoes_exibidas = {}
+
+    def _ja_exibida(aba, dsn):
+        versao = dados_pessoas.versao_analise(dsn)
+        return versao is not None and versoes_exibidas.get(aba) == (dsn, versao)
+
     # Atualização em massa
-    massa_tab.columnconfigure(0, weight=1)
-    massa_tab.rowconfigure(1, weight=1)
+    def _montar_massa():
+        massa_tab.columnconfigure(0, weight=1)
+        massa_tab.rowconfigure(1, weight=1)
 
-    ttk.Label(massa_tab, text="SQL de atualização em massa:").grid(
-        row=0, column=0, sticky="w", padx=8, pady=4
-    )
-    sql_text = tk.Text(massa_tab, height=8)
-    sql_text.grid(row=1, column=0, sticky="nsew", padx=8, pady=4)
+        ttk.Label(massa_tab, text="SQL de atualização em massa:").grid(
+            row=0, column=0, sticky="w", padx=8, pady=4
+        )
+        sql_text = tk.Text(massa_tab, height=8)
+        sql_text.grid(row=1, column=0, sticky="nsew", padx=8, pady=4)
 
-    def executar_sql_massa():
-        sql = sql_text.get("1.0", tk.END).strip()
-        if not sql:
-            messagebox.showwarning("Atenção", "Informe o SQL.")
-            return
-        if not messagebox.askyesno("Confirmação", "Deseja executar o SQL informado?"):
-            return
-        try:
-            con = get_connection(
-                entries["Host"].get().strip(),
-                entries["Porta"].get().strip(),
-                entries["Usuário"].get().strip(),
-                entries["Senha"].get(),
-                entries["Database"].get().strip(),
-            )
-            try:
-                cur = con.cursor()
-                cur.execute(sql)
-                con.commit()
-            finally:
-                con.close()
-            status_var.set("SQL executado com sucesso.")
-            on_load()
-        except Exception as e:
-            status_var.set(f"Falha ao executar SQL: {e}")
+        def executar_sql_massa():
+            sql = sql_text.get("1.0", tk.END).strip()
+            if not sql:
+                messagebox.showwarning("Atenção", "Informe o SQL.")
+                return
+            if not messagebox.askyesno("Confirmação", "Deseja executar o SQL informado?"):
+                return
+            abrir, dsn = _abridor_conexao(), _dsn_atual()
 
-    ttk.Button(massa_tab, text="Executar SQL", command=executar_sql_massa).grid(
-        row=2, column=0, pady=8
-    )
+            def trabalho(tarefa):
+                with abrir() as con:
+                    cur = con.cursor()
+                    cur.execute(sql)
+                    con.commit()
+
+            def concluir(_):
+                # SQL livre pode alterar qualquer linha: o retrato é descartado
+                dados_pessoas.invalidar()
+                if re.match(r"\s*(CREATE|ALTER|DROP|RECREATE)\b", sql, re.I):
+                    invalidar_cache_esquema(dsn)
+                status_var.set("SQL executado com sucesso.")
+                on_load()
+
+            _em_segundo_plano("Executando SQL", trabalho, concluir, "Falha ao executar SQL")
+
+        ttk.Button(massa_tab, text="Executar SQL", command=executar_sql_massa).grid(
+            row=2, column=0, pady=8
+        )
 
     # Aba Problemas
-    problemas_tab.columnconfigure(0, weight=1)
-    problemas_tab.rowconfigure(1, weight=1)
+    def _montar_problemas():
+        problemas_tab.columnconfigure(0, weight=1)
+        problemas_tab.rowconfigure(1, weight=1)
 
-    ttk.Label(problemas_tab, text="Lista de problemas nos cadastros:").grid(
-        row=0, column=0, sticky="w", padx=8, pady=4
-    )
+        ttk.Label(problemas_tab, text="Lista de problemas nos cadastros:").grid(
+            row=0, column=0, sticky="w", padx=8, pady=4
+        )
 
-    problemas_frame = ttk.Frame(problemas_tab)
-    problemas_frame.grid(row=1, column=0, sticky="nsew", padx=8, pady=4)
+        problemas_frame = ttk.Frame(problemas_tab)
+        problemas_frame.grid(row=1, column=0, sticky="nsew", padx=8, pady=4)
 
-    problemas_tree = ttk.Treeview(problemas_frame, show="headings")
-    p_vsb = ttk.Scrollbar(problemas_frame, orient="vertical", command=problemas_tree.yview)
-    p_hsb = ttk.Scrollbar(problemas_frame, orient="horizontal", command=problemas_tree.xview)
-    problemas_tree.configure(yscrollcommand=p_vsb.set, xscrollcommand=p_hsb.set)
+        problemas_tree = ttk.Treeview(problemas_frame, show="headings")
+        p_vsb = ttk.Scrollbar(problemas_frame, orient="vertical", command=problemas_tree.yview)
+        p_hsb = ttk.Scrollbar(problemas_frame, orient="horizontal", command=problemas_tree.xview)
+        problemas_tree.configure(yscrollcommand=p_vsb.set, xscrollcommand=p_hsb.set)
 
-    problemas_tree.grid(row=0, column=0, sticky="nsew")
-    p_vsb.grid(row=0, column=1, sticky="ns")
-    p_hsb.grid(row=1, column=0, sticky="ew")
+        problemas_tree.grid(row=0, column=0, sticky="nsew")
+        p_vsb.grid(row=0, column=1, sticky="ns")
+        p_hsb.grid(row=1, column=0, sticky="ew")
 
-    problemas_frame.columnconfigure(0, weight=1)
-    problemas_frame.rowconfigure(0, weight=1)
+        problemas_frame.columnconfigure(0, weight=1)
+        problemas_frame.rowconfigure(0, weight=1)
 
-    def carregar_problemas():
-        try:
-            con = get_connection(
-                entries["Host"].get().strip(),
-                entries["Porta"].get().strip(),
-                entries["Usuário"].get().strip(),
-                entries["Senha"].get(),
-                entries["Database"].get().strip(),
-            )
-            try:
-                columns, rows = fetch_people(con, "")
-            finally:
-                con.close()
+        def carregar_problemas():
+            abrir, dsn = _abridor_conexao(), _dsn_atual()
 
-            problemas = analisar_problemas(columns, rows)
-            problemas_tree.delete(*problemas_tree.get_children())
-            problemas_tree["columns"] = ["CODPESSOA", "NOME", "TIPO", "CPF_CNPJ", "ERRO"]
-            for col in problemas_tree["columns"]:
-                width = 240 if col in ("NOME", "ERRO") else 140
-                problemas_tree.heading(col, text=col)
-                problemas_tree.column(col, width=width, minwidth=80, stretch=True)
+            def trabalho(tarefa):
+                return _analise(abrir, dsn, tarefa).problemas
 
-            for item in problemas:
-                problemas_tree.insert("", "end", values=item)
+            def concluir(problemas):
+                problemas_tree.delete(*problemas_tree.get_children())
+                problemas_tree["columns"] = ["CODPESSOA", "NOME", "TIPO", "CPF_CNPJ", "ERRO"]
+                for col in problemas_tree["columns"]:
+                    width = 240 if col in ("NOME", "ERRO") else 140
+                    problemas_tree.heading(col, text=col)
+                    problemas_tree.column(col, width=width, minwidth=80, stretch=True)
 
-            status_var.set(f"Encontrados {len(problemas)} problemas.")
-        except Exception as e:
-            status_var.set(f"Falha ao analisar: {e}")
+                itens_problemas.clear()
+                for item in problemas:
+                    itens_problemas[_chave_cod(item[0])] = problemas_tree.insert("", "end", values=item)
 
-    ttk.Button(problemas_tab, text="Analisar cadastros", command=carregar_problemas).grid(
-        row=2, column=0, pady=8, padx=8, sticky="w"
-    )
+                status_var.set(f"Encontrados {len(problemas)} problemas.")
 
-    def abrir_ajuste_massa():
-        try:
-            con = get_connection(
-                entries["Host"].get().strip(),
-                entries["Porta"].get().strip(),
-                entries["Usuário"].get().strip(),
-                entries["Senha"].get(),
-                entries["Database"].get().strip(),
+            _em_segundo_plano("Analisando cadastros", trabalho, concluir, "Falha ao analisar")
+
+        itens_problemas = {}  # CODPESSOA -> item da aba Problemas
+
+        def _refletir_problemas(cod, alterados):
+            for cod_afetado, problema in alterados:
+                chave = _chave_cod(cod_afetado)
+                item = itens_problemas.get(chave)
+                if problema and item is not None:
+                    problemas_tree.item(item, values=problema)
+                elif problema and problemas_tree["columns"]:
+                    itens_problemas[chave] = problemas_tree.insert("", "end", values=problema)
+                elif item is not None:
+                    problemas_tree.delete(item)
+                    del itens_problemas[chave]
+
+        ao_alterar_cadastro.append(_refletir_problemas)
+
+        def _recarregar_problemas():
+            if problemas_tree["columns"]:
+                carregar_problemas()
+
+        ao_alterar_em_massa.append(_recarregar_problemas)
+
+        ttk.Button(problemas_tab, text="Analisar cadastros", command=carregar_problemas).grid(
+            row=2, column=0, pady=8, padx=8, sticky="w"
+        )
+
+        def abrir_ajuste_massa():
+            abrir, dsn = _abridor_conexao(), _dsn_atual()
+
+            def trabalho(tarefa):
+                return list(_analise(abrir, dsn, tarefa).sugestoes)
+
+            _em_segundo_plano(
+                "Gerando sugestões de ajuste", trabalho, _mostrar_ajuste_massa, "Falha no ajuste em massa"
             )
+
+        def _mostrar_ajuste_massa(sugestoes):
             try:
-                columns, rows = fetch_people(con, "")
-            finally:
-                con.close()
+                if not sugestoes:
+                    messagebox.showinfo("Ajuste em massa (IA)", "Nenhuma sugestão encontrada.")
+                    return
 
-            sugestoes = sugerir_ajustes_massa(columns, rows)
-            if not sugestoes:
-                messagebox.showinfo("Ajuste em massa (IA)", "Nenhuma sugestão encontrada.")
-                return
+                top = tk.Toplevel(root)
+                top.title("Ajuste em massa (IA) - Prévia")
+                top.geometry("900x500")
 
-            top = tk.Toplevel(root)
-            top.title("Ajuste em massa (IA) - Prévia")
-            top.geometry("900x500")
+                frame = ttk.Frame(top)
+                frame.pack(fill="both", expand=True, padx=8, pady=8)
 
-            frame = ttk.Frame(top)
-            frame.pack(fill="both", expand=True, padx=8, pady=8)
+                tree_adj = ttk.Treeview(frame, show="headings")
+                vsb = ttk.Scrollbar(frame, orient="vertical", command=tree_adj.yview)
+                hsb = ttk.Scrollbar(frame, orient="horizontal", command=tree_adj.xview)
+                tree_adj.configure(yscrollcommand=vsb.set, xscrollcommand=hsb.set)
 
-            tree_adj = ttk.Treeview(frame, show="headings")
-            vsb = ttk.Scrollbar(frame, orient="vertical", command=tree_adj.yview)
-            hsb = ttk.Scrollbar(frame, orient="horizontal", command=tree_adj.xview)
-            tree_adj.configure(yscrollcommand=vsb.set, xscrollcommand=hsb.set)
+                tree_adj["columns"] = ["CODPESSOA", "CAMPO", "VALOR_NOVO", "MOTIVO"]
+                for col in tree_adj["columns"]:
+                    width = 320 if col in ("VALOR_NOVO", "MOTIVO") else 140
+                    tree_adj.heading(col, text=col)
+                    tree_adj.column(col, width=width, minwidth=80, stretch=True)
 
-            tree_adj["columns"] = ["CODPESSOA", "CAMPO", "VALOR_NOVO", "MOTIVO"]
-            for col in tree_adj["columns"]:
-                width = 320 if col in ("VALOR_NOVO", "MOTIVO") else 140
-                tree_adj.heading(col, text=col)
-                tree_adj.column(col, width=width, minwidth=80, stretch=True)
+                for cod, campo, valor, motivo in sugestoes:
+                    tree_adj.insert("", "end", values=(cod, campo, valor if valor is not None else "", motivo))
 
-            for cod, campo, valor, motivo in sugestoes:
-                tree_adj.insert("", "end", values=(cod, campo, valor if valor is not None else "", motivo))
+                tree_adj.grid(row=0, column=0, sticky="nsew")
+                vsb.grid(row=0, column=1, sticky="ns")
+                hsb.grid(row=1, column=0, sticky="ew")
 
-            tree_adj.grid(row=0, column=0, sticky="nsew")
-            vsb.grid(row=0, column=1, sticky="ns")
-            hsb.grid(row=1, column=0, sticky="ew")
+                frame.columnconfigure(0, weight=1)
+                frame.rowconfigure(0, weight=1)
 
-            frame.columnconfigure(0, weight=1)
-            frame.rowconfigure(0, weight=1)
+                def aplicar_ajustes():
+                    if not messagebox.askyesno("Confirmação", "Deseja aplicar os ajustes sugeridos?"):
+                        return
+                    abrir = _abridor_conexao()
 
-            def aplicar_ajustes():
-                if not messagebox.askyesno("Confirmação", "Deseja aplicar os ajustes sugeridos?"):
-                    return
-                try:
-                    con = get_connection(
-                        entries["Host"].get().strip(),
-                        entries["Porta"].get().strip(),
-                        entries["Usuário"].get().strip(),
-                        entries["Senha"].get(),
-                        entries["Database"].get().strip(),
-                    )
-                    try:
-                        cur = con.cursor()
-                        por_cadastro = {}
-                        for cod, campo, valor, _ in sugestoes:
-                            por_cadastro.setdefault(cod, {})[campo] = valor
-
-                        for cod, campos in por_cadastro.items():
-                            cols = list(campos.keys())
-                            vals = [campos[c] for c in cols]
-                            sql = "UPDATE PESSOA SET " + ", ".join([f"{c}=?" for c in cols]) + " WHERE CODPESSOA=?"
-                            cur.execute(sql, (*vals, int(cod)))
-
-                        con.commit()
-                    finally:
-                        con.close()
-
-                    on_load()
-                    status_var.set(f"Ajustes aplicados: {len(sugestoes)}.")
-                    top.destroy()
-                except Exception as e:
-                    status_var.set(f"Falha ao aplicar ajustes: {e}")
+                    def trabalho(tarefa):
+                        def progresso(feitos, total):
+                            tarefa.reportar(feitos, total, f"Aplicando ajustes: {feitos}/{total} cadastros...")
 
-            ttk.Button(top, text="Aplicar ajustes (IA)", command=aplicar_ajustes).pack(
-                anchor="e", padx=8, pady=6
-            )
-        except Exception as e:
-            status_var.set(f"Falha no ajuste em massa: {e}")
+                        with abrir() as con:
+                            por_cadastro = aplicar_sugestoes_em_lote(con, sugestoes, progresso=progresso)
+                        dados_pessoas.atualizar_linhas(por_cadastro)
+                        return por_cadastro
 
-    def _atualizar_cnpj_api_problemas():
-        sel = problemas_tree.selection()
-        if not sel:
-            messagebox.showwarning("Atenção", "Selecione um cadastro na lista de problemas.")
-            return
-        cod = problemas_tree.item(sel[0], "values")[0]
-        atualizar_cnpj_api(cod)
+                    def concluir(por_cadastro):
+                        _refletir_alteracoes(por_cadastro)
+                        status_var.set(f"Ajustes aplicados: {len(sugestoes)}.")
+                        top.destroy()
 
-    ttk.Button(problemas_tab, text="Ajuste em massa (IA)", command=abrir_ajuste_massa).grid(
-        row=2, column=0, pady=8, padx=220, sticky="w"
-    )
-    ttk.Button(problemas_tab, text="Atualizar CNPJ (API)", command=_atualizar_cnpj_api_problemas).grid(
-        row=2, column=0, pady=8, padx=420, sticky="w"
-    )
+                    def falhar(e):
+                        # Lotes já gravados antes da falha/cancelamento: o retrato é descartado
+                        dados_pessoas.invalidar()
 
-    # --- Nova aba: Atualizar via API ---
-    api_tab.columnconfigure(0, weight=1)
-    api_tab.rowconfigure(2, weight=1)
+                    _em_segundo_plano("Aplicando ajustes", trabalho, concluir, "Falha ao aplicar ajustes", falhar)
 
-    ttk.Label(api_tab, text="URL da API (use {cnpj}):").grid(
-        row=0, column=0, sticky="w", padx=8, pady=4
-    )
-    ttk.Entry(api_tab, textvariable=api_url_var, width=80).grid(
-        row=0, column=0, sticky="e", padx=8, pady=4
-    )
+                ttk.Button(top, text="Aplicar ajustes (IA)", command=aplicar_ajustes).pack(
+                    anchor="e", padx=8, pady=6
+                )
+            except Exception as e:
+                status_var.set(f"Falha no ajuste em massa: {e}")
 
-    api_frame = ttk.Frame(api_tab)
-    api_frame.grid(row=1, column=0, sticky="nsew", padx=8, pady=4)
-    api_frame.columnconfigure(0, weight=1)
-    api_frame.rowconfigure(0, weight=1)
+        def _atualizar_cnpj_api_problemas():
+            sel = problemas_tree.selection()
+            if not sel:
+                messagebox.showwarning("Atenção", "Selecione um cadastro na lista de problemas.")
+                return
+            cod = problemas_tree.item(sel[0], "values")[0]
+            atualizar_cnpj_api(cod)
 
-    api_tree = ttk.Treeview(api_frame, show="headings", selectmode="browse")
-    api_vsb = ttk.Scrollbar(api_frame, orient="vertical", command=api_tree.yview)
-    api_hsb = ttk.Scrollbar(api_frame, orient="horizontal", command=api_tree.xview)
-    api_tree.configure(yscrollcommand=api_vsb.set, xscrollcommand=api_hsb.set)
+        ttk.Button(problemas_tab, text="Ajuste em massa (IA)", command=abrir_ajuste_massa).grid(
+            row=2, column=0, pady=8, padx=220, sticky="w"
+        )
+        ttk.Button(problemas_tab, text="Atualizar CNPJ (API)", command=_atualizar_cnpj_api_problemas).grid(
+            row=2, column=0, pady=8, padx=420, sticky="w"
+        )
 
-    api_tree.grid(row=0, column=0, sticky="nsew")
-    api_vsb.grid(row=0, column=1, sticky="ns")
-    api_hsb.grid(row=1, column=0, sticky="ew")
+    # --- Nova aba: Atualizar via API ---
+    def _montar_api():
+        api_tab.columnconfigure(0, weight=1)
+        api_tab.rowconfigure(2, weight=1)
 
-    def carregar_cnpjs_validos():
-        try:
-            con = get_connection(
-                entries["Host"].get().strip(),
-                entries["Porta"].get().strip(),
-                entries["Usuário"].get().strip(),
-                entries["Senha"].get(),
-                entries["Database"].get().strip(),
-            )
-            try:
-                columns, rows = fetch_people(con, "")
-            finally:
-                con.close()
+        ttk.Label(api_tab, text="URL da API (use {cnpj}):").grid(
+            row=0, column=0, sticky="w", padx=8, pady=4
+        )
+        ttk.Entry(api_tab, textvariable=api_url_var, width=80).grid(
+            row=0, column=0, sticky="e", padx=8, pady=4
+        )
 
-            # Filtrar apenas cadastros com CNPJ válido
-            idx = {c: i for i, c in enumerate(columns)}
-            cnpj_idx = idx.get("CGC")
-            cod_idx = idx.get("CODPESSOA")
-            nome_idx = idx.get("NOME")
-            fantasia_idx = idx.get("NOMEFANTASIA")
-            email_idx = idx.get("EMAIL")
-            fone_idx = idx.get("FONE1")
+        api_frame = ttk.Frame(api_tab)
+        api_frame.grid(row=1, column=0, sticky="nsew", padx=8, pady=4)
+        api_frame.columnconfigure(0, weight=1)
+        api_frame.rowconfigure(0, weight=1)
 
-            validos = []
-            for row in rows:
-                cnpj = row[cnpj_idx] if cnpj_idx is not None else ""
-                if cnpj and validar_cnpj(cnpj):
-                    validos.append(row)
-
-            # Exibir na treeview
-            api_tree.delete(*api_tree.get_children())
-            exibe_cols = ["CODPESSOA", "NOME", "CGC", "NOMEFANTASIA", "EMAIL", "FONE1"]
-            api_tree["columns"] = exibe_cols
-            for col in exibe_cols:
-                width = 220 if col in ("NOME", "NOMEFANTASIA") else 120
-                api_tree.heading(col, text=col)
-                api_tree.column(col, width=width, minwidth=80, stretch=True)
-
-            for row in validos:
-                api_tree.insert(
-                    "", "end",
-                    values=(
-                        row[cod_idx] if cod_idx is not None else "",
-                        row[nome_idx] if nome_idx is not None else "",
-                        row[cnpj_idx] if cnpj_idx is not None else "",
-                        row[fantasia_idx] if fantasia_idx is not None else "",
-                        row[email_idx] if email_idx is not None else "",
-                        row[fone_idx] if fone_idx is not None else "",
+        api_tree = ttk.Treeview(api_frame, show="headings", selectmode="browse")
+        api_vsb = ttk.Scrollbar(api_frame, orient="vertical", command=api_tree.yview)
+        api_hsb = ttk.Scrollbar(api_frame, orient="horizontal", command=api_tree.xview)
+        api_tree.configure(yscrollcommand=api_vsb.set, xscrollcommand=api_hsb.set)
+
+        api_tree.grid(row=0, column=0, sticky="nsew")
+        api_vsb.grid(row=0, column=1, sticky="ns")
+        api_hsb.grid(row=1, column=0, sticky="ew")
+
+        def carregar_cnpjs_validos(ao_carregar=None, so_se_mudou=False):
+            abrir, dsn = _abridor_conexao(), _dsn_atual()
+            if so_se_mudou and _ja_exibida(api_tab, dsn):
+                return
+
+            def trabalho(tarefa):
+                analise = _analise(abrir, dsn, tarefa)
+                return dados_pessoas.versao_analise(dsn), analise.cnpjs_validos
+
+            def concluir(resultado):
+                versao, validos = resultado
+                versoes_exibidas[api_tab] = (dsn, versao)
+                # Exibir na treeview
+                api_tree.delete(*api_tree.get_children())
+                api_tree["columns"] = COLUNAS_API
+                for col in COLUNAS_API:
+                    width = 220 if col in ("NOME", "NOMEFANTASIA") else 120
+                    api_tree.heading(col, text=col)
+                    api_tree.column(col, width=width, minwidth=80, stretch=True)
+
+                for item in validos:
+                    api_tree.insert("", "end", values=item)
+                status_var.set(f"Listados {len(validos)} cadastros com CNPJ válido.")
+                if ao_carregar:
+                    ao_carregar(validos)
+
+            _em_segundo_plano("Carregando CNPJs válidos", trabalho, concluir, "Falha ao carregar CNPJs válidos")
+
+        def atualizar_selecionado_api():
+            sel = api_tree.selection()
+            if not sel:
+                messagebox.showwarning("Atenção", "Selecione um cadastro para atualizar via API.")
+                return
+            cod = api_tree.item(sel[0], "values")[0]
+            atualizar_cnpj_api(cod, ao_terminar=carregar_cnpjs_validos)  # Atualiza a lista após atualização
+
+        def enriquecer_todos_api():
+            # Todos os CNPJs válidos da lista, sem caixas de mensagem: o progresso (ritmo e
+            # tempo restante) aparece na barra de status e o resumo ao final
+            if not messagebox.askyesno(
+                "Confirmação", "Atualizar via API todos os cadastros com CNPJ válido da lista?"
+            ):
+                return
+            abrir, dsn, url_template = _abridor_conexao(), _dsn_atual(), api_url_var.get()
+            posicao_cnpj = COLUNAS_API.index("CGC")
+
+            def iniciar(validos):
+                cadastros = [(item[0], _somente_digitos(item[posicao_cnpj])) for item in validos]
+
+                def trabalho(tarefa):
+                    resumo = enriquecer_cnpjs(abrir, dsn, cadastros, url_template, tarefa)
+                    dados_pessoas.atualizar_linhas(resumo["atualizados"])
+                    return resumo
+
+                def concluir(resumo):
+                    _refletir_alteracoes(resumo["atualizados"])
+                    carregar_cnpjs_validos()
+                    minutos = max(resumo["segundos"], 1) / 60
+                    status_var.set(
+                        f"API: {len(resumo['atualizados'])}/{resumo['total']} atualizados com "
+                        f"{resumo['consultas']} CNPJs distintos ({resumo['do_cache']} do cache), "
+                        f"{len(resumo['falhas'])} falhas ({resumo['sem_dados']} CNPJs sem dados na API), "
+                        f"{len(resumo['atualizados']) / minutos:.1f}/min, "
+                        f"{resumo['reutilizadas']} conexões reaproveitadas e {resumo['conexoes_novas']} novas."
                     )
-                )
-            status_var.set(f"Listados {len(validos)} cadastros com CNPJ válido.")
-        except Exception as e:
-            status_var.set(f"Falha ao carregar CNPJs válidos: {e}")
 
-    def atualizar_selecionado_api():
-        sel = api_tree.selection()
-        if not sel:
-            messagebox.showwarning("Atenção", "Selecione um cadastro para atualizar via API.")
-            return
-        cod = api_tree.item(sel[0], "values")[0]
-        atualizar_cnpj_api(cod)
-        carregar_cnpjs_validos()  # Atualiza a lista após atualização
+                def falhar(e):
+                    # Lotes já gravados antes da falha/cancelamento: o retrato é descartado
+                    dados_pessoas.invalidar()
 
-    ttk.Button(api_tab, text="Carregar lista", command=carregar_cnpjs_validos).grid(
-        row=2, column=0, sticky="w", padx=8, pady=4
-    )
-    ttk.Button(api_tab, text="Atualizar selecionado via API", command=atualizar_selecionado_api).grid(
-        row=2, column=0, sticky="e", padx=8, pady=4
-    )
+                _em_segundo_plano("Enriquecendo CNPJs via API", trabalho, concluir, "Falha no enriquecimento", falhar)
 
-    # Ajuste para garantir que a aba "Atualizar via API" carregue a lista ao ser selecionada
-    def on_tab_changed(event):
-        tab = event.widget.tab(event.widget.index("current"))["text"]
-        if tab == "Atualizar via API":
-            carregar_cnpjs_validos()
-    notebook.bind("<<NotebookTabChanged>>", on_tab_changed)
+            carregar_cnpjs_validos(ao_carregar=iniciar)
 
-    # === ABA DE VALIDAÇÃO ===
-    validacao_tab.columnconfigure(0, weight=1)
-    validacao_tab.rowconfigure(1, weight=1)
+        ttk.Button(api_tab, text="Carregar lista", command=carregar_cnpjs_validos).grid(
+            row=2, column=0, sticky="w", padx=8, pady=4
+        )
+        ttk.Button(api_tab, text="Atualizar todos via API", command=enriquecer_todos_api).grid(
+            row=2, column=0, padx=8, pady=4
+        )
+        ttk.Button(api_tab, text="Atualizar selecionado via API", command=atualizar_selecionado_api).grid(
+            row=2, column=0, sticky="e", padx=8, pady=4
+        )
 
-    ttk.Label(validacao_tab, text="Validação de Documentos", font=("Segoe UI", 12, "bold")).grid(
-        row=0, column=0, sticky="w", padx=8, pady=8
-    )
+        ao_abrir[api_tab] = lambda: carregar_cnpjs_validos(so_se_mudou=True)
 
-    val_frame = ttk.Frame(validacao_tab)
-    val_frame.grid(row=1, column=0, sticky="nsew", padx=8, pady=4)
-    val_frame.columnconfigure(0, weight=1)
-    val_frame.rowconfigure(0, weight=1)
+    # === ABA DE VALIDAÇÃO ===
+    def _montar_validacao():
+        validacao_tab.columnconfigure(0, weight=1)
+        validacao_tab.rowconfigure(1, weight=1)
 
-    val_tree = ttk.Treeview(val_frame, show="headings")
-    val_vsb = ttk.Scrollbar(val_frame, orient="vertical", command=val_tree.yview)
-    val_hsb = ttk.Scrollbar(val_frame, orient="horizontal", command=val_tree.xview)
-    val_tree.configure(yscrollcommand=val_vsb.set, xscrollcommand=val_hsb.set)
+        ttk.Label(validacao_tab, text="Validação de Documentos", font=("Segoe UI", 12, "bold")).grid(
+            row=0, column=0, sticky="w", padx=8, pady=8
+        )
 
-    val_tree.grid(row=0, column=0, sticky="nsew")
-    val_vsb.grid(row=0, column=1, sticky="ns")
-    val_hsb.grid(row=1, column=0, sticky="ew")
+        val_frame = ttk.Frame(validacao_tab)
+        val_frame.grid(row=1, column=0, sticky="nsew", padx=8, pady=4)
+        val_frame.columnconfigure(0, weight=1)
+        val_frame.rowconfigure(0, weight=1)
 
-    def carregar_validacao():
-        try:
-            con = get_connection(
-                entries["Host"].get().strip(),
-                entries["Porta"].get().strip(),
-                entries["Usuário"].get().strip(),
-                entries["Senha"].get(),
-                entries["Database"].get().strip(),
-            )
-            try:
-                columns, rows = fetch_people(con, "")
-            finally:
-                con.close()
+        val_tree = ttk.Treeview(val_frame, show="headings")
+        val_vsb = ttk.Scrollbar(val_frame, orient="vertical", command=val_tree.yview)
+        val_hsb = ttk.Scrollbar(val_frame, orient="horizontal", command=val_tree.xview)
+        val_tree.configure(yscrollcommand=val_vsb.set, xscrollcommand=val_hsb.set)
 
-            idx = {c: i for i, c in enumerate(columns)}
-            validacoes = []
-            
-            for row in rows:
-                cod = row[idx["CODPESSOA"]] if "CODPESSOA" in idx else ""
-                nome = row[idx["NOME"]] if "NOME" in idx else ""
-                tipo = (row[idx["TIPO"]] if "TIPO" in idx else "").strip().upper()
-                cpf = row[idx["CPF"]] if "CPF" in idx else ""
-                cnpj = row[idx["CGC"]] if "CGC" in idx else ""
-                
-                status_cpf = "✅ Válido" if cpf and validar_cpf(cpf) else ("❌ Inválido" if cpf else "⚪ Não informado")
-                status_cnpj = "✅ Válido" if cnpj and validar_cnpj(cnpj) else ("❌ Inválido" if cnpj else "⚪ Não informado")
-                
-                validacoes.append((cod, nome, tipo, cpf or "-", status_cpf, cnpj or "-", status_cnpj))
-
-            val_tree.delete(*val_tree.get_children())
-            val_tree["columns"] = ["COD", "NOME", "TIPO", "CPF", "STATUS_CPF", "CNPJ", "STATUS_CNPJ"]
-            
-            for col in val_tree["columns"]:
-                width = 250 if col == "NOME" else 120
-                val_tree.heading(col, text=col)
-                val_tree.column(col, width=width, minwidth=80, stretch=True)
-
-            for item in validacoes:
-                val_tree.insert("", "end", values=item)
-
-            status_var.set(f"Validados {len(validacoes)} cadastros.")
-        except Exception as e:
-            status_var.set(f"Falha ao validar: {e}")
-
-    ttk.Button(validacao_tab, text="🔍 Validar Documentos", command=carregar_validacao).grid(
-        row=2, column=0, pady=8
-    )
+        val_tree.grid(row=0, column=0, sticky="nsew")
+        val_vsb.grid(row=0, column=1, sticky="ns")
+        val_hsb.grid(row=1, column=0, sticky="ew")
 
-    # === ABA DE DUPLICADOS ===
-    duplicados_tab.columnconfigure(0, weight=1)
-    duplicados_tab.rowconfigure(1, weight=1)
+        def carregar_validacao(so_se_mudou=False):
+            abrir, dsn = _abridor_conexao(), _dsn_atual()
+            if so_se_mudou and _ja_exibida(validacao_tab, dsn):
+                return
 
-    ttk.Label(duplicados_tab, text="Cadastros Duplicados", font=("Segoe UI", 12, "bold")).grid(
-        row=0, column=0, sticky="w", padx=8, pady=8
-    )
+            def trabalho(tarefa):
+                analise = _analise(abrir, dsn, tarefa)
+                return dados_pessoas.versao_analise(dsn), analise.validacoes
 
-    dup_notebook = ttk.Notebook(duplicados_tab)
-    dup_notebook.grid(row=1, column=0, sticky="nsew", padx=8, pady=4)
+            def concluir(resultado):
+                versao, validacoes = resultado
+                versoes_exibidas[validacao_tab] = (dsn, versao)
+                val_tree.delete(*val_tree.get_children())
+                val_tree["columns"] = ["COD", "NOME", "TIPO", "CPF", "STATUS_CPF", "CNPJ", "STATUS_CNPJ"]
 
-    # Sub-aba CPF duplicado
-    dup_cpf_frame = ttk.Frame(dup_notebook)
-    dup_notebook.add(dup_cpf_frame, text="CPF Duplicados")
-    
-    dup_cpf_frame.columnconfigure(0, weight=1)
-    dup_cpf_frame.rowconfigure(0, weight=1)
+                for col in val_tree["columns"]:
+                    width = 250 if col == "NOME" else 120
+                    val_tree.heading(col, text=col)
+                    val_tree.column(col, width=width, minwidth=80, stretch=True)
 
-    dup_cpf_tree = ttk.Treeview(dup_cpf_frame, show="headings")
-    cpf_vsb = ttk.Scrollbar(dup_cpf_frame, orient="vertical", command=dup_cpf_tree.yview)
-    cpf_hsb = ttk.Scrollbar(dup_cpf_frame, orient="horizontal", command=dup_cpf_tree.xview)
-    dup_cpf_tree.configure(yscrollcommand=cpf_vsb.set, xscrollcommand=cpf_hsb.set)
+                for item in validacoes:
+                    val_tree.insert("", "end", values=item)
 
-    dup_cpf_tree.grid(row=0, column=0, sticky="nsew")
-    cpf_vsb.grid(row=0, column=1, sticky="ns")
-    cpf_hsb.grid(row=1, column=0, sticky="ew")
+                status_var.set(f"Validados {len(validacoes)} cadastros.")
 
-    # Sub-aba CNPJ duplicado
-    dup_cnpj_frame = ttk.Frame(dup_notebook)
-    dup_notebook.add(dup_cnpj_frame, text="CNPJ Duplicados")
-    
-    dup_cnpj_frame.columnconfigure(0, weight=1)
-    dup_cnpj_frame.rowconfigure(0, weight=1)
+            _em_segundo_plano("Validando documentos", trabalho, concluir, "Falha ao validar")
 
-    dup_cnpj_tree = ttk.Treeview(dup_cnpj_frame, show="headings")
-    cnpj_vsb = ttk.Scrollbar(dup_cnpj_frame, orient="vertical", command=dup_cnpj_tree.yview)
-    cnpj_hsb = ttk.Scrollbar(dup_cnpj_frame, orient="horizontal", command=dup_cnpj_tree.xview)
-    dup_cnpj_tree.configure(yscrollcommand=cnpj_vsb.set, xscrollcommand=cnpj_hsb.set)
+        ttk.Button(validacao_tab, text="🔍 Validar Documentos", command=carregar_validacao).grid(
+            row=2, column=0, pady=8
+        )
+        ao_abrir[validacao_tab] = lambda: carregar_validacao(so_se_mudou=True)
 
-    dup_cnpj_tree.grid(row=0, column=0, sticky="nsew")
-    cnpj_vsb.grid(row=0, column=1, sticky="ns")
-    cnpj_hsb.grid(row=1, column=0, sticky="ew")
+    # === ABA DE DUPLICADOS ===
+    def _montar_duplicados():
+        duplicados_tab.columnconfigure(0, weight=1)
+        duplicados_tab.rowconfigure(1, weight=1)
 
-    def carregar_duplicados():
-        try:
-            con = get_connection(
-                entries["Host"].get().strip(),
-                entries["Porta"].get().strip(),
-                entries["Usuário"].get().strip(),
-                entries["Senha"].get(),
-                entries["Database"].get().strip(),
-            )
-            try:
-                columns, rows = fetch_people(con, "")
-            finally:
-                con.close()
+        ttk.Label(duplicados_tab, text="Cadastros Duplicados", font=("Segoe UI", 12, "bold")).grid(
+            row=0, column=0, sticky="w", padx=8, pady=8
+        )
 
-            idx = {c: i for i, c in enumerate(columns)}
-            cpfs = {}
-            cnpjs = {}
-            
-            # Agrupar por documento
-            for row in rows:
-                cpf = _somente_digitos(row[idx["CPF"]] if "CPF" in idx else "")
-                cnpj = _somente_digitos(row[idx["CGC"]] if "CGC" in idx else "")
-                
-                if cpf and len(cpf) == 11:
-                    cpfs.setdefault(cpf, []).append(row)
-                if cnpj and len(cnpj) == 14:
-                    cnpjs.setdefault(cnpj, []).append(row)
+        dup_notebook = ttk.Notebook(duplicados_tab)
+        # Agrupamento no servidor: só os grupos duplicados trafegam pela rede, mas cada
+        # busca percorre a tabela inteira; por padrão os grupos saem do retrato em memória
+        dup_servidor_var = tk.BooleanVar(value=False)
+        # Último resultado do servidor e a versão do retrato em que foi lido
+        dup_servidor_cache = {"chave": None, "resultado": None}
+        dup_notebook.grid(row=1, column=0, sticky="nsew", padx=8, pady=4)
+
+        # Sub-aba CPF duplicado
+        dup_cpf_frame = ttk.Frame(dup_notebook)
+        dup_notebook.add(dup_cpf_frame, text="CPF Duplicados")
+
+        dup_cpf_frame.columnconfigure(0, weight=1)
+        dup_cpf_frame.rowconfigure(0, weight=1)
+
+        dup_cpf_tree = ttk.Treeview(dup_cpf_frame, show="headings")
+        cpf_vsb = ttk.Scrollbar(dup_cpf_frame, orient="vertical", command=dup_cpf_tree.yview)
+        cpf_hsb = ttk.Scrollbar(dup_cpf_frame, orient="horizontal", command=dup_cpf_tree.xview)
+        dup_cpf_tree.configure(yscrollcommand=cpf_vsb.set, xscrollcommand=cpf_hsb.set)
+
+        dup_cpf_tree.grid(row=0, column=0, sticky="nsew")
+        cpf_vsb.grid(row=0, column=1, sticky="ns")
+        cpf_hsb.grid(row=1, column=0, sticky="ew")
+
+        # Sub-aba CNPJ duplicado
+        dup_cnpj_frame = ttk.Frame(dup_notebook)
+        dup_notebook.add(dup_cnpj_frame, text="CNPJ Duplicados")
+
+        dup_cnpj_frame.columnconfigure(0, weight=1)
+        dup_cnpj_frame.rowconfigure(0, weight=1)
+
+        dup_cnpj_tree = ttk.Treeview(dup_cnpj_frame, show="headings")
+        cnpj_vsb = ttk.Scrollbar(dup_cnpj_frame, orient="vertical", command=dup_cnpj_tree.yview)
+        cnpj_hsb = ttk.Scrollbar(dup_cnpj_frame, orient="horizontal", command=dup_cnpj_tree.xview)
+        dup_cnpj_tree.configure(yscrollcommand=cnpj_vsb.set, xscrollcommand=cnpj_hsb.set)
+
+        dup_cnpj_tree.grid(row=0, column=0, sticky="nsew")
+        cnpj_vsb.grid(row=0, column=1, sticky="ns")
+        cnpj_hsb.grid(row=1, column=0, sticky="ew")
+
+        # Sub-aba de nomes parecidos (quase-duplicados)
+        dup_sem_frame = ttk.Frame(dup_notebook)
+        dup_notebook.add(dup_sem_frame, text="🔎 Semelhantes")
+
+        dup_sem_frame.columnconfigure(0, weight=1)
+        dup_sem_frame.rowconfigure(0, weight=1)
+
+        dup_sem_tree = ttk.Treeview(dup_sem_frame, show="headings")
+        sem_vsb = ttk.Scrollbar(dup_sem_frame, orient="vertical", command=dup_sem_tree.yview)
+        sem_hsb = ttk.Scrollbar(dup_sem_frame, orient="horizontal", command=dup_sem_tree.xview)
+        dup_sem_tree.configure(yscrollcommand=sem_vsb.set, xscrollcommand=sem_hsb.set)
+
+        dup_sem_tree.grid(row=0, column=0, sticky="nsew")
+        sem_vsb.grid(row=0, column=1, sticky="ns")
+        sem_hsb.grid(row=1, column=0, sticky="ew")
+
+        def carregar_duplicados():
+            abrir, dsn = _abridor_conexao(), _dsn_atual()
+            no_servidor = dup_servidor_var.get()
+
+            chave = (dsn, dados_pessoas.versao)
+
+            def trabalho(tarefa):
+                if no_servidor:
+                    with abrir() as con:
+                        return None, buscar_duplicados_sql(con, dsn)
+                analise = _analise(abrir, dsn, tarefa)
+                return dados_pessoas.versao_analise(dsn), (analise.dup_cpf, analise.dup_cnpj)
+
+            def concluir(resultado):
+                versao, resultado = resultado
+                if no_servidor:
+                    dup_servidor_cache.update(chave=chave, resultado=resultado)
+                _mostrar_duplicados(*resultado)
+                versoes_exibidas[duplicados_tab] = (dsn, versao)
+
+            _em_segundo_plano("Buscando duplicados", trabalho, concluir, "Falha ao carregar duplicados")
+
+        def _abrir_duplicados():
+            # Trocar de aba não dispara os GROUP BY no servidor: reapresenta a última
+            # busca enquanto o retrato não mudar; a nova busca fica com o botão
+            if not dup_servidor_var.get():
+                if not _ja_exibida(duplicados_tab, _dsn_atual()):
+                    carregar_duplicados()
+            elif dup_servidor_cache["chave"] == (_dsn_atual(), dados_pessoas.versao):
+                _mostrar_duplicados(*dup_servidor_cache["resultado"])
+                versoes_exibidas.pop(duplicados_tab, None)
+            else:
+                status_var.set("Clique em \"Buscar Duplicados\" para agrupar no servidor.")
 
+        def _mostrar_duplicados(dup_cpf, dup_cnpj):
             # CPF duplicados
             dup_cpf_tree.delete(*dup_cpf_tree.get_children())
             dup_cpf_tree["columns"] = ["CPF", "COD", "NOME", "EMAIL", "AÇÃO"]
-            
+
             for col in dup_cpf_tree["columns"]:
                 width = 200 if col in ("NOME", "EMAIL") else 120
                 dup_cpf_tree.heading(col, text=col)
                 dup_cpf_tree.column(col, width=width, minwidth=80, stretch=True)
 
-            for cpf, registros in cpfs.items():
-                if len(registros) > 1:
-                    for row in registros:
-                        dup_cpf_tree.insert("", "end", values=(
-                            cpf,
-                            row[idx["CODPESSOA"]] if "CODPESSOA" in idx else "",
-                            row[idx["NOME"]] if "NOME" in idx else "",
-                            row[idx["EMAIL"]] if "EMAIL" in idx else "",
-                            "🔴 Duplicado"
-                        ))
+            for item in dup_cpf:
+                dup_cpf_tree.insert("", "end", values=(*item, "🔴 Duplicado"))
 
             # CNPJ duplicados
             dup_cnpj_tree.delete(*dup_cnpj_tree.get_children())
             dup_cnpj_tree["columns"] = ["CNPJ", "COD", "NOME", "EMAIL", "AÇÃO"]
-            
+
             for col in dup_cnpj_tree["columns"]:
                 width = 200 if col in ("NOME", "EMAIL") else 120
                 dup_cnpj_tree.heading(col, text=col)
                 dup_cnpj_tree.column(col, width=width, minwidth=80, stretch=True)
 
-            for cnpj, registros in cnpjs.items():
-                if len(registros) > 1:
-                    for row in registros:
-                        dup_cnpj_tree.insert("", "end", values=(
-                            cnpj,
-                            row[idx["CODPESSOA"]] if "CODPESSOA" in idx else "",
-                            row[idx["NOME"]] if "NOME" in idx else "",
-                            row[idx["EMAIL"]] if "EMAIL" in idx else "",
-                            "🔴 Duplicado"
-                        ))
-
-            total_dup = sum(1 for v in cpfs.values() if len(v) > 1) + sum(1 for v in cnpjs.values() if len(v) > 1)
+            for item in dup_cnpj:
+                dup_cnpj_tree.insert("", "end", values=(*item, "🔴 Duplicado"))
+
+            total_dup = len({item[0] for item in dup_cpf}) + len({item[0] for item in dup_cnpj})
             status_var.set(f"Encontrados {total_dup} grupos de duplicados.")
-        except Exception as e:
-            status_var.set(f"Falha ao carregar duplicados: {e}")
-
-    def inativar_duplicado_selecionado():
-        # Determinar qual árvore está ativa
-        current_tab = dup_notebook.index(dup_notebook.select())
-        tree_atual = dup_cpf_tree if current_tab == 0 else dup_cnpj_tree
-        
-        sel = tree_atual.selection()
-        if not sel:
-            messagebox.showwarning("Atenção", "Selecione um cadastro duplicado.")
-            return
-        
-        cod = tree_atual.item(sel[0], "values")[1]
-        
-        if not messagebox.askyesno("Confirmação", f"Deseja inativar o cadastro {cod}?"):
-            return
-        
-        try:
-            con = get_connection(
-                entries["Host"].get().strip(),
-                entries["Porta"].get().strip(),
-                entries["Usuário"].get().strip(),
-                entries["Senha"].get(),
-                entries["Database"].get().strip(),
-            )
-            try:
-                cur = con.cursor()
-                # Tentar diferentes campos de inativação
-                try:
-                    cur.execute("UPDATE PESSOA SET SITUACAO='I' WHERE CODPESSOA=?", (int(cod),))
-                except:
-                    cur.execute("UPDATE PESSOA SET CADASTRO_VALIDO='N' WHERE CODPESSOA=?", (int(cod),))
-                con.commit()
-            finally:
-                con.close()
-            
-            carregar_duplicados()
-            status_var.set(f"Cadastro {cod} inativado com sucesso.")
-        except Exception as e:
-            messagebox.showerror("Erro", f"Falha ao inativar: {e}")
-
-    btn_frame = ttk.Frame(duplicados_tab)
-    btn_frame.grid(row=2, column=0, pady=8, sticky="ew", padx=8)
-    
-    ttk.Button(btn_frame, text="🔍 Buscar Duplicados", command=carregar_duplicados).pack(side="left", padx=4)
-    ttk.Button(btn_frame, text="🔴 Inativar Selecionado", command=inativar_duplicado_selecionado).pack(side="left", padx=4)
 
-    # === ABA DE RELATÓRIOS ===
-    relatorios_tab.columnconfigure(0, weight=1)
-    relatorios_tab.rowconfigure(0, weight=1)
+        def carregar_semelhantes():
+            abrir, dsn = _abridor_conexao(), _dsn_atual()
 
-    rel_text = tk.Text(relatorios_tab, wrap="word", font=("Consolas", 10))
-    rel_text.grid(row=0, column=0, sticky="nsew", padx=8, pady=8)
-    
-    rel_scroll = ttk.Scrollbar(relatorios_tab, orient="vertical", command=rel_text.yview)
-    rel_scroll.grid(row=0, column=1, sticky="ns")
-    rel_text.configure(yscrollcommand=rel_scroll.set)
+            def trabalho(tarefa):
+                columns, rows, documentos = dados_pessoas.obter_documentos(abrir, dsn)
+                return buscar_quase_duplicados(columns, rows, documentos, tarefa=tarefa)
 
-    def gerar_relatorio():
-        try:
-            con = get_connection(
-                entries["Host"].get().strip(),
-                entries["Porta"].get().strip(),
-                entries["Usuário"].get().strip(),
-                entries["Senha"].get(),
-                entries["Database"].get().strip(),
+            _em_segundo_plano(
+                "Buscando cadastros semelhantes", trabalho, _mostrar_semelhantes,
+                "Falha ao buscar semelhantes",
             )
-            try:
-                columns, rows = fetch_people(con, "")
-            finally:
-                con.close()
 
-            idx = {c: i for i, c in enumerate(columns)}
-            
-            total = len(rows)
-            tipo_f = sum(1 for r in rows if (r[idx["TIPO"]] if "TIPO" in idx else "").strip().upper() == "F")
-            tipo_j = sum(1 for r in rows if (r[idx["TIPO"]] if "TIPO" in idx else "").strip().upper() == "J")
-            
-            cpf_validos = sum(1 for r in rows if validar_cpf(r[idx["CPF"]] if "CPF" in idx else ""))
-            cnpj_validos = sum(1 for r in rows if validar_cnpj(r[idx["CGC"]] if "CGC" in idx else ""))
-            
-            sem_email = sum(1 for r in rows if not (r[idx["EMAIL"]] if "EMAIL" in idx else ""))
-            sem_telefone = sum(1 for r in rows if not (r[idx["FONE1"]] if "FONE1" in idx else ""))
-            
+        def _mostrar_semelhantes(pares):
+            dup_sem_tree.delete(*dup_sem_tree.get_children())
+            dup_sem_tree["columns"] = ["SIMILARIDADE", "COD", "NOME", "COD SEMELHANTE", "NOME SEMELHANTE", "MOTIVO"]
+
+            for col in dup_sem_tree["columns"]:
+                width = 220 if col.startswith("NOME") else 110
+                dup_sem_tree.heading(col, text=col)
+                dup_sem_tree.column(col, width=width, minwidth=80, stretch=True)
+
+            for par in pares[:LIMITE_PARES_EXIBIDOS]:
+                nota = "-" if par[0] is None else f"{par[0]:.2f}"
+                dup_sem_tree.insert("", "end", values=(nota, *par[1:]))
+
+            exibidos = f" (exibindo {LIMITE_PARES_EXIBIDOS})" if len(pares) > LIMITE_PARES_EXIBIDOS else ""
+            status_var.set(f"Encontrados {len(pares)} pares de cadastros semelhantes{exibidos}.")
+
+        def inativar_duplicado_selecionado():
+            # Determinar qual árvore está ativa
+            current_tab = dup_notebook.index(dup_notebook.select())
+            tree_atual = (dup_cpf_tree, dup_cnpj_tree, dup_sem_tree)[current_tab]
+
+            sel = tree_atual.selection()
+            if not sel:
+                messagebox.showwarning("Atenção", "Selecione um cadastro duplicado.")
+                return
+
+            # Nos semelhantes o par vem ordenado por código: inativa-se o mais novo
+            cod = tree_atual.item(sel[0], "values")[3 if tree_atual is dup_sem_tree else 1]
+
+            if not messagebox.askyesno("Confirmação", f"Deseja inativar o cadastro {cod}?"):
+                return
+
+            abrir = _abridor_conexao()
+
+            def trabalho(tarefa):
+                with abrir() as con:
+                    cur = con.cursor()
+                    # Tentar diferentes campos de inativação
+                    try:
+                        cur.execute("UPDATE PESSOA SET SITUACAO='I' WHERE CODPESSOA=?", (int(cod),))
+                        inativacao = {"SITUACAO": "I"}
+                    except:
+                        cur.execute("UPDATE PESSOA SET CADASTRO_VALIDO='N' WHERE CODPESSOA=?", (int(cod),))
+                        inativacao = {"CADASTRO_VALIDO": "N"}
+                    con.commit()
+                return inativacao
+
+            def concluir(inativacao):
+                alterados = dados_pessoas.atualizar_linha(cod, inativacao)
+                _refletir_alteracao(cod, inativacao, alterados)
+                if dup_servidor_var.get():
+                    carregar_duplicados()
+                if tree_atual is dup_sem_tree and dup_sem_tree.exists(sel[0]):
+                    dup_sem_tree.delete(sel[0])
+                status_var.set(f"Cadastro {cod} inativado com sucesso.")
+
+            def falhar(e):
+                if not isinstance(e, TarefaCancelada):
+                    messagebox.showerror("Erro", f"Falha ao inativar: {e}")
+
+            _em_segundo_plano(f"Inativando cadastro {cod}", trabalho, concluir, "Falha ao inativar", falhar)
+
+        btn_frame = ttk.Frame(duplicados_tab)
+        btn_frame.grid(row=2, column=0, pady=8, sticky="ew", padx=8)
+
+        ttk.Button(btn_frame, text="🔍 Buscar Duplicados", command=carregar_duplicados).pack(side="left", padx=4)
+        ttk.Button(btn_frame, text="🔎 Buscar Semelhantes", command=carregar_semelhantes).pack(side="left", padx=4)
+        ttk.Button(btn_frame, text="🔴 Inativar Selecionado", command=inativar_duplicado_selecionado).pack(side="left", padx=4)
+        ttk.Checkbutton(btn_frame, text="Agrupar no servidor", variable=dup_servidor_var).pack(side="left", padx=12)
+
+        def _refletir_duplicados(cod, alterados):
+            dsn = _dsn_atual()
+            versao = dados_pessoas.versao_analise(dsn)
+            analise = dados_pessoas.analise_pronta(dsn)
+            if analise is not None and not dup_servidor_var.get() and dup_cpf_tree["columns"]:
+                _mostrar_duplicados(analise.dup_cpf, analise.dup_cnpj)
+                versoes_exibidas[duplicados_tab] = (dsn, versao)
+
+        ao_alterar_cadastro.append(_refletir_duplicados)
+
+        def _recarregar_duplicados():
+            if not dup_servidor_var.get() and dup_cpf_tree["columns"]:
+                carregar_duplicados()
+
+        ao_alterar_em_massa.append(_recarregar_duplicados)
+        ao_abrir[duplicados_tab] = _abrir_duplicados
+
+    # === ABA DE RELATÓRIOS ===
+    def _montar_relatorios():
+        relatorios_tab.columnconfigure(0, weight=1)
+        relatorios_tab.rowconfigure(0, weight=1)
+
+        rel_text = tk.Text(relatorios_tab, wrap="word", font=("Consolas", 10))
+        rel_text.grid(row=0, column=0, sticky="nsew", padx=8, pady=8)
+
+        rel_scroll = ttk.Scrollbar(relatorios_tab, orient="vertical", command=rel_text.yview)
+        rel_scroll.grid(row=0, column=1, sticky="ns")
+        rel_text.configure(yscrollcommand=rel_scroll.set)
+
+        def gerar_relatorio():
+            abrir, dsn = _abridor_conexao(), _dsn_atual()
+
+            def trabalho(tarefa):
+                # Aberta a cada troca de aba: sai do retrato compartilhado, sem nova leitura da tabela
+                return _analise(abrir, dsn, tarefa).relatorio
+
+            def falhar(e):
+                rel_text.insert("1.0", f"Erro ao gerar relatório: {e}")
+
+            _em_segundo_plano("Gerando relatório", trabalho, _mostrar_relatorio, "Falha ao gerar relatório", falhar)
+
+        def _mostrar_relatorio(contadores):
+            total = contadores["total"]
+            tipo_f = contadores["tipo_f"]
+            tipo_j = contadores["tipo_j"]
+            cpf_validos = contadores["cpf_validos"]
+            cnpj_validos = contadores["cnpj_validos"]
+            sem_email = contadores["sem_email"]
+            sem_telefone = contadores["sem_telefone"]
+            # Regras da análise de problemas: da que mais consumiu tempo para a que menos
+            regras = "\n".join(
+                f"{mensagem[:32]:<33}{ocorrencias:>10} {tempo * 1000:>11.1f} ms"
+                for mensagem, _, ocorrencias, tempo in estatisticas_regras()
+            ) or "Nenhuma análise de problemas executada nesta sessão."
+            http = estatisticas_http()
+            conexoes_api = (
+                f"Requisições:                     {http['requisicoes']:>10}\n"
+                f"Conexões abertas:                {http['conexoes_novas']:>10}\n"
+                f"Conexões reaproveitadas:         {http['reutilizadas']:>10}\n"
+                f"Taxa de reuso:                   {http['taxa_reuso'] * 100:>9.1f}%\n"
+                f"Fechadas pelo servidor:          {http['descartadas']:>10}\n"
+                f"Recebido (rede/descompactado):   {http['bytes_rede'] // 1024:>5} / {http['bytes_corpo'] // 1024} KB"
+            ) if http and http["requisicoes"] else "Nenhuma consulta à API nesta sessão."
+
             rel_text.delete("1.0", tk.END)
             rel_text.insert("1.0", f"""
 ╔══════════════════════════════════════════════════════════╗
@@ -1468,36 +3390,156 @@ Taxa de CNPJ válidos:            {(cnpj_validos/max(tipo_j,1)*100):>9.1f}%
 Taxa de cadastros com e-mail:    {((total-sem_email)/max(total,1)*100):>9.1f}%
 Taxa de cadastros com telefone:  {((total-sem_telefone)/max(total,1)*100):>9.1f}%
 
+⏱ REGRAS DE ANÁLISE (ocorrências / tempo estimado)
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+{regras}
+
+🌐 CONEXÕES COM A API CNPJ
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+{conexoes_api}
+
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 Relatório gerado em: {time.strftime('%d/%m/%Y %H:%M:%S')}
 """)
             status_var.set("Relatório gerado com sucesso.")
-        except Exception as e:
-            rel_text.insert("1.0", f"Erro ao gerar relatório: {e}")
 
-    ttk.Button(relatorios_tab, text="📊 Gerar Relatório", command=gerar_relatorio).grid(
-        row=1, column=0, columnspan=2, pady=8
-    )
+        ttk.Button(relatorios_tab, text="📊 Gerar Relatório", command=gerar_relatorio).grid(
+            row=1, column=0, columnspan=2, pady=8
+        )
+        ao_abrir[relatorios_tab] = gerar_relatorio
+
+    montagens = {
+        massa_tab: _montar_massa,
+        problemas_tab: _montar_problemas,
+        api_tab: _montar_api,
+        validacao_tab: _montar_validacao,
+        duplicados_tab: _montar_duplicados,
+        relatorios_tab: _montar_relatorios,
+    }
 
-    # Ajuste para garantir que as abas carreguem automaticamente ao serem selecionadas
+    # Monta a aba na primeira abertura e recarrega as que se atualizam ao serem selecionadas
     def on_tab_changed(event):
-        tab = event.widget.tab(event.widget.index("current"))["text"]
-        if tab == "🌐 Atualizar via API":
-            carregar_cnpjs_validos()
-        elif tab == "✅ Validação":
-            carregar_validacao()
-        elif tab == "👥 Duplicados":
-            carregar_duplicados()
-        elif tab == "📊 Relatórios":
-            gerar_relatorio()
+        aba = notebook.nametowidget(notebook.select())
+        montar = montagens.pop(aba, None)
+        if montar:
+            montar()
+        carregar = ao_abrir.get(aba)
+        if carregar:
+            carregar()
     notebook.bind("<<NotebookTabChanged>>", on_tab_changed)
 
+    # Sincronização incremental: traz só o que outros usuários alteraram desde a última leitura
+    def sincronizar_dados():
+        abrir, dsn = _abridor_conexao(), _dsn_atual()
+        _em_segundo_plano(
+            "Sincronizando",
+            lambda tarefa: dados_pessoas.sincronizar(abrir, dsn),
+            _aplicar_sincronizacao,
+            "Falha ao sincronizar",
+        )
+
+    def _aplicar_sincronizacao(resultado):
+        if resultado is None:
+            # Sem a lista do que mudou (base sem controle de alterações ou exclusões
+            # detectadas pela contagem): a lista de pessoas também volta ao começo
+            mensagem = "Alterações sem detalhe: dados recarregados por completo."
+            on_load()
+        else:
+            columns, rows, removidos = resultado
+            tree_cols = list(tree["columns"])
+            idx_cod = columns.index("CODPESSOA")
+            ultimo = paginacao["ultimo_cod"]
+            novos = []
+            for row in rows:
+                chave = _chave_cod(row[idx_cod])
+                item = itens_pessoas.get(chave)
+                if item is None:
+                    # Fora da lista mas dentro do trecho já carregado (novo, ou que passou
+                    # a atender o filtro): precisa ser trazido; depois dele, a paginação traz
+                    if paginacao["fim"] or (ultimo is not None and chave <= _chave_cod(ultimo)):
+                        novos.append(row[idx_cod])
+                    continue
+                for col, valor in zip(columns, row):
+                    if col in tree_cols:
+                        tree.set(item, col, "" if valor is None else valor)
+            for cod in removidos:
+                item = itens_pessoas.pop(_chave_cod(cod), None)
+                if item is not None:
+                    tree.delete(item)
+                    paginacao["total"] -= 1
+            if novos:
+                _trazer_novos(novos)
+            mensagem = f"Sincronizado: {len(rows)} alterados, {len(removidos)} removidos."
+        # Reapresenta a aba aberta a partir do retrato atualizado
+        carregar = ao_abrir.get(notebook.nametowidget(notebook.select()))
+        if carregar:
+            carregar()
+        status_var.set(mensagem)
+
+    def _trazer_novos(cods):
+        # Linhas completas (com as colunas e o filtro da lista) dos cadastros que a
+        # sincronização achou fora da Treeview
+        filtro, geracao = paginacao["filtro"], paginacao["geracao"]
+        abrir, dsn = _abridor_conexao(), _dsn_atual()
+
+        def trabalho(tarefa):
+            columns, rows = None, []
+            with abrir() as con:
+                # Firebird limita a 1500 itens por IN
+                for i in range(0, len(cods), 1000):
+                    lote = cods[i:i + 1000]
+                    columns, parte = fetch_people(
+                        con, filtro, dsn=dsn,
+                        condicao=(f"P.CODPESSOA IN ({', '.join('?' * len(lote))})", lote),
+                    )
+                    rows.extend(parte)
+            return columns, rows
+
+        def concluir(resultado):
+            columns, rows = resultado
+            if geracao != paginacao["geracao"] or not rows:
+                return
+            idx_cod = columns.index("CODPESSOA")
+            rows = sorted(
+                (r for r in rows if _chave_cod(r[idx_cod]) not in itens_pessoas),
+                key=lambda r: _chave_cod(r[idx_cod]),
+            )
+            _inserir_pessoas(columns, rows, no_lugar=True)
+            paginacao["total"] += len(rows)
+            _status_paginacao()
+
+        _em_segundo_plano("Trazendo cadastros novos", trabalho, concluir, "Falha ao trazer cadastros novos")
+
+    ttk.Button(actions_frame, text="🔄 Sincronizar", command=sincronizar_dados).grid(
+        row=0, column=2, padx=(8, 0)
+    )
+
     # Melhorar estilo visual
     style.configure("TNotebook.Tab", padding=[20, 10], font=("Segoe UI", 10))
     style.configure("TButton", padding=[10, 5], font=("Segoe UI", 9))
     style.configure("TLabel", font=("Segoe UI", 9))
     
+    def on_close():
+        tarefas.encerrar()
+        encerrar_processos()
+        _pool_conexoes.fechar_todas()
+        fechar_cache_cnpj()
+        fechar_cliente_http()
+        root.destroy()
+    root.protocol("WM_DELETE_WINDOW", on_close)
+
     root.rowconfigure(len(fields) + 1, weight=1)
+
+    # Partida a frio: do início do processo até a janela pronta e ociosa. Com
+    # --medir-inicio o tempo vai para a saída padrão e o programa fecha em seguida,
+    # para acompanhar regressões por script
+    def _registrar_inicio():
+        ms = (time.perf_counter() - _INICIO_PROCESSO) * 1000
+        status_var.set(f"{status_var.get()} (iniciado em {ms:.0f} ms)")
+        if medir_inicio:
+            print(f"Inicio: {ms:.0f} ms")
+            on_close()
+    root.after_idle(_registrar_inicio)
     root.mainloop()
 
 # URL template da API (permite trocar por outra API)
@@ -1509,5 +3551,669 @@ def _build_api_url(template, cnpj):
         return tpl.format(cnpj=cnpj)
     return tpl.rstrip("/") + f"/{cnpj}"
 
+# Limite de requisições por provedor (host da URL), em balde de fichas: cabem até
+# "capacidade" consultas seguidas e as fichas voltam à taxa capacidade/período.
+# O saldo fica gravado em disco, então reiniciar o programa não zera a cota.
+# CNPJ_API_LIMITES="brasilapi.com.br=3/60;outra.api=10/60"; um valor sem host vale para os demais
+LIMITES_API_FILE = Path.home() / ".limites_api_cnpj.json"
+LIMITES_API = os.getenv("CNPJ_API_LIMITES", "3/60")
+CONCORRENCIA_API = int(os.getenv("CNPJ_API_CONCORRENCIA", "4"))
+TAMANHO_LOTE_API = int(os.getenv("CNPJ_API_LOTE", "50"))
+# Novas tentativas: erros de rede e 5xx esperam um recuo exponencial com variação
+# aleatória, ou o Retry-After do servidor. Um 429 pausa o limitador do provedor pelo
+# tempo pedido: o lote inteiro espera e retoma, em vez de abortar ou insistir
+TENTATIVAS_API = int(os.getenv("CNPJ_API_TENTATIVAS", "4"))
+RECUO_BASE_API = 2.0  # segundos
+RECUO_MAX_API = 120.0
+STATUS_REPETIR_API = frozenset((429, 500, 502, 503, 504))
+STATUS_SEM_DADOS_API = frozenset((400, 404, 410, 422))  # vão para o cache negativo
+
+_lock_limites = threading.Lock()
+_limitadores = {}
+
+class LimiteApiExcedido(Exception):
+    def __init__(self, espera):
+        super().__init__(f"Limite de requisições da API atingido; aguarde {int(espera) + 1} segundos.")
+        self.espera = espera
+
+class CnpjSemDados(Exception):
+    # CNPJ não encontrado ou resposta inválida; do_cache: veio do cache negativo
+    def __init__(self, cnpj, motivo, do_cache=False):
+        super().__init__(f"CNPJ {cnpj} sem dados na API ({motivo}).")
+        self.motivo = motivo
+        self.do_cache = do_cache
+
+class LimitadorTaxa:
+    def __init__(self, chave, capacidade, periodo, arquivo=None):
+        self.chave = chave
+        self.capacidade = capacidade
+        self.periodo = periodo
+        self.arquivo = arquivo or LIMITES_API_FILE
+        self._lock = threading.Lock()
+        estado = self._ler().get(chave) or {}
+        self._fichas = float(estado.get("fichas", capacidade))
+        self._atualizado = float(estado.get("atualizado", time.time()))
+
+    def _ler(self):
+        try:
+            return json.loads(self.arquivo.read_text(encoding="utf-8"))
+        except Exception:
+            return {}
+
+    def _salvar(self):
+        with _lock_limites:
+            try:
+                estados = self._ler()
+                estados[self.chave] = {"fichas": self._fichas, "atualizado": self._atualizado}
+                self.arquivo.write_text(json.dumps(estados), encoding="utf-8")
+            except Exception:
+                pass
+
+    def _repor(self):
+        # Relógio de parede: o saldo gravado continua valendo depois de reiniciar
+        agora = time.time()
+        if agora < self._atualizado:
+            return  # em pausa: as fichas só voltam a encher depois dela
+        decorrido = max(0.0, agora - self._atualizado)
+        self._fichas = min(float(self.capacidade), self._fichas + decorrido * self.capacidade / self.periodo)
+        self._atualizado = agora
+
+    def tentar(self):
+        # Consome uma ficha; devolve 0 ou, sem ficha, os segundos até a próxima
+        with self._lock:
+            self._repor()
+            if self._fichas >= 1:
+                self._fichas -= 1
+                self._salvar()
+                return 0.0
+            pausa = max(0.0, self._atualizado - time.time())
+            return pausa + (1 - self._fichas) * self.periodo / self.capacidade
+
+    def pausar(self, segundos):
+        # Resposta 429: ninguém consulta o provedor até a pausa acabar, nem depois de reiniciar
+        with self._lock:
+            self._repor()
+            self._fichas = 0.0
+            self._atualizado = max(self._atualizado, time.time() + segundos)
+            self._salvar()
+
+    def aguardar(self, tarefa=None):
+        while True:
+            espera = self.tentar()
+            if not espera:
+                return
+            if tarefa:
+                tarefa.verificar_cancelamento()
+            time.sleep(min(espera, 0.5))
+
+def _provedor_api(url_template):
+    import urllib.parse
+
+    return urllib.parse.urlsplit(_build_api_url(url_template, "0")).netloc.lower() or "api"
+
+def _limite_configurado(provedor):
+    padrao = (3, 60)
+    for item in LIMITES_API.split(";"):
+        host, _, limite = item.strip().rpartition("=")
+        try:
+            quantidade, _, periodo = limite.partition("/")
+            valor = (max(1, int(quantidade)), max(1.0, float(periodo or 60)))
+        except ValueError:
+            continue
+        if not host:
+            padrao = valor
+        elif host.strip().lower() == provedor:
+            return valor
+    return padrao
+
+def limitador_api(url_template):
+    provedor = _provedor_api(url_template)
+    with _lock_limites:
+        if provedor not in _limitadores:
+            _limitadores[provedor] = LimitadorTaxa(provedor, *_limite_configurado(provedor))
+        return _limitadores[provedor]
+
+# Cliente HTTP com conexões persistentes (keep-alive) por host: em lotes de milhares
+# de CNPJs contra o mesmo provedor, abrir uma conexão TLS por consulta fazia o aperto
+# de mão dominar o tempo. Cada host guarda até POOL_HTTP_POR_HOST conexões ociosas;
+# uma conexão reaproveitada que o servidor já fechou é descartada e a requisição é
+# refeita numa nova. As respostas são pedidas e descompactadas em gzip
+POOL_HTTP_POR_HOST = int(os.getenv("CNPJ_API_POOL", str(CONCORRENCIA_API)))
+TIMEOUT_CONEXAO_API = float(os.getenv("CNPJ_API_TIMEOUT_CONEXAO", "10"))
+TIMEOUT_LEITURA_API = float(os.getenv("CNPJ_API_TIMEOUT", "15"))
+OCIOSA_MAX_HTTP = 30  # segundos; servidores costumam fechar conexões paradas há mais tempo
+REDIRECIONAMENTOS_MAX = 5
+
+class ErroHttp(Exception):
+    # Resposta com status de erro; code/reason/headers com os nomes do urllib.error.HTTPError
+    def __init__(self, url, code, reason, headers, corpo=b""):
+        super().__init__(f"HTTP {code}: {reason}")
+        self.url = url
+        self.code = code
+        self.reason = reason
+        self.headers = headers
+        self.corpo = corpo
+
+class ClienteHttp:
+    def __init__(self, por_host=POOL_HTTP_POR_HOST, timeout_conexao=TIMEOUT_CONEXAO_API,
+                 timeout_leitura=TIMEOUT_LEITURA_API):
+        self.por_host = max(0, por_host)
+        self.timeout_conexao = timeout_conexao
+        self.timeout_leitura = timeout_leitura
+        self._lock = threading.Lock()
+        self._ociosas = {}  # (esquema, host, porta) -> [(conexão, devolvida em)]
+        self.requisicoes = 0
+        self.conexoes_novas = 0
+        self.reutilizadas = 0
+        self.descartadas = 0  # reaproveitadas que o servidor já tinha fechado
+        self.bytes_rede = 0
+        self.bytes_corpo = 0
+
+    def _nova_conexao(self, esquema, host, porta):
+        import http.client
+        import urllib.request
+
+        classe = http.client.HTTPSConnection if esquema == "https" else http.client.HTTPConnection
+        proxy = urllib.request.getproxies().get(esquema)
+        if proxy and not urllib.request.proxy_bypass(host):
+            # Proxy do ambiente (HTTPS_PROXY/HTTP_PROXY), como o urlopen fazia
+            import urllib.parse
+
+            destino = urllib.parse.urlsplit(proxy if "://" in proxy else f"http://{proxy}")
+            con = classe(destino.hostname, destino.port, timeout=self.timeout_conexao)
+            con.set_tunnel(host, porta)
+        else:
+            con = classe(host, porta, timeout=self.timeout_conexao)
+        con.connect()
+        con.sock.settimeout(self.timeout_leitura)
+        with self._lock:
+            self.conexoes_novas += 1
+        return con
+
+    def _retirar(self, chave):
+        agora = time.monotonic()
+        with self._lock:
+            ociosas = self._ociosas.get(chave) or []
+            while ociosas:
+                con, devolvida = ociosas.pop()
+                if agora - devolvida < OCIOSA_MAX_HTTP:
+                    self.reutilizadas += 1
+                    return con, True
+                con.close()
+        return self._nova_conexao(*chave), False
+
+    def _devolver(self, chave, con):
+        with self._lock:
+            ociosas = self._ociosas.setdefault(chave, [])
+            if len(ociosas) < self.por_host:
+                ociosas.append((con, time.monotonic()))
+                return
+        con.close()
+
+    def _enviar(self, chave, caminho, cabecalhos):
+        import http.client
+
+        for tentativa in range(2):
+            con, reutilizada = self._retirar(chave)
+            try:
+                con.request("GET", caminho, headers=cabecalhos)
+                resp = con.getresponse()
+                corpo = resp.read()
+            except (ConnectionError, http.client.HTTPException):
+                con.close()
+                if reutilizada and tentativa == 0:
+                    with self._lock:
+                        self.descartadas += 1
+                    continue
+                raise
+            except BaseException:
+                con.close()
+                raise
+            if resp.will_close:
+                con.close()
+            else:
+                self._devolver(chave, con)
+            return resp, corpo
+
+    def obter(self, url, cabecalhos=None):
+        # GET com keep-alive; devolve o corpo já descompactado ou levanta ErroHttp
+        import urllib.parse
+
+        cabecalhos = {"User-Agent": "Mozilla/5.0", "Accept-Encoding": "gzip", **(cabecalhos or {})}
+        for _ in range(REDIRECIONAMENTOS_MAX + 1):
+            partes = urllib.parse.urlsplit(url)
+            esquema = partes.scheme.lower()
+            if esquema not in ("http", "https"):
+                raise ValueError(f"URL não suportada: {url}")
+            chave = (esquema, partes.hostname, partes.port or (443 if esquema == "https" else 80))
+            caminho = (partes.path or "/") + (f"?{partes.query}" if partes.query else "")
+            with self._lock:
+                self.requisicoes += 1
+            resp, corpo = self._enviar(chave, caminho, cabecalhos)
+            tamanho_rede = len(corpo)
+            if resp.getheader("Content-Encoding", "").lower() in ("gzip", "deflate"):
+                corpo = zlib.decompress(corpo, 32 + zlib.MAX_WBITS)  # 32: aceita cabeçalho gzip ou zlib
+            with self._lock:
+                self.bytes_rede += tamanho_rede
+                self.bytes_corpo += len(corpo)
+            if resp.status in (301, 302, 303, 307, 308) and resp.getheader("Location"):
+                url = urllib.parse.urljoin(url, resp.getheader("Location"))
+                continue
+            if resp.status >= 400:
+                raise ErroHttp(url, resp.status, resp.reason, resp.msg, corpo)
+            return corpo
+        raise ErroHttp(url, resp.status, "Redirecionamentos demais", resp.msg)
+
+    def estatisticas(self):
+        with self._lock:
+            conexoes = self.conexoes_novas + self.reutilizadas
+            return {
+                "requisicoes": self.requisicoes,
+                "conexoes_novas": self.conexoes_novas,
+                "reutilizadas": self.reutilizadas,
+                "descartadas": self.descartadas,
+                "taxa_reuso": self.reutilizadas / conexoes if conexoes else 0.0,
+                "bytes_rede": self.bytes_rede,
+                "bytes_corpo": self.bytes_corpo,
+                "ociosas": sum(len(o) for o in self._ociosas.values()),
+            }
+
+    def fechar(self):
+        with self._lock:
+            ociosas, self._ociosas = self._ociosas, {}
+        for lista in ociosas.values():
+            for con, _ in lista:
+                con.close()
+
+_cliente_http = None
+_lock_cliente_http = threading.Lock()
+
+def cliente_http():
+    global _cliente_http
+    with _lock_cliente_http:
+        if _cliente_http is None:
+            _cliente_http = ClienteHttp()
+        return _cliente_http
+
+def estatisticas_http():
+    # Reuso de conexões do cliente da API nesta sessão; None se nada foi consultado
+    with _lock_cliente_http:
+        return _cliente_http.estatisticas() if _cliente_http is not None else None
+
+def fechar_cliente_http():
+    global _cliente_http
+    with _lock_cliente_http:
+        if _cliente_http is not None:
+            _cliente_http.fechar()
+            _cliente_http = None
+
+# Consultas simultâneas à mesma URL (a consulta avulsa e um lote, dois lotes, filiais
+# que dividem o CNPJ) viram uma só: a primeira vai à rede e as demais esperam por ela
+class ChamadaUnica:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._em_voo = {}  # chave -> Future da chamada em andamento
+        self.coalescidas = 0
+
+    def executar(self, chave, funcao, tarefa=None, esperar=True):
+        # Devolve (resultado, se foi a chamada que executou). Com esperar=False quem encontra
+        # a chamada em andamento não fica preso a ela (que pode estar esperando o limitador)
+        # e executa por conta própria
+        while True:
+            with self._lock:
+                futuro = self._em_voo.get(chave)
+                if futuro is None:
+                    futuro = self._em_voo[chave] = Future()
+                    break
+                if not esperar:
+                    futuro = None
+                    break
+                self.coalescidas += 1
+            while not futuro.done():
+                if tarefa:
+                    tarefa.verificar_cancelamento()
+                wait((futuro,), timeout=0.5)
+            try:
+                return futuro.result(), False
+            except (TarefaCancelada, LimiteApiExcedido):
+                # Cancelamento ou limite atingido são da outra chamada (uma consulta avulsa
+                # não espera pelo limitador): tenta de novo, agora no próprio modo
+                continue
+        if futuro is None:
+            return funcao(), True
+        try:
+            resultado = funcao()
+        except BaseException as e:
+            futuro.set_exception(e)
+            raise
+        else:
+            futuro.set_result(resultado)
+            return resultado, True
+        finally:
+            with self._lock:
+                del self._em_voo[chave]
+
+_consultas_cnpj = ChamadaUnica()
+
+def _segundos_retry_after(valor):
+    # Retry-After vem em segundos ou como data HTTP
+    if not valor:
+        return None
+    try:
+        return max(0.0, float(valor))
+    except ValueError:
+        pass
+    from email.utils import parsedate_to_datetime
+
+    try:
+        return max(0.0, parsedate_to_datetime(valor).timestamp() - time.time())
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
+
+def _recuo_api(tentativa):
+    # Recuo exponencial com variação total: threads que falharam juntas não voltam juntas
+    return random.uniform(0, min(RECUO_MAX_API, RECUO_BASE_API * 2 ** tentativa))
+
+def _esperar_api(segundos, tarefa=None):
+    fim = time.monotonic() + segundos
+    while True:
+        if tarefa:
+            tarefa.verificar_cancelamento()
+        resta = fim - time.monotonic()
+        if resta <= 0:
+            return
+        time.sleep(min(resta, 0.5))
+
+def _resposta_cnpj_valida(data):
+    return isinstance(data, dict) and bool(data.get("razao_social") or data.get("cnpj"))
+
+def consultar_cnpj_api(cnpj, url_template, limitador=None, tarefa=None, esperar=True):
+    # (dados da API, veio do cache); só consultas que vão à rede gastam ficha do limitador.
+    # CNPJ sem dados levanta CnpjSemDados, também quando vem do cache negativo
+    cache = cache_cnpj()
+    data = cache.obter(cnpj)
+    if data is not None:
+        return data, True
+    motivo = cache.obter_negativo(cnpj)
+    if motivo is not None:
+        raise CnpjSemDados(cnpj, motivo, do_cache=True)
+
+    def requisitar():
+        import http.client
+
+        tentativa = pausas = 0
+        while True:
+            if limitador is not None:
+                if esperar:
+                    limitador.aguardar(tarefa)
+                else:
+                    espera = limitador.tentar()
+                    if espera:
+                        raise LimiteApiExcedido(espera)
+            try:
+                return cliente_http().obter(url, {"Accept": "application/json"})
+            except ErroHttp as e:
+                if e.code not in STATUS_REPETIR_API:
+                    raise
+                erro, espera = e, _segundos_retry_after(e.headers.get("Retry-After") if e.headers else None)
+                if e.code == 429:
+                    pausas += 1
+                    pausa = espera if espera is not None else _recuo_api(pausas)
+                    if limitador is not None:
+                        limitador.pausar(pausa)
+                    if not esperar:
+                        raise LimiteApiExcedido(pausa) from e
+                    # Pausa não gasta tentativa: o lote só para se for cancelado
+                    if tarefa:
+                        tarefa.reportar(texto=f"API pediu pausa: retomando em {int(pausa) + 1} s...")
+                    if limitador is None:
+                        _esperar_api(pausa, tarefa)
+                    continue
+            except (OSError, http.client.HTTPException) as e:
+                erro, espera = e, None
+            tentativa += 1
+            if tentativa >= TENTATIVAS_API:
+                raise erro
+            _esperar_api(espera if espera is not None else _recuo_api(tentativa), tarefa)
+
+    def consultar():
+        try:
+            corpo = requisitar()
+        except ErroHttp as e:
+            if e.code not in STATUS_SEM_DADOS_API:
+                raise
+            cache.gravar_negativo(cnpj, f"HTTP {e.code}")
+            raise CnpjSemDados(cnpj, f"HTTP {e.code}") from e
+        try:
+            dados = json.loads(corpo.decode("utf-8"))
+        except ValueError:
+            dados = None
+        if not _resposta_cnpj_valida(dados):
+            cache.gravar_negativo(cnpj, "resposta inválida")
+            raise CnpjSemDados(cnpj, "resposta inválida")
+        cache.gravar(cnpj, dados)
+        return dados
+
+    # Substituir URL fixa por template configurável
+    url = _build_api_url(url_template, cnpj)
+    data, executou = _consultas_cnpj.executar(url, consultar, tarefa, esperar)
+    # Quem pegou carona na consulta de outra thread não foi à rede: conta como cache
+    return data, not executou
+
+def extrair_dados_cnpj(data):
+    # === Extrair TODOS os dados da BrasilAPI ===
+    estabelecimento = data.get("estabelecimento", {}) or {}
+    fantasia = data.get("nome_fantasia", "") or estabelecimento.get("nome_fantasia", "")
+
+    # Telefones
+    ddd1 = estabelecimento.get("ddd1", "")
+    tel1 = estabelecimento.get("telefone1", "")
+    ddd2 = estabelecimento.get("ddd2", "")
+    tel2 = estabelecimento.get("telefone2", "")
+
+    # Endereço completo
+    tipo_logradouro = estabelecimento.get("tipo_logradouro", "")
+    logradouro = estabelecimento.get("logradouro", "")
+    numero = estabelecimento.get("numero", "")
+    nome_rua = f"{tipo_logradouro} {logradouro}".strip() if tipo_logradouro else logradouro
+    if numero:
+        nome_rua = f"{nome_rua}, {numero}" if nome_rua else numero
+
+    # Cidade/Estado
+    cidade = estabelecimento.get("cidade", {})
+    estado = estabelecimento.get("estado", {})
+
+    return {
+        "nome": data.get("razao_social", ""),
+        "fantasia": fantasia,
+        "email": normalizar_email(estabelecimento.get("email", "")),
+        "fone1": normalizar_fone(f"{ddd1}{tel1}"),
+        "fone2": normalizar_fone(f"{ddd2}{tel2}"),
+        "nome_rua": nome_rua,
+        "numero": numero,
+        "complemento": estabelecimento.get("complemento", ""),
+        "bairro": estabelecimento.get("bairro", ""),
+        "municipio": cidade.get("nome", "") if isinstance(cidade, dict) else "",
+        "cod_municipio": cidade.get("ibge_id", "") if isinstance(cidade, dict) else "",
+        "uf": estado.get("sigla", "") if isinstance(estado, dict) else "",
+        "cep": normalizar_cep(estabelecimento.get("cep", "")),
+        # Dados adicionais
+        "situacao_cadastral": data.get("descricao_situacao_cadastral", ""),
+        "data_situacao": data.get("data_situacao_cadastral", ""),
+        "natureza_juridica": data.get("natureza_juridica", ""),
+        "porte": data.get("porte", ""),
+        "data_abertura": data.get("data_inicio_atividade", ""),
+        "cnae_fiscal": str(data.get("cnae_fiscal", "")),
+        "cnae_fiscal_descricao": data.get("cnae_fiscal_descricao", ""),
+    }
+
+def campos_atualizacao_cnpj(dados, colunas):
+    # [(campo, valor)] a gravar na PESSOA, cortados ao tamanho de cada coluna
+    def limitar(valor, campo, padrao):
+        info = colunas.get(campo)
+        return valor[:(info["tamanho"] if info and info["tamanho"] else padrao)] if valor else ""
+
+    # Campos básicos obrigatórios
+    campos_update = [
+        ("NOME", limitar(dados["nome"], "NOME", 100)),
+        ("NOMEFANTASIA", limitar(dados["fantasia"], "NOMEFANTASIA", 100)),
+        ("EMAIL", limitar(dados["email"], "EMAIL", 100)),
+        ("FONE1", dados["fone1"]),
+        ("NOME_RUA", limitar(dados["nome_rua"], "NOME_RUA", 100)),
+        ("RUA_NUMERO", dados["numero"]),
+        ("COMPLEMENTO", limitar(dados["complemento"], "COMPLEMENTO", 50)),
+        ("BAIRRO", limitar(dados["bairro"], "BAIRRO", 50)),
+        ("CEP", dados["cep"]),
+    ]
+
+    # Adicionar FONE2 se existir
+    if "FONE2" in colunas and dados["fone2"]:
+        campos_update.append(("FONE2", dados["fone2"]))
+
+    # Adicionar flag API se existir
+    if "ATUALIZADO_API" in colunas:
+        campos_update.append(("ATUALIZADO_API", "S"))
+
+    # Verificar e adicionar campos opcionais
+    campos_opcionais = [
+        ("MUNICIPIO", dados["municipio"]),
+        ("UF", dados["uf"]),
+        ("COD_MUNICIPIO", dados["cod_municipio"]),
+        ("SITUACAO_CADASTRAL", dados["situacao_cadastral"]),
+        ("DATA_SITUACAO", dados["data_situacao"]),
+        ("NATUREZA_JURIDICA", dados["natureza_juridica"]),
+        ("PORTE", dados["porte"]),
+        ("DATA_ABERTURA", dados["data_abertura"]),
+        ("CNAE_FISCAL", dados["cnae_fiscal"]),
+        ("CNAE_DESCRICAO", dados["cnae_fiscal_descricao"]),
+    ]
+    for campo, valor in campos_opcionais:
+        if valor and campo in colunas:
+            campos_update.append((campo, valor))
+    return campos_update
+
+def gravar_campos_cnpj(cur, atualizacoes):
+    # atualizacoes: [(cods, [(campo, valor)])]; os cadastros do mesmo CNPJ recebem os
+    # valores num só UPDATE ... WHERE CODPESSOA IN (...), e os comandos de mesmo texto
+    # (mesmos campos, mesmo número de cadastros) vão juntos num executemany
+    por_comando = {}
+    for cods, campos_update in atualizacoes:
+        cols = tuple(campo for campo, _ in campos_update)
+        valores = [valor for _, valor in campos_update]
+        # Firebird limita a 1500 itens por IN
+        for i in range(0, len(cods), 1000):
+            lote = [int(cod) for cod in cods[i:i + 1000]]
+            por_comando.setdefault((cols, len(lote)), []).append(valores + lote)
+    for (cols, quantidade), params in por_comando.items():
+        set_clause = ", ".join(f"{campo}=COALESCE(?, {campo})" for campo in cols)
+        onde = "CODPESSOA=?" if quantidade == 1 else f"CODPESSOA IN ({', '.join('?' * quantidade)})"
+        cur.executemany(f"UPDATE PESSOA SET {set_clause} WHERE {onde}", params)
+
+def mensagem_dados_cnpj(dados):
+    # Mensagem detalhada de sucesso
+    info_msg = "✅ Cadastro atualizado via API BrasilAPI\n\n"
+    info_msg += "📋 DADOS CADASTRAIS\n"
+    info_msg += f"Razão Social: {dados['nome'] or 'N/A'}\n"
+    info_msg += f"Nome Fantasia: {dados['fantasia'] or 'N/A'}\n"
+    if dados["situacao_cadastral"]:
+        info_msg += f"Situação: {dados['situacao_cadastral']}\n"
+    if dados["cnae_fiscal"]:
+        info_msg += f"CNAE: {dados['cnae_fiscal']}"
+        if dados["cnae_fiscal_descricao"]:
+            info_msg += f" - {dados['cnae_fiscal_descricao']}"
+        info_msg += "\n"
+
+    info_msg += "\n📍 ENDEREÇO\n"
+    info_msg += f"{dados['nome_rua'] or 'N/A'}\n"
+    if dados["bairro"]:
+        info_msg += f"Bairro: {dados['bairro']}\n"
+    info_msg += f"Cidade/UF: {dados['municipio'] or 'N/A'}/{dados['uf'] or 'N/A'}\n"
+    if dados["cep"]:
+        info_msg += f"CEP: {dados['cep']}\n"
+
+    info_msg += "\n📞 CONTATO\n"
+    if dados["fone1"]:
+        info_msg += f"Telefone 1: {dados['fone1']}\n"
+    if dados["fone2"]:
+        info_msg += f"Telefone 2: {dados['fone2']}\n"
+    info_msg += f"Email: {dados['email'] or 'N/A'}"
+    return info_msg
+
+# Enriquecimento em massa: consultas em paralelo num pool de threads (cada uma espera
+# a vez no limitador do provedor) e gravação em lotes numa conexão curta por lote.
+# Cada CNPJ é consultado uma vez só e a resposta vale para todos os cadastros que o
+# compartilham (filiais, duplicados). Falhas de um CNPJ não interrompem os demais;
+# cancelar grava o que já chegou
+def enriquecer_cnpjs(abrir_conexao, dsn, cadastros, url_template, tarefa,
+                     concorrencia=CONCORRENCIA_API, tamanho_lote=TAMANHO_LOTE_API):
+    # cadastros: [(cod, cnpj)]; devolve o resumo com {cod: campos gravados} e as falhas
+    limitador = limitador_api(url_template)
+    por_cnpj = {}
+    for cod, cnpj in cadastros:
+        por_cnpj.setdefault(cnpj, []).append(cod)
+    resumo = {
+        "atualizados": {}, "falhas": [], "do_cache": 0, "sem_dados": 0,
+        "total": len(cadastros), "consultas": len(por_cnpj),
+    }
+    conexoes_antes = cliente_http().estatisticas()
+    inicio = time.monotonic()
+    pendentes = []
+
+    def gravar():
+        if not pendentes:
+            return
+        with abrir_conexao() as con:
+            colunas = colunas_pessoa(con, dsn)
+            atualizacoes = [(cods, campos_atualizacao_cnpj(dados, colunas)) for cods, dados in pendentes]
+            gravar_campos_cnpj(con.cursor(), atualizacoes)
+            con.commit()
+        for cods, campos_update in atualizacoes:
+            campos = {c: v for c, v in campos_update if v is not None}
+            for cod in cods:
+                resumo["atualizados"][cod] = campos
+        pendentes.clear()
+
+    pool = ThreadPoolExecutor(max_workers=max(1, concorrencia), thread_name_prefix="cnpj")
+    try:
+        futuros = {
+            pool.submit(consultar_cnpj_api, cnpj, url_template, limitador, tarefa): cnpj
+            for cnpj in por_cnpj
+        }
+        for feitos, futuro in enumerate(as_completed(futuros), 1):
+            cods = por_cnpj[futuros[futuro]]
+            try:
+                data, do_cache = futuro.result()
+                pendentes.append((cods, extrair_dados_cnpj(data)))
+                resumo["do_cache"] += do_cache
+            except TarefaCancelada:
+                raise
+            except CnpjSemDados as e:
+                resumo["falhas"].extend((cod, str(e)) for cod in cods)
+                resumo["sem_dados"] += 1
+                resumo["do_cache"] += e.do_cache
+            except Exception as e:
+                resumo["falhas"].extend((cod, str(e)) for cod in cods)
+            if len(pendentes) >= tamanho_lote:
+                gravar()
+            tarefa.reportar(feitos, len(por_cnpj), _texto_progresso_api(feitos, len(por_cnpj), inicio))
+        gravar()
+    except TarefaCancelada:
+        pool.shutdown(wait=True, cancel_futures=True)
+        gravar()
+        raise
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+    resumo["segundos"] = time.monotonic() - inicio
+    conexoes = cliente_http().estatisticas()
+    resumo["conexoes_novas"] = conexoes["conexoes_novas"] - conexoes_antes["conexoes_novas"]
+    resumo["reutilizadas"] = conexoes["reutilizadas"] - conexoes_antes["reutilizadas"]
+    return resumo
+
+def _texto_progresso_api(feitos, total, inicio):
+    decorrido = max(time.monotonic() - inicio, 1e-6)
+    por_minuto = feitos * 60 / decorrido
+    restante = str(timedelta(seconds=int((total - feitos) * decorrido / feitos))) if feitos else "--"
+    return f"Enriquecendo CNPJs: {feitos}/{total} · {por_minuto:.1f}/min · restante {restante}"
+
 if __name__ == "__main__":
-    launch_gui()
\ No newline at end of file
+    launch_gui(medir_inicio="--medir-inicio" in sys.argv[1:])
\ No newline at end of file